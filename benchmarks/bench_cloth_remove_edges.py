@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021 UuuNyaa <UuuNyaa@gmail.com>
+# This file is part of MMD UuuNyaa Tools.
+
+"""Times the stages of RigidBodyToClothConverter that run without Blender on rigid body grids.
+
+partition is the joint graph split of convert_batch, collect_joints and clean_mesh are the first
+stages printed by convert. clean_mesh is also compared with the nested loop it replaced.
+build_cloth_mesh and bind_mmd_mesh need bmesh.ops and bpy.ops, read their timings from the
+console output of convert in Blender.
+
+Usage: python benchmarks/bench_cloth_remove_edges.py [repeat]
+"""
+
+import sys
+import timeit
+import types
+from typing import List, Tuple
+
+from loader import TypeNamespace, load_module
+
+
+class BMVert:
+    def __init__(self, index: int):
+        self.index = index
+
+
+class BMEdge:
+    def __init__(self, vert0: BMVert, vert1: BMVert):
+        self.verts = (vert0, vert1)
+        self.seq_index = -1
+
+
+class BMEdgeSeq(list):
+    def __init__(self, edges: List[BMEdge]):
+        super().__init__(edges)
+        for index, edge in enumerate(edges):
+            edge.seq_index = index
+
+    def remove(self, edge: BMEdge):
+        # BMEdgeSeq.remove is O(1), unlike list.remove
+        self[edge.seq_index] = None
+
+
+class BMesh:
+    def __init__(self, verts: List[BMVert], edges: List[BMEdge]):
+        self.verts = verts
+        self.edges = BMEdgeSeq(edges)
+
+    def edge_count(self) -> int:
+        return sum(1 for e in self.edges if e is not None)
+
+
+def new_grid(size: int) -> Tuple[BMesh, List[Tuple[int, int]]]:
+    """A skirt of size x size rigid bodies, the joints and the diagonals holes_fill would add."""
+    verts = [BMVert(i) for i in range(size * size)]
+
+    joint_edges: List[Tuple[int, int]] = []
+    diagonal_edges: List[Tuple[int, int]] = []
+    for y in range(size):
+        for x in range(size):
+            i = y * size + x
+            if x + 1 < size:
+                joint_edges.append((i + 1, i))
+            if y + 1 < size:
+                joint_edges.append((i, i + size))
+            if x + 1 < size and y + 1 < size:
+                diagonal_edges.append((i, i + size + 1))
+
+    edges = [BMEdge(verts[i0], verts[i1]) for i0, i1 in joint_edges + diagonal_edges]
+    return BMesh(verts, edges), joint_edges
+
+
+class Object:
+    """bpy.types.Object is hashed by identity."""
+
+    def __init__(self, name: str, **kwargs):
+        self.name = name
+        self.__dict__.update(kwargs)
+
+
+def new_objects(size: int, joint_edges: List[Tuple[int, int]]) -> Tuple[List[Object], List[Object]]:
+    """The rigid bodies of the grid and the joints between them, with a side joint on every top rigid body."""
+    rigid_body_objects = [Object(f'rigid_body{i}') for i in range(size * size)]
+    joint_objects = [
+        Object(f'joint{i0}_{i1}', rigid_body_constraint=types.SimpleNamespace(object1=rigid_body_objects[i0], object2=rigid_body_objects[i1]))
+        for i0, i1 in joint_edges
+    ]
+    parent_object = Object('parent')
+    joint_objects.extend(
+        Object(f'side_joint{i}', rigid_body_constraint=types.SimpleNamespace(object1=parent_object, object2=rigid_body_objects[i]))
+        for i in range(size)
+    )
+    return rigid_body_objects, joint_objects
+
+
+def remove_edges_nested_loop(cloth_bm: BMesh, save_edges: List[Tuple[int, int]]):
+    # the implementation before the joint pairs were hashed
+    for index, edge in enumerate(cloth_bm.edges):
+        if edge is None:
+            continue
+
+        is_save_edge = False
+        for i in save_edges:
+            if edge.verts[0].index in i and edge.verts[1].index in i:
+                is_save_edge = True
+                break
+
+        if not is_save_edge:
+            cloth_bm.edges[index] = None
+
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 1
+
+    rigid_body_to_cloth = load_module('converters/physics/rigid_body_to_cloth.py', {
+        'bmesh': {'types': TypeNamespace(), 'ops': types.SimpleNamespace(holes_fill=lambda bm, edges, sides: None)},
+        'bpy': {'types': TypeNamespace()},
+        'mmd_uuunyaa_tools.editors.meshes': {'MeshEditor': None},
+        'mmd_uuunyaa_tools.m17n': {'_': lambda text: text, 'iface_': lambda text: text},
+        'mmd_uuunyaa_tools.utilities': {'MessageException': Exception, 'import_mmd_tools': None},
+    })
+    converter = rigid_body_to_cloth.RigidBodyToClothConverter
+    clean_mesh = converter.clean_mesh
+
+    print(f'{"grid":>9} {"edges":>7} {"joints":>7} {"partition":>10} {"collect_joints":>15} {"clean_mesh":>11} {"nested loop":>12} {"speedup":>8}')
+    for size in (10, 25, 50, 75, 100):
+        cloth_bm, joint_edges = new_grid(size)
+        edge_count = len(cloth_bm.edges)
+        rigid_body_objects, joint_objects = new_objects(size, joint_edges)
+        rigid_body_index_dict = {obj: i for i, obj in enumerate(rigid_body_objects)}
+
+        partition_time = min(timeit.repeat(lambda: converter.partition_rigid_bodies(rigid_body_objects, joint_objects), repeat=repeat, number=1))
+        assert len(converter.partition_rigid_bodies(rigid_body_objects, joint_objects)) == 1
+
+        collect_joints_time = min(timeit.repeat(lambda: converter.collect_joints(joint_objects, rigid_body_index_dict), repeat=repeat, number=1))
+        assert converter.collect_joints(joint_objects, rigid_body_index_dict)[1] == joint_edges
+
+        def run(function):
+            timer = timeit.Timer(
+                lambda: function(cloth_bm, joint_edges),
+                setup=lambda: setattr(cloth_bm, 'edges', BMEdgeSeq(new_grid(size)[0].edges)),
+            )
+            return min(timer.repeat(repeat, 1))
+
+        nested_loop_time = run(remove_edges_nested_loop)
+        assert cloth_bm.edge_count() == len(joint_edges)
+
+        hashed_time = run(clean_mesh)
+        assert cloth_bm.edge_count() == len(joint_edges)
+
+        print(
+            f'{size:>4}x{size:<4} {edge_count:>7} {len(joint_edges):>7}'
+            f' {partition_time:>9.4f}s {collect_joints_time:>14.4f}s {hashed_time:>10.4f}s {nested_loop_time:>11.4f}s {nested_loop_time / hashed_time:>7.1f}x'
+        )
+
+
+if __name__ == '__main__':
+    main()
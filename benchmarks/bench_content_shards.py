@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021 UuuNyaa <UuuNyaa@gmail.com>
+# This file is part of MMD UuuNyaa Tools.
+
+"""Compares ContentShards with a content map guarded by a single lock.
+
+Usage: python benchmarks/bench_content_shards.py [operation_count]
+"""
+
+import hashlib
+import itertools
+import random
+import sys
+import threading
+import time
+import types
+from typing import Dict, List, Optional
+
+from loader import load_module
+
+
+class SingleLockContents:
+    """The content map before it was sharded, one lock guards every access."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._contents: Dict[str, object] = {}
+        self._touch_counts: Dict[str, int] = {}
+        self._touch_counter = itertools.count()
+
+    def get(self, content_id: str) -> Optional[object]:
+        with self._lock:
+            return self._contents.get(content_id)
+
+    def touch(self, content_id: str) -> Optional[object]:
+        with self._lock:
+            content = self._contents.get(content_id)
+            if content is not None:
+                self._touch_counts[content_id] = next(self._touch_counter)
+            return content
+
+    def put(self, content):
+        with self._lock:
+            self._contents[content.id] = content
+            self._touch_counts[content.id] = next(self._touch_counter)
+
+    def to_list(self) -> List[object]:
+        with self._lock:
+            touch_counted_contents = [(self._touch_counts[i], c) for i, c in self._contents.items()]
+            touch_counted_contents.sort(key=lambda e: e[0])
+        return [c for _, c in touch_counted_contents]
+
+
+def run(contents, content_ids: List[str], thread_count: int, operation_count: int, scan: bool) -> float:
+    """Returns the operations per second of thread_count threads doing mostly lookups.
+
+    With scan, another thread lists the contents in the least recently used order meanwhile, as the eviction does.
+    """
+    barrier = threading.Barrier(thread_count + 1)
+    finished = threading.Event()
+
+    def scan_contents():
+        while not finished.is_set():
+            contents.to_list()
+
+    def work(seed: int):
+        rng = random.Random(seed)
+        operations = [(rng.random(), rng.choice(content_ids)) for _ in range(operation_count)]
+        barrier.wait()
+        for choice, content_id in operations:
+            if choice < 0.6:
+                contents.get(content_id)
+            elif choice < 0.95:
+                contents.touch(content_id)
+            else:
+                contents.put(types.SimpleNamespace(id=content_id))
+
+    threads = [threading.Thread(target=work, args=(i,)) for i in range(thread_count)]
+    for thread in threads:
+        thread.start()
+
+    scan_thread = threading.Thread(target=scan_contents) if scan else None
+    if scan_thread is not None:
+        scan_thread.start()
+
+    barrier.wait()
+    start_time = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed_time = time.perf_counter() - start_time
+
+    finished.set()
+    if scan_thread is not None:
+        scan_thread.join()
+
+    return thread_count * operation_count / elapsed_time
+
+
+def main():
+    operation_count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+
+    cache = load_module('asset_search/cache.py', {
+        'requests': {'models': types.SimpleNamespace(Response=object)},
+        'mmd_uuunyaa_tools': {'REGISTER_HOOKS': [], 'UNREGISTER_HOOKS': []},
+        'mmd_uuunyaa_tools.asset_search.url_resolvers': {'URLResolver': object, 'URLResolverABC': object},
+        'mmd_uuunyaa_tools.utilities': {'get_preferences': None},
+    })
+
+    content_ids = [hashlib.sha1(str(i).encode()).hexdigest() for i in range(10000)]
+
+    print(f'{"scan":>5} {"threads":>7} {"single lock":>14} {"sharded":>14} {"ratio":>6}')
+    for scan in (False, True):
+        for thread_count in (1, 2, 4, 8, 16):
+            results = []
+            for contents in (SingleLockContents(), cache.ContentShards()):
+                for content_id in content_ids:
+                    contents.put(types.SimpleNamespace(id=content_id))
+                results.append(run(contents, content_ids, thread_count, operation_count // thread_count, scan))
+
+            single_lock, sharded = results
+            print(f'{str(scan):>5} {thread_count:>7} {single_lock:>10.0f} op/s {sharded:>10.0f} op/s {sharded / single_lock:>5.2f}x')
+
+
+if __name__ == '__main__':
+    main()
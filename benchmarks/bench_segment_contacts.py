@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021 UuuNyaa <UuuNyaa@gmail.com>
+# This file is part of MMD UuuNyaa Tools.
+
+"""Compares segmentation._calc_segment_contacts_batched with the BMesh builder _calc_segment_contacts.
+
+The meshes are the triangulated grids of tests/test_editors_segmentation.py.
+mathutils and bpy_prop_collection.foreach_get are C code in Blender, here they are replaced by
+NumPy fakes, so the absolute timings are slower than in Blender and the speedup is only indicative.
+
+Usage: python benchmarks/bench_segment_contacts.py [repeat]
+"""
+
+import os
+import sys
+import timeit
+import types
+
+import numpy as np
+
+from loader import TypeNamespace, load_module
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tests'))
+
+from test_editors_segmentation import GridMesh, Vector, area_tri  # noqa: E402 pylint: disable=wrong-import-position
+
+
+class PreparedCollection:
+    """Reads the attributes once, so that foreach_get is a copy like in Blender."""
+
+    def __init__(self, collection):
+        self._length = len(collection)
+        self._collection = collection
+        self._arrays = {}
+
+    def __len__(self) -> int:
+        return self._length
+
+    def foreach_get(self, attribute: str, array: np.ndarray):
+        if attribute not in self._arrays:
+            self._arrays[attribute] = array.copy()
+            self._collection.foreach_get(attribute, self._arrays[attribute])
+        array[:] = self._arrays[attribute]
+
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+
+    segmentation = load_module('editors/segmentation.py', {
+        'bmesh': {'types': TypeNamespace()},
+        'bpy': {'types': TypeNamespace()},
+        'mathutils': {'Vector': Vector, 'geometry': types.SimpleNamespace(area_tri=area_tri)},
+        'mmd_uuunyaa_tools.m17n': {'_': lambda text: text},
+    })
+    cost_factors = (1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0)
+
+    print(f'{"grid":>9} {"faces":>7} {"contacts":>9} {"bmesh":>10} {"batched":>10} {"speedup":>8}')
+    for size in (16, 32, 64, 96):
+        test_mesh = GridMesh(0, size=size, select_ratio=1.0)
+        bmesh_mesh = types.SimpleNamespace(verts=test_mesh.verts)
+        mesh = test_mesh.to_mesh()
+        mesh = types.SimpleNamespace(**{name: PreparedCollection(getattr(mesh, name)) for name in ('polygons', 'loops', 'edges', 'vertices')})
+        vertex_group_weights = segmentation._read_vertex_group_weights(test_mesh.to_bmesh(), set())  # pylint: disable=protected-access
+
+        def run_bmesh():
+            vi2vgi2weights = segmentation._calc_vi2vgi2weights(bmesh_mesh, vertex_group_weights)  # pylint: disable=protected-access
+            return segmentation._calc_segment_contacts(*cost_factors, vi2vgi2weights, bmesh_mesh, test_mesh.tri_loops)  # pylint: disable=protected-access
+
+        def run_batched():
+            return segmentation._calc_segment_contacts_batched(*cost_factors, vertex_group_weights, mesh, test_mesh.tri_loops)  # pylint: disable=protected-access
+
+        bmesh_contacts, _ = run_bmesh()
+        batched_contacts, _ = run_batched()
+        assert list(batched_contacts.keys()) == list(bmesh_contacts.keys())
+
+        bmesh_time = min(timeit.repeat(run_bmesh, repeat=repeat, number=1))
+        batched_time = min(timeit.repeat(run_batched, repeat=repeat, number=1))
+
+        print(f'{size:>4}x{size:<4} {len(test_mesh.faces):>7} {len(bmesh_contacts):>9} {bmesh_time:>9.4f}s {batched_time:>9.4f}s {bmesh_time / batched_time:>7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
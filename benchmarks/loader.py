@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021 UuuNyaa <UuuNyaa@gmail.com>
+# This file is part of MMD UuuNyaa Tools.
+
+import importlib.util
+import os
+import sys
+import types
+from typing import Any, Dict
+
+PACKAGE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'mmd_uuunyaa_tools')
+
+
+class TypeNamespace:
+    """bpy.types and bmesh.types are only used in the annotations."""
+
+    def __getattr__(self, name: str) -> type:
+        return type(name, (), {})
+
+
+def load_module(relative_path: str, stub_modules: Dict[str, Dict[str, Any]]) -> types.ModuleType:
+    """Loads a module of the add-on without Blender, the modules it imports are replaced with the given stubs."""
+    for name, attributes in stub_modules.items():
+        stub_module = types.ModuleType(name)
+        stub_module.__dict__.update(attributes)
+        sys.modules[name] = stub_module
+
+    module_name = 'mmd_uuunyaa_tools_benchmark_' + os.path.splitext(relative_path)[0].replace('/', '_')
+    spec = importlib.util.spec_from_file_location(module_name, os.path.join(PACKAGE_PATH, relative_path))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+    return module
@@ -3,24 +3,34 @@
 # This file is part of MMD UuuNyaa Tools.
 
 import ast
+import dataclasses
 import errno
 import functools
-import importlib
+import importlib.util
 import json
 import os
+import posixpath
+import queue
 import re
 import shutil
 import stat
+import tempfile
+import threading
+import traceback
 import urllib
 import zipfile
-from typing import List, Optional
+from concurrent.futures import Future, ThreadPoolExecutor
+from enum import Enum
+from types import ModuleType
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
 
 import bpy
 import requests
-from mmd_uuunyaa_tools import PACKAGE_PATH
+from mmd_uuunyaa_tools import PACKAGE_PATH, REGISTER_HOOKS, UNREGISTER_HOOKS
 from mmd_uuunyaa_tools.asset_search.assets import AssetDescription, _Utilities
+from mmd_uuunyaa_tools.asset_search.sessions import SESSIONS
 from mmd_uuunyaa_tools.m17n import _
-from mmd_uuunyaa_tools.utilities import MessageException
+from mmd_uuunyaa_tools.utilities import MessageException, get_preferences, snapshot_preferences, use_preferences_snapshot
 
 
 class RestrictionChecker(ast.NodeVisitor):
@@ -43,11 +53,11 @@ class RestrictionChecker(ast.NodeVisitor):
 class DownloadActionExecutor:
     @staticmethod
     def get(url: str) -> requests.models.Response:
-        return requests.get(url, allow_redirects=True, stream=True)
+        return SESSIONS.session.get(url, allow_redirects=True, stream=True)
 
     @staticmethod
     def tstorage(url: str, password: str = None) -> requests.models.Response:
-        return requests.post(
+        return SESSIONS.session.post(
             url,
             data={
                 'op': 'download2',
@@ -64,7 +74,7 @@ class DownloadActionExecutor:
 
     @staticmethod
     def smutbase(url: str) -> requests.models.Response:
-        session = requests.Session()
+        session = SESSIONS.new_session()
         response = session.get(url, allow_redirects=True)
         response.raise_for_status()
 
@@ -76,7 +86,7 @@ class DownloadActionExecutor:
 
     @staticmethod
     def bowlroll(url: str, password: str = None) -> requests.models.Response:
-        session = requests.Session()
+        session = SESSIONS.new_session()
         response = session.get(url)
         response.raise_for_status()
 
@@ -117,7 +127,7 @@ class DownloadActionExecutor:
 
         download_url = urllib.parse.urljoin(url, '/uc')
 
-        session = requests.Session()
+        session = SESSIONS.new_session()
         response = session.get(download_url, params={'id': file_id}, stream=True)
         response.raise_for_status()
 
@@ -143,7 +153,7 @@ class DownloadActionExecutor:
         file_id = match.groups()[0]
         download_url = f'https://api.onedrive.com/v1.0/shares/{file_id}/root/content'
 
-        session = requests.Session()
+        session = SESSIONS.new_session()
         return session.get(
             download_url,
             stream=True,
@@ -153,7 +163,7 @@ class DownloadActionExecutor:
     @staticmethod
     def uploader(url: str, password=None) -> requests.models.Response:
         error_message = _('Failed to download assets from uploader.jp. The response format may have changed.')
-        session = requests.Session()
+        session = SESSIONS.new_session()
 
         if password is None:
             response = session.get(url)
@@ -200,9 +210,440 @@ class DownloadActionExecutor:
         )
 
 
+class ExtractionProgress:
+    def __init__(self):
+        self.total_size = 0
+        self.extracted_size = 0
+        self.canceled = False
+        self._lock = threading.Lock()
+
+    def add(self, size: int):
+        with self._lock:
+            self.extracted_size += size
+
+    def cancel(self):
+        self.canceled = True
+
+    def check_canceled(self):
+        if self.canceled:
+            raise InterruptedError('extraction was canceled')
+
+
+class ZipExtractor:
+    CHUNK_SIZE = 1024*1024
+    LARGE_MEMBER_SIZE = 4*1024*1024
+
+    def __init__(self, zip_file_path: str, encoding: str = 'cp437', password: Optional[str] = None, max_workers: int = 4, progress: Optional[ExtractionProgress] = None):
+        # pylint: disable=too-many-arguments
+        self.zip_file_path = zip_file_path
+        self.encoding = encoding
+        self.pwd = password.encode() if password else None
+        self.max_workers = max_workers
+        self.progress = ExtractionProgress() if progress is None else progress
+
+    def namelist(self) -> List[str]:
+        with zipfile.ZipFile(self.zip_file_path) as zip_file:
+            return [self._decode_filename(info).filename for info in zip_file.infolist()]
+
+    def extract(self, asset_path: str, member_names: Optional[Iterable[str]] = None):
+        asset_path = os.path.normpath(asset_path)
+        asset_dir = os.path.dirname(asset_path)
+        os.makedirs(asset_dir, exist_ok=True)
+
+        # unique per extraction, the concurrent extractions into the same folder must not share it
+        staging_path = tempfile.mkdtemp(prefix=f'.{os.path.basename(asset_path)}.', suffix='.extracting', dir=asset_dir)
+        try:
+            with zipfile.ZipFile(self.zip_file_path) as zip_file:
+                infos = [self._decode_filename(info) for info in zip_file.infolist()]
+                if member_names is not None:
+                    member_names = set(member_names)
+                    infos = [info for info in infos if info.filename in member_names]
+                self.progress.total_size = sum(info.file_size for info in infos)
+
+                large_infos = [info for info in infos if info.file_size >= self.LARGE_MEMBER_SIZE]
+                small_infos = [info for info in infos if info.file_size < self.LARGE_MEMBER_SIZE]
+
+                with ThreadPoolExecutor(self.max_workers) as executor:
+                    futures = [executor.submit(self._extract_large_member, info, staging_path) for info in large_infos]
+                    try:
+                        for info in small_infos:
+                            self._extract_member(zip_file, info, staging_path)
+
+                        for future in futures:
+                            future.result()
+                    except:  # pylint: disable=bare-except
+                        self.progress.cancel()
+                        raise
+
+            # the asset folder appears only when the whole archive is extracted
+            self._move_tree(staging_path, asset_path)
+        finally:
+            shutil.rmtree(staging_path, ignore_errors=True)
+
+    def _decode_filename(self, info: zipfile.ZipInfo) -> zipfile.ZipInfo:
+        # the filenames without the UTF-8 flag were decoded as cp437
+        if not info.flag_bits & 0x800 and self.encoding != 'cp437':
+            info.filename = info.orig_filename.encode('cp437').decode(self.encoding)
+
+        if os.sep != '/' and os.sep in info.filename:
+            info.filename = info.filename.replace(os.sep, '/')
+
+        return info
+
+    @staticmethod
+    def _to_target_path(info: zipfile.ZipInfo, path: str) -> str:
+        # same sanitization as zipfile.ZipFile.extract
+        arcname = os.path.splitdrive(info.filename.replace('/', os.sep))[1]
+        parts = [part for part in arcname.split(os.sep) if part not in {'', os.curdir, os.pardir}]
+        if os.sep == '\\':
+            parts = [re.sub(r'[:<>|"?*]', '_', part).rstrip('.') or '_' for part in parts]
+        return os.path.join(path, *parts)
+
+    def _extract_large_member(self, info: zipfile.ZipInfo, path: str):
+        # each thread reads through its own file handle
+        with zipfile.ZipFile(self.zip_file_path) as zip_file:
+            self._extract_member(zip_file, info, path)
+
+    def _extract_member(self, zip_file: zipfile.ZipFile, info: zipfile.ZipInfo, path: str):
+        self.progress.check_canceled()
+
+        target_path = self._to_target_path(info, path)
+        if info.is_dir():
+            os.makedirs(target_path, exist_ok=True)
+            return
+
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+
+        # the member attributes are not restored, so the files are writable without a chmod walk afterwards
+        with zip_file.open(info, pwd=self.pwd) as source, open(target_path, 'wb') as target:
+            while True:
+                chunk = source.read(self.CHUNK_SIZE)
+                if not chunk:
+                    break
+                target.write(chunk)
+                self.progress.add(len(chunk))
+                self.progress.check_canceled()
+
+    @staticmethod
+    def _move_tree(source_path: str, target_path: str):
+        if not os.path.exists(target_path):
+            os.makedirs(os.path.dirname(target_path), exist_ok=True)
+            os.rename(source_path, target_path)
+            return
+
+        # merge into the existing folder, the extract folder may be shared with other assets
+        for name in os.listdir(source_path):
+            source = os.path.join(source_path, name)
+            target = os.path.join(target_path, name)
+            if os.path.isdir(source) and os.path.isdir(target):
+                ZipExtractor._move_tree(source, target)
+                continue
+
+            if os.path.isdir(target):
+                shutil.rmtree(target)
+            os.replace(source, target)
+
+
+class X7ZipExtractor:
+    """Extracts the members of a 7z archive in batches, the cancellation is checked between the batches."""
+
+    BATCH_SIZE = 16*1024*1024
+    BATCH_MEMBER_COUNT = 256
+
+    def __init__(self, zip_file, progress: Optional[ExtractionProgress] = None):
+        self.zip_file = zip_file
+        self.progress = ExtractionProgress() if progress is None else progress
+
+    def extract(self, asset_path: str, infos: List[Any]):
+        infos = [info for info in infos if not info.is_dir()]
+        self.progress.total_size = sum(info.file_size or 0 for info in infos)
+
+        for batch_infos in self._to_batches(infos):
+            self.progress.check_canceled()
+            self._extract_batch(asset_path, batch_infos)
+            self.progress.add(sum(info.file_size or 0 for info in batch_infos))
+
+    def _to_batches(self, infos: List[Any]) -> Iterator[List[Any]]:
+        batch_infos: List[Any] = []
+        batch_size = 0
+        for info in infos:
+            # 7z decompresses a solid block for each command, the members of a block are extracted together
+            is_same_block = batch_infos and info.block is not None and info.block == batch_infos[-1].block
+            if batch_infos and not is_same_block and (batch_size >= self.BATCH_SIZE or len(batch_infos) >= self.BATCH_MEMBER_COUNT):
+                yield batch_infos
+                batch_infos = []
+                batch_size = 0
+
+            batch_infos.append(info)
+            batch_size += info.file_size or 0
+
+        if batch_infos:
+            yield batch_infos
+
+    def _extract_batch(self, asset_path: str, infos: List[Any]):
+        # the member names are passed in a list file, the length of the command line is limited
+        with tempfile.NamedTemporaryFile('w', encoding='utf-8', suffix='.txt', delete=False) as list_file:
+            list_file.write(''.join(f'{info.filename}\n' for info in infos))
+
+        try:
+            self.zip_file.extractall(path=asset_path, members=[f'@{list_file.name}'])
+        finally:
+            os.remove(list_file.name)
+
+
+class ArchiveModules:
+    def __init__(self, executables_name: str = 'archive_executables.json'):
+        self.executables_name = executables_name
+        self._lock = threading.RLock()
+        self._modules: Dict[str, ModuleType] = {}
+
+    def _to_executables_path(self) -> str:
+        return os.path.join(get_preferences().asset_cache_folder, self.executables_name)
+
+    def _load_executables(self) -> Dict[str, str]:
+        try:
+            with open(self._to_executables_path(), 'r', encoding='utf-8') as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_executables(self, executables: Dict[str, str]):
+        executables_path = self._to_executables_path()
+        os.makedirs(os.path.dirname(executables_path), exist_ok=True)
+        with open(executables_path, 'w', encoding='utf-8') as file:
+            json.dump(executables, file)
+
+    def load(self, namespace: str) -> ModuleType:
+        with self._lock:
+            module = self._modules.get(namespace)
+            if module is not None:
+                return module
+
+            spec = importlib.util.spec_from_file_location(namespace, os.path.join(PACKAGE_PATH, 'externals', namespace, f'{namespace}.py'))
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            self._restore_executor(namespace, module)
+            self._modules[namespace] = module
+            return module
+
+    def _restore_executor(self, namespace: str, module: ModuleType):
+        # pylint: disable=protected-access
+        executable = self._load_executables().get(namespace)
+        if executable is None:
+            return
+
+        # skip probing the executables by spawning processes
+        for executor in getattr(module, '_EXECUTORS', []):
+            if executor.executable == executable:
+                module._EXECUTOR = executor
+                return
+
+        if hasattr(module, '_EXECUTABLES') and executable in module._EXECUTABLES:
+            module._EXECUTOR = module._Executor(executable)
+
+    def remember_executor(self, namespace: str):
+        # pylint: disable=protected-access
+        with self._lock:
+            executor = self.load(namespace)._EXECUTOR
+            if executor is None:
+                return
+
+            executables = self._load_executables()
+            if executables.get(namespace) == executor.executable:
+                return
+
+            executables[namespace] = executor.executable
+            self._save_executables(executables)
+
+    def forget_executor(self, namespace: str):
+        # pylint: disable=protected-access
+        with self._lock:
+            self.load(namespace)._EXECUTOR = None
+
+            executables = self._load_executables()
+            if executables.pop(namespace, None) is not None:
+                self._save_executables(executables)
+
+
+class ArchiveListings:
+    def __init__(self, archive_modules: ArchiveModules, listings_folder_name: str = 'listings'):
+        self.archive_modules = archive_modules
+        self.listings_folder_name = listings_folder_name
+        self._lock = threading.Lock()
+        self._listings: Dict[str, Tuple[Tuple[int, int], List[Any]]] = {}
+
+    def _to_listing_path(self, content_id: str) -> str:
+        return os.path.join(get_preferences().asset_cache_folder, self.listings_folder_name, f'{content_id}.json')
+
+    def list_x7zip(self, zip_file_path: str, password: Optional[str] = None) -> List[Any]:
+        x7zipfile = self.archive_modules.load('x7zipfile')
+
+        # the cached content files are named by the content id
+        content_id = os.path.basename(zip_file_path)
+        file_stat = os.stat(zip_file_path)
+        version = (file_stat.st_size, file_stat.st_mtime_ns)
+
+        with self._lock:
+            listing = self._listings.get(content_id)
+        if listing is not None and listing[0] == version:
+            return listing[1]
+
+        listing_path = self._to_listing_path(content_id)
+        infos = None
+        try:
+            with open(listing_path, 'r', encoding='utf-8') as file:
+                listing_json = json.load(file)
+            if tuple(listing_json['version']) == version:
+                infos = [
+                    x7zipfile.x7ZipInfo(**{**info, 'date_time': tuple(info['date_time']) if info['date_time'] else None})
+                    for info in listing_json['infos']
+                ]
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+
+        if infos is None:
+            with x7zipfile.x7ZipFile(zip_file_path, pwd=password) as zip_file:
+                infos = list(zip_file.infolist())
+            self.archive_modules.remember_executor('x7zipfile')
+
+            os.makedirs(os.path.dirname(listing_path), exist_ok=True)
+            with open(listing_path, 'w', encoding='utf-8') as file:
+                json.dump({'version': version, 'infos': [dataclasses.asdict(info) for info in infos]}, file)
+
+        with self._lock:
+            self._listings[content_id] = (version, infos)
+
+        return infos
+
+
+ARCHIVE_MODULES = ArchiveModules()
+ARCHIVE_LISTINGS = ArchiveListings(ARCHIVE_MODULES)
+
+
+class PmxTextures:
+    # bytes of the vertex weights by the weight deform type: BDEF1, BDEF2, BDEF4, SDEF, QDEF
+    _WEIGHT_BONE_COUNTS = (1, 2, 4, 2, 4)
+    _WEIGHT_EXTRA_SIZES = (0, 4, 16, 4 + 36, 16)
+
+    @staticmethod
+    def read(pmx_file_path: str) -> List[str]:
+        with open(pmx_file_path, 'rb') as file:
+            if file.read(4) != b'PMX ':
+                return []
+
+            def read(size: int) -> bytes:
+                data = file.read(size)
+                if len(data) != size:
+                    raise EOFError(f'{pmx_file_path} is truncated')
+                return data
+
+            def read_int(size: int) -> int:
+                return int.from_bytes(read(size), 'little', signed=True)
+
+            def read_text(encoding: str) -> str:
+                return read(read_int(4)).decode(encoding, errors='replace')
+
+            read(4)  # version
+            global_count = read(1)[0]
+            globals_ = read(global_count)
+            encoding = 'utf-16-le' if globals_[0] == 0 else 'utf-8'
+            additional_uv_count, vertex_index_size, _texture_index_size, _material_index_size, bone_index_size = globals_[1:6]
+
+            for _ in range(4):  # model names and comments
+                read_text(encoding)
+
+            for _ in range(read_int(4)):  # vertices
+                read(4*3 + 4*3 + 4*2 + 4*4*additional_uv_count)
+                weight_deform_type = read(1)[0]
+                read(
+                    bone_index_size*PmxTextures._WEIGHT_BONE_COUNTS[weight_deform_type]
+                    + PmxTextures._WEIGHT_EXTRA_SIZES[weight_deform_type]
+                    + 4  # edge scale
+                )
+
+            file.seek(read_int(4) * vertex_index_size, os.SEEK_CUR)  # faces
+
+            return [read_text(encoding) for _ in range(read_int(4))]
+
+
+class LazyExtraction:
+    """Extracts the members to import, the skipped members are recorded in a marker and extracted on a full extraction."""
+
+    def __init__(self, asset_path: str, asset_json: str, member_names: Iterable[str]):
+        self.asset_path = asset_path
+        self.marker_path = self.to_marker_path(asset_json)
+        self._member_names = {self.normalize(name).lower(): name for name in member_names}
+
+    @staticmethod
+    def to_marker_path(asset_json: str) -> str:
+        return f'{os.path.splitext(asset_json)[0]}.lazy.json'
+
+    @staticmethod
+    def normalize(path: str) -> str:
+        return posixpath.normpath(path.replace('\\', '/'))
+
+    def resolve(self, paths: Iterable[str]) -> List[str]:
+        member_names = []
+        for path in paths:
+            member_name = self._member_names.get(self.normalize(path).lower())
+            if member_name is None or os.path.exists(os.path.join(self.asset_path, self.normalize(member_name))):
+                continue
+            member_names.append(member_name)
+        return member_names
+
+    def extract(self, target_paths: List[str], extract_members: Callable[[List[str]], None]):
+        extract_members(self.resolve(target_paths))
+
+        # PMX models refer the textures by the paths relative to the model
+        texture_paths = []
+        for target_path in target_paths:
+            if not target_path.lower().endswith('.pmx'):
+                continue
+
+            # the import actions may differ from the member names in case
+            target_path = self._member_names.get(self.normalize(target_path).lower(), target_path)
+            pmx_file_path = os.path.join(self.asset_path, self.normalize(target_path))
+            if not os.path.exists(pmx_file_path):
+                continue
+
+            try:
+                pmx_texture_paths = PmxTextures.read(pmx_file_path)
+            except (EOFError, IndexError, ValueError):
+                traceback.print_exc()
+                continue
+
+            pmx_folder = posixpath.dirname(self.normalize(target_path))
+            texture_paths.extend(posixpath.join(pmx_folder, self.normalize(p)) for p in pmx_texture_paths)
+
+        extract_members(self.resolve(texture_paths))
+
+        # the asset is not marked as extracted, the next full extraction extracts the skipped members
+        os.makedirs(os.path.dirname(self.marker_path), exist_ok=True)
+        with open(self.marker_path, 'w', encoding='utf-8') as file:
+            json.dump({'skipped_members': self.resolve(self._member_names.values())}, file, ensure_ascii=False, indent=2)
+
+    def extract_skipped(self, extract_members: Callable[[List[str]], None]) -> bool:
+        """Returns False when no lazy extraction was made, the whole archive must be extracted then."""
+        try:
+            with open(self.marker_path, 'r', encoding='utf-8') as file:
+                skipped_member_names = json.load(file)['skipped_members']
+        except FileNotFoundError:
+            return False
+        except (ValueError, KeyError, TypeError):
+            traceback.print_exc()
+            return False
+
+        extract_members(self.resolve(skipped_member_names))
+        os.remove(self.marker_path)
+        return True
+
+
 class ImportActionExecutor:
+    FILE_ACTION_NAMES = {'unzip', 'un7zip', 'unrar', 'link'}
+
     @staticmethod
-    def unzip(zip_file_path=None, encoding='cp437', password=None, asset=None):
+    def unzip(zip_file_path=None, encoding='cp437', password=None, asset=None, progress=None, target_paths=None):
+        # pylint: disable=too-many-arguments
         asset_path, asset_json = _Utilities.resolve_path(asset)
 
         print(f'unzip({zip_file_path},{asset_path},{asset_json})')
@@ -210,23 +651,28 @@ class ImportActionExecutor:
         if _Utilities.is_extracted(asset):
             return
 
-        pwd = password.encode() if password else None
+        extractor = ZipExtractor(zip_file_path, encoding, password, progress=progress)
 
-        with zipfile.ZipFile(zip_file_path) as zip_file:
-            for info in zip_file.infolist():
-                if info.flag_bits ^ 0x800:
-                    info.filename = info.orig_filename.encode('cp437').decode(encoding)
+        # the directory members are created with the files
+        lazy_extraction = LazyExtraction(asset_path, asset_json, [name for name in extractor.namelist() if not name.endswith('/')])
 
-                if os.sep != '/' and os.sep in info.filename:
-                    info.filename = info.filename.replace(os.sep, '/')
+        def extract_members(member_names: List[str]):
+            if member_names:
+                extractor.extract(asset_path, member_names)
+
+        if target_paths:
+            # the members the import action does not refer stay in the archive
+            lazy_extraction.extract(target_paths, extract_members)
+            return
 
-                zip_file.extract(info, path=asset_path, pwd=pwd)
+        if not lazy_extraction.extract_skipped(extract_members):
+            extractor.extract(asset_path)
 
         _Utilities.write_json(asset)
-        ImportActionExecutor.chmod_recursively(asset_path, stat.S_IWRITE)
 
     @staticmethod
-    def unrar(rar_file_path=None, password=None, asset=None):
+    def unrar(rar_file_path=None, password=None, asset=None, progress=None):
+        """The lazy extraction is not supported, RAR archives are always extracted entirely."""
         asset_path, asset_json = _Utilities.resolve_path(asset)
 
         print(f'unrar({rar_file_path},{asset_path},{asset_json})')
@@ -234,21 +680,30 @@ class ImportActionExecutor:
         if _Utilities.is_extracted(asset):
             return
 
-        namespace = 'xrarfile'
-        loader = importlib.machinery.SourceFileLoader(namespace, os.path.join(PACKAGE_PATH, 'externals', 'xrarfile', 'xrarfile.py'))
-        xrarfile = loader.load_module(namespace)  # pylint: disable=deprecated-method
+        xrarfile = ARCHIVE_MODULES.load('xrarfile')
+
+        # xrarfile can not list the members, the archive is extracted by one command and the cancellation is checked around it
+        progress = ExtractionProgress() if progress is None else progress
+        progress.total_size = os.path.getsize(rar_file_path)
+        progress.check_canceled()
 
         try:
             with xrarfile.XRarFile(rar_file_path) as rar:
+                ARCHIVE_MODULES.remember_executor('xrarfile')
                 rar.extractall(path=asset_path, pwd=password)
         except xrarfile.XRarCannotExec as ex:
+            ARCHIVE_MODULES.forget_executor('xrarfile')
             raise MessageException(_('Failed to execute unrar or WinRAR\nPlease install unrar or WinRAR and setup the PATH properly.')) from ex
 
+        progress.add(progress.total_size)
+        progress.check_canceled()
+
         _Utilities.write_json(asset)
         ImportActionExecutor.chmod_recursively(asset_path, stat.S_IWRITE)
 
     @staticmethod
-    def un7zip(zip_file_path=None, password=None, asset=None):
+    def un7zip(zip_file_path=None, password=None, asset=None, progress=None, target_paths=None):
+        # pylint: disable=too-many-arguments
         asset_path, asset_json = _Utilities.resolve_path(asset)
 
         print(f'un7zip({zip_file_path},{asset_path},{asset_json})')
@@ -256,14 +711,36 @@ class ImportActionExecutor:
         if _Utilities.is_extracted(asset):
             return
 
-        namespace = 'x7zipfile'
-        loader = importlib.machinery.SourceFileLoader(namespace, os.path.join(PACKAGE_PATH, 'externals', 'x7zipfile', 'x7zipfile.py'))
-        x7zipfile = loader.load_module(namespace)  # pylint: disable=deprecated-method
+        x7zipfile = ARCHIVE_MODULES.load('x7zipfile')
 
         try:
-            with x7zipfile.x7ZipFile(zip_file_path, pwd=password) as zip_file:
-                zip_file.extractall(path=asset_path)
+            # a cached listing runs no 7z command, the archive is opened only when there are members to extract
+            infos = [info for info in ARCHIVE_LISTINGS.list_x7zip(zip_file_path, password) if not info.is_dir()]
+            name2infos = {info.filename: info for info in infos}
+            extractor: Optional[X7ZipExtractor] = None
+
+            def extract_members(member_names: List[str]):
+                nonlocal extractor
+                if not member_names:
+                    return
+
+                if extractor is None:
+                    extractor = X7ZipExtractor(x7zipfile.x7ZipFile(zip_file_path, pwd=password), progress)
+                    ARCHIVE_MODULES.remember_executor('x7zipfile')
+
+                extractor.extract(asset_path, [name2infos[name] for name in member_names])
+
+            lazy_extraction = LazyExtraction(asset_path, asset_json, name2infos.keys())
+            if target_paths:
+                # the members the import action does not refer stay in the archive
+                lazy_extraction.extract(target_paths, extract_members)
+                ImportActionExecutor.chmod_recursively(asset_path, stat.S_IWRITE)
+                return
+
+            if not lazy_extraction.extract_skipped(extract_members):
+                extract_members(list(name2infos.keys()))
         except x7zipfile.x7ZipCannotExec as ex:
+            ARCHIVE_MODULES.forget_executor('x7zipfile')
             raise MessageException(_('Failed to execute 7z\nPlease install p7zip-full or 7-zip and setup the PATH properly.')) from ex
 
         _Utilities.write_json(asset)
@@ -391,13 +868,63 @@ class ImportActionExecutor:
         bpy.ops.object.delete()
 
     @staticmethod
-    def execute_import_action(asset: AssetDescription, target_file: Optional[str]):
+    def is_extraction_first(asset: AssetDescription) -> bool:
         tree = ast.parse(asset.import_action)
+        if len(tree.body) == 0 or not isinstance(tree.body[0], ast.Expr):
+            return False
+
+        call = tree.body[0].value
+        return isinstance(call, ast.Call) and isinstance(call.func, ast.Name) and call.func.id in {'unzip', 'un7zip', 'unrar'}
+
+    @staticmethod
+    def to_target_paths(tree: ast.AST) -> Optional[List[str]]:
+        """Returns the files to import and extract first, or None when the whole archive must be extracted."""
+        target_paths = []
+        for node in ast.walk(tree):
+            if not isinstance(node, ast.Call) or not isinstance(node.func, ast.Name):
+                continue
+
+            if node.func.id in {'import_collections', 'import_world'}:
+                # .blend files link the libraries and images by the relative paths, they are not resolved
+                return None
+
+            if node.func.id not in {'import_pmx', 'import_vmd', 'import_vpd'}:
+                continue
+
+            # the file path is the first argument
+            if len(node.args) == 0 or not isinstance(node.args[0], ast.Constant) or not isinstance(node.args[0].value, str):
+                return None
+
+            target_paths.append(node.args[0].value)
+
+        return target_paths or None
+
+    @staticmethod
+    def execute_file_actions(asset: AssetDescription, target_file: Optional[str], progress: Optional[ExtractionProgress] = None):
+        ImportActionExecutor.execute_import_action(asset, target_file, progress, ImportActionExecutor.FILE_ACTION_NAMES)
+
+    @staticmethod
+    def execute_blender_actions(asset: AssetDescription, target_file: Optional[str]):
+        ImportActionExecutor.execute_import_action(asset, target_file, action_names={
+            'import_collections', 'import_world', 'import_pmx', 'import_vmd', 'import_vpd', 'delete_objects',
+        })
+
+    @staticmethod
+    def execute_import_action(
+        asset: AssetDescription,
+        target_file: Optional[str],
+        progress: Optional[ExtractionProgress] = None,
+        action_names: Optional[Set[str]] = None,
+    ):
+        tree = ast.parse(asset.import_action)
+
+        target_paths = ImportActionExecutor.to_target_paths(tree) if get_preferences().asset_extract_lazy else None
 
         functions = {
-            'unzip': functools.partial(ImportActionExecutor.unzip, zip_file_path=target_file, asset=asset),
-            'un7zip': functools.partial(ImportActionExecutor.un7zip, zip_file_path=target_file, asset=asset),
-            'unrar': functools.partial(ImportActionExecutor.unrar, rar_file_path=target_file, asset=asset),
+            'unzip': functools.partial(ImportActionExecutor.unzip, zip_file_path=target_file, asset=asset, progress=progress, target_paths=target_paths),
+            'un7zip': functools.partial(ImportActionExecutor.un7zip, zip_file_path=target_file, asset=asset, progress=progress, target_paths=target_paths),
+            # unrar extracts the whole archive, it takes no target_paths
+            'unrar': functools.partial(ImportActionExecutor.unrar, rar_file_path=target_file, asset=asset, progress=progress),
             'link': functools.partial(ImportActionExecutor.link, from_path=target_file, asset=asset),
             'import_collections': functools.partial(ImportActionExecutor.import_collections, asset=asset),
             'import_world': functools.partial(ImportActionExecutor.import_world, asset=asset),
@@ -409,6 +936,21 @@ class ImportActionExecutor:
 
         RestrictionChecker(*(functions.keys())).visit(tree)
 
+        def to_action(name, function):
+            if action_names is not None and name not in action_names:
+                return lambda *_args, **_kwargs: None
+
+            if progress is None:
+                return function
+
+            def action(*args, **kwargs):
+                progress.check_canceled()
+                return function(*args, **kwargs)
+
+            return action
+
+        functions = {name: to_action(name, function) for name, function in functions.items()}
+
         try:
             exec(  # pylint: disable=exec-used
                 compile(tree, '<source>', 'exec'),
@@ -424,3 +966,138 @@ class ImportActionExecutor:
                     raise MessageException(_('The file path is too long. This can be alleviated to some extent by shortening the Asset Extract Root Folder in the Add-on Preferences.')) from ex
 
             raise
+
+
+class ImportTask:
+    # pylint: disable=too-few-public-methods
+
+    class State(Enum):
+        QUEUING = 1
+        RUNNING = 2
+        SUCCESS = 3
+        FAILURE = 4
+        CANCELED = 5
+
+    def __init__(self, asset: AssetDescription, target_file: Optional[str], callbacks: List[Callable[['ImportTask'], None]] = None):
+        self.asset = asset
+        self.target_file = target_file
+        self.callbacks = [] if callbacks is None else callbacks
+        self.state = ImportTask.State.QUEUING
+        self.preferences = snapshot_preferences()
+        self.progress = ExtractionProgress()
+        self.future: Optional[Future] = None
+        self.exception: Optional[BaseException] = None
+
+
+class ImportTaskQueue:
+    def __init__(self, max_workers: int = 2, main_thread_interval_secs: float = 0.1):
+        self.main_thread_interval_secs = main_thread_interval_secs
+
+        self._executor = ThreadPoolExecutor(max_workers)
+        self._lock = threading.Lock()
+        self._tasks: Dict[str, ImportTask] = {}
+        self._listeners: List[Callable[[str], None]] = []
+        self._main_thread_calls: queue.Queue = queue.Queue()
+
+    def register(self):
+        # bpy.app.timers must not be registered from the worker threads, one timer drains the calls on the main thread
+        if not bpy.app.timers.is_registered(self._run_main_thread_calls):
+            bpy.app.timers.register(self._run_main_thread_calls, persistent=True)
+
+    def unregister(self):
+        if bpy.app.timers.is_registered(self._run_main_thread_calls):
+            bpy.app.timers.unregister(self._run_main_thread_calls)
+
+    def call_on_main_thread(self, function: Callable[[], None]):
+        self._main_thread_calls.put(function)
+
+    def _run_main_thread_calls(self) -> float:
+        while True:
+            try:
+                function = self._main_thread_calls.get_nowait()
+            except queue.Empty:
+                return self.main_thread_interval_secs
+
+            try:
+                function()
+            except:  # pylint: disable=bare-except
+                traceback.print_exc()
+
+    def add_listener(self, listener: Callable[[str], None]):
+        self._listeners.append(listener)
+
+    def _notify(self, asset_id: str):
+        for listener in self._listeners:
+            try:
+                listener(asset_id)
+            except:  # pylint: disable=bare-except
+                traceback.print_exc()
+
+    def try_get_task(self, asset_id: str) -> Optional[ImportTask]:
+        return self._tasks.get(asset_id)
+
+    def submit(self, asset: AssetDescription, target_file: Optional[str], callback: Optional[Callable[[ImportTask], None]] = None) -> ImportTask:
+        """Must be called on the main thread, the task takes a snapshot of the preferences."""
+        with self._lock:
+            task = self._tasks.get(asset.id)
+            if task is not None:
+                # e.g. importing while the archive is extracted on download
+                if callback is not None:
+                    task.callbacks.append(callback)
+                return task
+
+            task = ImportTask(asset, target_file, [] if callback is None else [callback])
+            self._tasks[asset.id] = task
+            task.future = self._executor.submit(self._run, task)
+
+        self._notify(asset.id)
+        return task
+
+    def cancel(self, asset_id: str):
+        task = self.try_get_task(asset_id)
+        if task is None:
+            return
+
+        task.progress.cancel()
+        if task.future.cancel():
+            task.state = ImportTask.State.CANCELED
+            with self._lock:
+                self._tasks.pop(asset_id, None)
+            self._notify(asset_id)
+
+    def _run(self, task: ImportTask):
+        task.state = ImportTask.State.RUNNING
+        self._notify(task.asset.id)
+
+        try:
+            with use_preferences_snapshot(task.preferences):
+                ImportActionExecutor.execute_file_actions(task.asset, task.target_file, task.progress)
+            task.state = ImportTask.State.SUCCESS
+        except InterruptedError:
+            task.state = ImportTask.State.CANCELED
+        except BaseException as ex:  # pylint: disable=broad-except
+            traceback.print_exc()
+            task.exception = ex
+            task.state = ImportTask.State.FAILURE
+
+        # the Blender operators must run on the main thread
+        self.call_on_main_thread(functools.partial(self._finish, task))
+
+    def _finish(self, task: ImportTask):
+        with self._lock:
+            self._tasks.pop(task.asset.id, None)
+            callbacks = list(task.callbacks)
+            task.callbacks.clear()
+
+        for callback in callbacks:
+            try:
+                callback(task)
+            except:  # pylint: disable=bare-except
+                traceback.print_exc()
+
+        self._notify(task.asset.id)
+
+
+IMPORT_TASKS = ImportTaskQueue()
+REGISTER_HOOKS.append(IMPORT_TASKS.register)
+UNREGISTER_HOOKS.append(IMPORT_TASKS.unregister)
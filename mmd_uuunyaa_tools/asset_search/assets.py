@@ -10,7 +10,7 @@ import os
 import traceback
 from datetime import datetime, timezone
 from enum import Enum
-from typing import Any, Dict, ItemsView, Tuple, ValuesView
+from typing import Any, Dict, Iterable, ItemsView, List, Optional, Set, Tuple, ValuesView
 
 import requests
 from mmd_uuunyaa_tools import PACKAGE_PATH, REGISTER_HOOKS
@@ -179,15 +179,104 @@ class _Utilities:
             raise
 
 
+class AssetIndex:
+    """Inverted index over assets.
+
+    Posting lists are kept as bitsets (int) of the asset positions,
+    so a query is answered by intersecting the bitsets.
+    """
+
+    GRAM_SIZE = 3
+
+    def __init__(self, assets: Iterable[AssetDescription]):
+        self.assets: List[AssetDescription] = list(assets)
+        self.all_bits: int = (1 << len(self.assets)) - 1
+        self.type_bits: Dict[AssetType, int] = {}
+        self.tag_bits: Dict[str, int] = {}
+        self.gram_bits: Dict[str, int] = {}
+
+        type_indices: Dict[AssetType, List[int]] = {}
+        tag_indices: Dict[str, List[int]] = {}
+        gram_indices: Dict[str, List[int]] = {}
+
+        for index, asset in enumerate(self.assets):
+            type_indices.setdefault(asset.type, []).append(index)
+
+            for tag_name in asset.tag_names:
+                tag_indices.setdefault(tag_name, []).append(index)
+
+            for gram in self._to_grams(asset.keywords):
+                gram_indices.setdefault(gram, []).append(index)
+
+        self.type_bits.update((k, self._to_bits(v)) for k, v in type_indices.items())
+        self.tag_bits.update((k, self._to_bits(v)) for k, v in tag_indices.items())
+        self.gram_bits.update((k, self._to_bits(v)) for k, v in gram_indices.items())
+
+    @staticmethod
+    def _to_bits(indices: List[int]) -> int:
+        bits = 0
+        for index in indices:
+            bits |= 1 << index
+        return bits
+
+    @staticmethod
+    def _to_indices(bits: int) -> List[int]:
+        indices: List[int] = []
+        reversed_bits = bin(bits)[:1:-1]
+        index = reversed_bits.find('1')
+        while index >= 0:
+            indices.append(index)
+            index = reversed_bits.find('1', index + 1)
+        return indices
+
+    @classmethod
+    def _to_grams(cls, text: str) -> Set[str]:
+        return {text[i:i+cls.GRAM_SIZE] for i in range(len(text) - cls.GRAM_SIZE + 1)}
+
+    def search(self, type_name: str, text: str, tag_names: Set[str]) -> List[AssetDescription]:
+        bits = self.all_bits if type_name == AssetType.ALL.name else self.type_bits.get(AssetType[type_name], 0)
+
+        for tag_name in tag_names:
+            if bits == 0:
+                return []
+            bits &= self.tag_bits.get(tag_name, 0)
+
+        for gram in self._to_grams(text):
+            if bits == 0:
+                return []
+            bits &= self.gram_bits.get(gram, 0)
+
+        if len(text) in {0, self.GRAM_SIZE}:
+            # the text is empty or a single gram, the bits are exact
+            return [self.assets[i] for i in self._to_indices(bits)]
+
+        # the grams are only a necessary condition, verify the candidates
+        return [
+            asset for asset in (self.assets[i] for i in self._to_indices(bits))
+            if text in asset.keywords
+        ]
+
+
 class AssetRegistry:
 
     def __init__(self, *assets: AssetDescription):
         self.assets: Dict[str, AssetDescription] = {}
+        self._index: Optional[AssetIndex] = None
         for asset in assets:
             self.add(asset)
 
     def add(self, asset: AssetDescription):
         self.assets[asset.id] = asset
+        self._index = None
+
+    @property
+    def index(self) -> AssetIndex:
+        if self._index is None:
+            self._index = AssetIndex(self.assets.values())
+        return self._index
+
+    def search(self, type_name: str, text: str, tag_names: Set[str]) -> List[AssetDescription]:
+        return self.index.search(type_name, text, tag_names)
 
     def __contains__(self, identifier: str) -> bool:
         return identifier in self.assets
@@ -205,6 +294,7 @@ class AssetRegistry:
         preferences = get_preferences()
 
         self.assets.clear()
+        self._index = None
 
         json_paths = glob.glob(os.path.join(preferences.asset_jsons_folder, '*.json'))
         json_paths.sort()
@@ -219,6 +309,8 @@ class AssetRegistry:
             except:  # pylint: disable=bare-except
                 traceback.print_exc()
 
+        self._index = AssetIndex(self.assets.values())
+
     def is_extracted(self, identifier: str) -> bool:
         return _Utilities.is_extracted(self[identifier])
 
@@ -2,25 +2,44 @@
 # Copyright 2021 UuuNyaa <UuuNyaa@gmail.com>
 # This file is part of MMD UuuNyaa Tools.
 
+import collections
+import contextlib
 import hashlib
+import heapq
+import itertools
 import json
 import os
+import re
 import shutil
-import tempfile
 import threading
+import time
 import traceback
 from abc import ABC, abstractmethod
 from concurrent.futures import Future, ThreadPoolExecutor
-from enum import Enum
-from typing import Callable, Dict, List, Optional, OrderedDict
+from enum import Enum, IntEnum
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, OrderedDict, Tuple
 
-from mmd_uuunyaa_tools import REGISTER_HOOKS
+import requests
+from mmd_uuunyaa_tools import REGISTER_HOOKS, UNREGISTER_HOOKS
 from mmd_uuunyaa_tools.asset_search.url_resolvers import (URLResolver,
                                                           URLResolverABC)
 from mmd_uuunyaa_tools.utilities import get_preferences
 
+if os.name == 'nt':
+    import msvcrt
+else:
+    import fcntl
+
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None
+    print('[WARN] sqlite3 does not exist. Ignore it.')
+
 URL = str
 Callback = Callable[['Content'], None]
+# called with the changed content id, or None when everything changed
+Listener = Callable[[Optional[str]], None]
 
 
 class Content:
@@ -67,11 +86,18 @@ class Task:
         FAILURE = 4
         CANCELED = 5
 
+    class Priority(IntEnum):
+        VISIBLE = 0
+        PREFETCH = 1
+        DOWNLOAD = 2
+
     url: URL
     state: State
+    priority: Priority
     callbacks: List[Callback]
     future: Future
     content_id: str
+    host: str
     fetched_size: int
     content_length: int
 
@@ -80,16 +106,722 @@ class Task:
         url: URL,
         state: State,
         callbacks: List[Callback] = None,
+        priority: Priority = Priority.DOWNLOAD,
     ):
         self.url = url
         self.state = state
+        self.priority = priority
         self.callbacks = [] if callbacks is None else callbacks
         self.future = None
         self.content_id = Content.to_content_id(url)
+        self.host = FetchScheduler.to_host(url)
         self.fetched_size = 0
         self.content_length = 0
 
 
+class ContentShards:
+    SHARD_COUNT = 16
+
+    class _Shard:
+        # pylint: disable=too-few-public-methods
+
+        def __init__(self):
+            self.lock = threading.Lock()
+            self.contents: Dict[str, Content] = {}
+            self.touch_counts: Dict[str, int] = {}
+
+    def __init__(self):
+        self._shards = [ContentShards._Shard() for _ in range(self.SHARD_COUNT)]
+        self._touch_counter = itertools.count()
+
+    def _to_shard(self, content_id: str) -> _Shard:
+        # content ids are hex digests, the first digit is uniformly distributed
+        return self._shards[int(content_id[0], 16) % self.SHARD_COUNT]
+
+    def __len__(self) -> int:
+        return sum(len(shard.contents) for shard in self._shards)
+
+    def get(self, content_id: str) -> Optional[Content]:
+        shard = self._to_shard(content_id)
+        with shard.lock:
+            return shard.contents.get(content_id)
+
+    def touch(self, content_id: str) -> Optional[Content]:
+        shard = self._to_shard(content_id)
+        with shard.lock:
+            content = shard.contents.get(content_id)
+            if content is not None:
+                shard.touch_counts[content_id] = next(self._touch_counter)
+            return content
+
+    def put(self, content: Content):
+        shard = self._to_shard(content.id)
+        with shard.lock:
+            shard.contents[content.id] = content
+            shard.touch_counts[content.id] = next(self._touch_counter)
+
+    def pop(self, content_id: str) -> Optional[Content]:
+        shard = self._to_shard(content_id)
+        with shard.lock:
+            shard.touch_counts.pop(content_id, None)
+            return shard.contents.pop(content_id, None)
+
+    def least_recently_used(self) -> Iterator[Content]:
+        return iter(self.to_list())
+
+    def to_list(self) -> List[Content]:
+        # least recently used first
+        touch_counted_contents: List[Tuple[int, Content]] = []
+        for shard in self._shards:
+            with shard.lock:
+                touch_counted_contents.extend((shard.touch_counts[i], c) for i, c in shard.contents.items())
+
+        touch_counted_contents.sort(key=lambda e: e[0])
+        return [c for _, c in touch_counted_contents]
+
+
+class PartialContent:
+    def __init__(self, directory: str, content_id: str):
+        self.data_path = os.path.join(directory, f'{content_id}.part')
+        self.validators_path = os.path.join(directory, f'{content_id}.part.json')
+
+    def load_validators(self, url: URL) -> Dict[str, Any]:
+        if not os.path.exists(self.data_path) or not os.path.exists(self.validators_path):
+            return {}
+
+        try:
+            with open(self.validators_path, 'r', encoding='utf-8') as file:
+                validators = json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+        if validators.get('url') != url:
+            return {}
+
+        return validators
+
+    def to_resume_headers(self, url: URL) -> Dict[str, str]:
+        validators = self.load_validators(url)
+        if not validators:
+            return {}
+
+        # weak entity tags can not be used for If-Range
+        validator = validators.get('etag') or validators.get('last_modified')
+        if not validator or validator.startswith('W/'):
+            validator = validators.get('last_modified')
+        if not validator:
+            return {}
+
+        fetched_size = os.path.getsize(self.data_path)
+        if fetched_size == 0:
+            return {}
+
+        return {'Range': f'bytes={fetched_size}-', 'If-Range': validator}
+
+    def to_resumed_size(self, response: requests.models.Response, resume_headers: Dict[str, str]) -> int:
+        if response.status_code != 206 or 'Range' not in resume_headers:
+            return 0
+
+        match = re.match(r'^bytes (\d+)-\d+/(\d+|\*)$', response.headers.get('Content-Range', ''))
+        if match is None:
+            return 0
+
+        resumed_size = int(match.group(1))
+        if resumed_size != os.path.getsize(self.data_path):
+            return 0
+
+        return resumed_size
+
+    def is_completed(self, url: URL, response: Optional[requests.models.Response] = None) -> bool:
+        validators = self.load_validators(url)
+        content_length = validators.get('content_length', 0)
+
+        if response is not None:
+            # 416 Range Not Satisfiable tells the current length
+            match = re.match(r'^bytes \*/(\d+)$', response.headers.get('Content-Range', ''))
+            if match is not None:
+                content_length = int(match.group(1))
+
+        return content_length > 0 and os.path.getsize(self.data_path) == content_length
+
+    def save_validators(self, url: URL, response: requests.models.Response, content_length: int):
+        if response.status_code != 206 and response.headers.get('Accept-Ranges') != 'bytes':
+            self.remove_validators()
+            return
+
+        with open(self.validators_path, 'w', encoding='utf-8') as file:
+            json.dump({
+                'url': url,
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+                'content_length': content_length,
+                'content_type': response.headers.get('Content-Type'),
+            }, file)
+
+    def is_resumable(self) -> bool:
+        return os.path.exists(self.validators_path)
+
+    def remove_validators(self):
+        if os.path.exists(self.validators_path):
+            os.remove(self.validators_path)
+
+    def remove(self):
+        self.remove_validators()
+        if os.path.exists(self.data_path):
+            os.remove(self.data_path)
+
+
+class SegmentedDownload:
+    def __init__(
+        self,
+        url_resolver: URLResolverABC,
+        task: 'Task',
+        data_path: str,
+        content_length: int,
+        segment_count: int,
+        bandwidth: 'TokenBucket',
+        validator: Optional[str] = None,
+    ):
+        # pylint: disable=too-many-arguments
+        segment_size = -(-content_length // segment_count)
+
+        self._url_resolver = url_resolver
+        self._task = task
+        self._data_path = data_path
+        self._content_length = content_length
+        self._bandwidth = bandwidth
+        self._validator = validator
+        self._segments = collections.deque(
+            (offset, min(offset + segment_size, content_length) - 1)
+            for offset in range(0, content_length, segment_size)
+        )
+        self._condition = threading.Condition()
+        self._running_count = 0
+        self._exceptions: List[BaseException] = []
+
+    def run(self, scheduler: 'FetchScheduler'):
+        with open(self._data_path, 'wb') as file:
+            file.truncate(self._content_length)
+
+        # the helpers take the workers through the scheduler, so the host limits hold for the segments
+        scheduler.submit_helpers(self._task, self._fetch_segments, len(self._segments) - 1)
+
+        # the calling thread takes segments too, so late helpers find nothing to do and never block the fetch
+        self._fetch_segments()
+
+        with self._condition:
+            while self._running_count > 0:
+                self._condition.wait()
+
+        if self._exceptions:
+            raise self._exceptions[0]
+
+    def _fetch_segments(self):
+        while True:
+            with self._condition:
+                if self._exceptions or not self._segments:
+                    return
+                first, last = self._segments.popleft()
+                self._running_count += 1
+
+            try:
+                self._fetch_segment(first, last)
+            except BaseException as exception:  # pylint: disable=broad-except
+                with self._condition:
+                    self._exceptions.append(exception)
+            finally:
+                with self._condition:
+                    self._running_count -= 1
+                    self._condition.notify_all()
+
+    def _fetch_segment(self, first: int, last: int):
+        task = self._task
+
+        headers = {'Range': f'bytes={first}-{last}'}
+        if self._validator:
+            headers['If-Range'] = self._validator
+
+        response = self._url_resolver.resolve(task.url, headers)
+        response.raise_for_status()
+
+        if response.status_code != 206 or not response.headers.get('Content-Range', '').startswith(f'bytes {first}-{last}/'):
+            raise ValueError(f'task (={task.url}) segment (={first}-{last}) was not served as a range')
+
+        offset = first
+        with open(self._data_path, 'r+b', buffering=0) as file:
+            for chunk in response.iter_content(chunk_size=65536):
+                self._bandwidth.consume(len(chunk))
+                self._write_at(file, chunk, offset)
+                offset += len(chunk)
+
+                with self._condition:
+                    task.fetched_size += len(chunk)
+
+                if task.state is not Task.State.RUNNING:
+                    raise InterruptedError(f'task (={task.url}) fetch was interrupted')
+
+        if offset != last + 1:
+            raise IOError(f'task (={task.url}) segment (={first}-{last}) was truncated at {offset}')
+
+    @staticmethod
+    def _write_at(file, data: bytes, offset: int):
+        view = memoryview(data)
+        while view:
+            if hasattr(os, 'pwrite'):
+                written = os.pwrite(file.fileno(), view, offset)
+            else:
+                file.seek(offset)
+                written = file.write(view)
+            view = view[written:]
+            offset += written
+
+
+class TokenBucket:
+    def __init__(self, rate_bytes_per_sec: int = 0, burst_secs: float = 1.0):
+        self.rate_bytes_per_sec = rate_bytes_per_sec
+        self.burst_secs = burst_secs
+
+        self._lock = threading.Lock()
+        self._tokens: float = 0.0
+        self._updated_at = time.monotonic()
+
+    def consume(self, size: int):
+        if self.rate_bytes_per_sec <= 0:
+            return
+
+        with self._lock:
+            now = time.monotonic()
+            capacity = self.rate_bytes_per_sec * self.burst_secs
+            self._tokens = min(capacity, self._tokens + (now - self._updated_at) * self.rate_bytes_per_sec)
+            self._updated_at = now
+
+            # go into debt and wait until it is paid back
+            self._tokens -= size
+            wait_secs = -self._tokens / self.rate_bytes_per_sec if self._tokens < 0 else 0
+
+        if wait_secs > 0:
+            time.sleep(wait_secs)
+
+
+class FetchScheduler:
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(
+        self,
+        executor: ThreadPoolExecutor,
+        fetch: Callable[['Task'], Any],
+        max_workers: int = 10,
+        max_host_workers: int = 10,
+        max_download_workers: int = 5,
+        download_bandwidth_limit_bytes: int = 0,
+    ):
+        # pylint: disable=too-many-arguments
+        self.max_workers = max_workers
+        self.max_host_workers = max_host_workers
+        self.max_download_workers = max_download_workers
+        self.download_bandwidth = TokenBucket(download_bandwidth_limit_bytes)
+        self.unlimited_bandwidth = TokenBucket()
+
+        self._executor = executor
+        self._fetch = fetch
+
+        self._lock = threading.Lock()
+        self._queue: List[Tuple[int, int, 'Task']] = []
+        self._sequence = itertools.count()
+        self._host_counts: Dict[str, int] = collections.Counter()
+        self._download_count = 0
+        self._running_count = 0
+        self._closed = False
+
+    @staticmethod
+    def to_host(url: URL) -> str:
+        # the download actions wrap the URL, e.g. gdrive('https://drive.google.com/...')
+        match = re.search(r'https?://([^/\'"]+)', url)
+        return match.group(1) if match else ''
+
+    def get_bandwidth(self, task: 'Task') -> TokenBucket:
+        return self.download_bandwidth if task.priority is Task.Priority.DOWNLOAD else self.unlimited_bandwidth
+
+    def submit(self, task: 'Task') -> Future:
+        task.future = Future()
+        with self._lock:
+            if self._closed:
+                task.future.cancel()
+                return task.future
+
+            heapq.heappush(self._queue, (task.priority, next(self._sequence), task))
+
+        self.dispatch()
+        return task.future
+
+    def close(self):
+        """Stops dispatching and cancels the futures of the queued tasks, the running tasks are left to the caller."""
+        with self._lock:
+            self._closed = True
+            entries = self._queue
+            self._queue = []
+
+        # a reprioritized task has a stale entry too, cancelling it again is a no-op
+        for _priority, _sequence, task in entries:
+            task.future.cancel()
+
+    def reprioritize(self, task: 'Task', priority: 'Task.Priority'):
+        with self._lock:
+            if task.state is not Task.State.QUEUING or priority >= task.priority:
+                return
+
+            # the old entry is skipped because its priority is stale
+            task.priority = priority
+            heapq.heappush(self._queue, (task.priority, next(self._sequence), task))
+
+    def _is_runnable(self, task: 'Task') -> bool:
+        if self._host_counts[task.host] >= self.max_host_workers:
+            return False
+
+        return task.priority is not Task.Priority.DOWNLOAD or self._download_count < self.max_download_workers
+
+    def _pop_next(self) -> Optional['Task']:
+        deferred_entries = []
+        try:
+            while self._queue:
+                entry = heapq.heappop(self._queue)
+                priority, _, task = entry
+
+                if priority != task.priority or task.future.cancelled():
+                    continue
+
+                if not self._is_runnable(task):
+                    deferred_entries.append(entry)
+                    continue
+
+                self._host_counts[task.host] += 1
+                if task.priority is Task.Priority.DOWNLOAD:
+                    self._download_count += 1
+                return task
+
+            return None
+
+        finally:
+            for deferred_entry in deferred_entries:
+                heapq.heappush(self._queue, deferred_entry)
+
+    def dispatch(self):
+        # start every runnable task, e.g. the limits were raised or a fetch of a capped host finished
+        tasks: List['Task'] = []
+        with self._lock:
+            while not self._closed and self._running_count < self.max_workers:
+                task = self._pop_next()
+                if task is None:
+                    # the deferred entries are picked up when a running fetch finishes
+                    break
+
+                self._running_count += 1
+                tasks.append(task)
+
+        for task in tasks:
+            self._executor.submit(self._run, task)
+
+    def submit_helpers(self, task: 'Task', function: Callable[[], Any], count: int) -> int:
+        """Runs the function on up to count free workers to help the running task, returns the number of the helpers."""
+        with self._lock:
+            count = max(0, min(count, self.max_workers - self._running_count, self.max_host_workers - self._host_counts[task.host]))
+            self._running_count += count
+            self._host_counts[task.host] += count
+
+        for index in range(count):
+            try:
+                self._executor.submit(self._run_helper, task, function)
+            except RuntimeError:
+                # the executor was shut down
+                self._release_helpers(task, count - index)
+                return index
+
+        return count
+
+    def _run_helper(self, task: 'Task', function: Callable[[], Any]):
+        try:
+            function()
+        finally:
+            self._release_helpers(task, 1)
+
+    def _release_helpers(self, task: 'Task', count: int):
+        with self._lock:
+            self._running_count -= count
+            self._host_counts[task.host] -= count
+
+        self.dispatch()
+
+    def _run(self, task: 'Task'):
+        try:
+            if task.future.set_running_or_notify_cancel():
+                try:
+                    task.future.set_result(self._fetch(task))
+                except BaseException as exception:  # pylint: disable=broad-except
+                    task.future.set_exception(exception)
+        finally:
+            with self._lock:
+                self._running_count -= 1
+                self._host_counts[task.host] -= 1
+                if task.priority is Task.Priority.DOWNLOAD:
+                    self._download_count -= 1
+
+            self.dispatch()
+
+
+class ContentFileLock:
+    def __init__(self, lock_path: str):
+        self.lock_path = lock_path
+        self._file = None
+
+    def _lock(self, blocking: bool) -> bool:
+        file = open(self.lock_path, 'a+b')  # pylint: disable=consider-using-with
+        try:
+            if os.name == 'nt':
+                file.seek(0)
+                msvcrt.locking(file.fileno(), msvcrt.LK_LOCK if blocking else msvcrt.LK_NBLCK, 1)
+            else:
+                fcntl.flock(file.fileno(), fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            file.close()
+            if blocking:
+                raise
+            return False
+
+        # the lock file may have been removed by the previous owner while waiting for it
+        try:
+            is_removed = os.stat(self.lock_path).st_ino != os.fstat(file.fileno()).st_ino
+        except FileNotFoundError:
+            is_removed = True
+
+        if is_removed:
+            file.close()
+            return False
+
+        self._file = file
+        return True
+
+    def try_acquire(self) -> bool:
+        return self._lock(blocking=False)
+
+    def acquire(self):
+        while not self._lock(blocking=True):
+            pass
+
+    def release(self):
+        if self._file is None:
+            return
+
+        try:
+            if os.name == 'nt':
+                self._file.seek(0)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        finally:
+            self._file.close()
+            self._file = None
+
+    def try_remove(self) -> bool:
+        if not self.try_acquire():
+            return False
+
+        try:
+            # the waiters notice the removal and lock the new file
+            os.remove(self.lock_path)
+        except OSError:
+            return False  # an open file can not be removed on Windows
+        finally:
+            self.release()
+
+        return True
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.release()
+
+
+class ContentJournal:
+
+    def __init__(self, cache_folder: str, journal_name: str = 'contents.jsonl'):
+        self.cache_folder = cache_folder
+        self.journal_path = os.path.join(cache_folder, journal_name)
+        self.record_count: int = 0
+
+        self._lock = threading.Lock()
+        self._file = None
+        self._read_offset = 0
+        self._read_inode = None
+
+        # least recently touched first, written by flush_touches(), the next append or dropped by the compaction
+        self._touched_ids: OrderedDict[str, None] = OrderedDict()
+
+    def _to_record(self, content: Content) -> Dict[str, Any]:
+        return {
+            'op': 'put',
+            'id': content.id,
+            'state': content.state.name,
+            'filepath': os.path.basename(content.filepath) if content.filepath else '',
+            'type': content.type,
+            'length': content.length,
+        }
+
+    def to_content(self, record: Dict[str, Any]) -> Content:
+        return Content(
+            id=record['id'],
+            state=Content.State[record['state']],
+            filepath=os.path.join(self.cache_folder, record['filepath']),
+            type=record['type'],
+            length=record['length']
+        )
+
+    def file_lock(self) -> ContentFileLock:
+        # serializes the appends and the compaction of the processes sharing the journal
+        return ContentFileLock(self.journal_path + '.lock')
+
+    def _read_records(self) -> Iterator[Dict[str, Any]]:
+        with open(self.journal_path, 'rb') as file:
+            self._read_inode = os.fstat(file.fileno()).st_ino
+            file.seek(self._read_offset)
+            for line in file:
+                if not line.endswith(b'\n'):
+                    break  # the other process is still writing it
+
+                self._read_offset += len(line)
+
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue  # torn write of an interrupted session
+
+    def load(self) -> List[Content]:
+        # least recently used first
+        contents: OrderedDict[str, Content] = OrderedDict()
+
+        with self._lock:
+            self.record_count = 0
+            self._read_offset = 0
+            self._read_inode = None
+
+            if not os.path.exists(self.journal_path):
+                return []
+
+            for record in self._read_records():
+                self.record_count += 1
+
+                content_id = record['id']
+                operation = record['op']
+                if operation == 'put':
+                    contents[content_id] = self.to_content(record)
+                    contents.move_to_end(content_id)
+                elif operation == 'touch':
+                    if content_id in contents:
+                        contents.move_to_end(content_id)
+                elif operation == 'remove':
+                    contents.pop(content_id, None)
+
+        return list(contents.values())
+
+    def load_appended(self) -> Optional[List[Dict[str, Any]]]:
+        """Returns the records appended since the last read, or None when the journal was replaced."""
+        with self._lock:
+            try:
+                if os.stat(self.journal_path).st_ino != self._read_inode:
+                    return None
+            except FileNotFoundError:
+                return None if self._read_inode is not None else []
+
+            return list(self._read_records())
+
+    def load_legacy_json(self, json_name: str = 'contents.json') -> Optional[List[Content]]:
+        json_path = os.path.join(self.cache_folder, json_name)
+        if not os.path.exists(json_path):
+            return None
+
+        with open(json_path, 'r') as file:
+            content_json = json.load(file, object_pairs_hook=OrderedDict)
+
+        contents = [self.to_content(value) for value in content_json.values()]
+        with self.file_lock():
+            self.compact(contents)
+        os.remove(json_path)
+        return contents
+
+    def _append(self, record: Optional[Dict[str, Any]]):
+        with self.file_lock(), self._lock:
+            # the batched touches precede the record, they happened before it
+            lines = [json.dumps({'op': 'touch', 'id': content_id}) + '\n' for content_id in self._touched_ids]
+            self._touched_ids.clear()
+            if record is not None:
+                lines.append(json.dumps(record) + '\n')
+
+            if not lines:
+                return
+
+            # reopen the journal replaced by the compaction of the other process
+            if self._file is not None and os.fstat(self._file.fileno()).st_ino != os.stat(self.journal_path).st_ino:
+                self.close()
+
+            if self._file is None:
+                self._file = open(self.journal_path, 'a', encoding='utf-8')  # pylint: disable=consider-using-with
+
+            self._file.write(''.join(lines))
+            self._file.flush()
+            self.record_count += len(lines)
+
+    def append_put(self, content: Content):
+        self._append(self._to_record(content))
+
+    def append_touch(self, content_id: str):
+        """Batches the touch in memory, a cache hit does not take the file_lock()."""
+        with self._lock:
+            self._touched_ids[content_id] = None
+            self._touched_ids.move_to_end(content_id)
+
+    @property
+    def has_touches(self) -> bool:
+        with self._lock:
+            return len(self._touched_ids) > 0
+
+    def flush_touches(self):
+        if self.has_touches:
+            self._append(None)
+
+    def append_remove(self, content_id: str):
+        self._append({'op': 'remove', 'id': content_id})
+
+    def compact(self, contents: Iterable[Content]):
+        """Rewrites the journal, the caller holds the file_lock() and has merged the appended records.
+
+        The contents are in the least recently used order, so the batched touches are dropped.
+        """
+        with self._lock:
+            self.close()
+            self._touched_ids.clear()
+
+            temp_path = self.journal_path + '.tmp'
+            record_count = 0
+            with open(temp_path, 'w', encoding='utf-8') as file:
+                for content in contents:
+                    file.write(json.dumps(self._to_record(content)) + '\n')
+                    record_count += 1
+                file.flush()
+                os.fsync(file.fileno())
+                read_offset = file.tell()
+
+            os.replace(temp_path, self.journal_path)
+            self.record_count = record_count
+            self._read_offset = read_offset
+            self._read_inode = os.stat(self.journal_path).st_ino
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
 class CacheABC(ABC):
     @abstractmethod
     def cancel_fetch(self, url: URL):
@@ -99,6 +831,10 @@ class CacheABC(ABC):
     def remove_content(self, url: URL) -> bool:
         pass
 
+    @abstractmethod
+    def peek_content(self, url: URL) -> Optional[Content]:
+        pass
+
     @abstractmethod
     def try_get_content(self, url: URL) -> Optional[Content]:
         pass
@@ -108,7 +844,7 @@ class CacheABC(ABC):
         pass
 
     @abstractmethod
-    def async_get_content(self, url: URL, callback: Callback) -> Future:
+    def async_get_content(self, url: URL, callback: Callback, priority: Task.Priority = Task.Priority.DOWNLOAD) -> Future:
         pass
 
 
@@ -120,83 +856,307 @@ class ContentCache(CacheABC):
         cache_folder: str,
         temporary_dir: str,
         max_cache_size_bytes: int = 1024*1024*1024,
+        min_cache_size_ratio: float = 0.9,
         max_workers: int = 10,
         contents_load: bool = True,
-        contents_save_interval_secs: float = 5.0,
-        url_resolver: URLResolverABC = URLResolver()
+        contents_journal_compact_ratio: float = 2.0,
+        contents_journal_flush_interval_secs: float = 5.0,
+        content_lock_poll_interval_secs: float = 0.1,
+        partial_content_max_age_secs: float = 7*24*60*60,
+        segment_count: int = 4,
+        segment_min_size_bytes: int = 32*1024*1024,
+        max_host_workers: int = 10,
+        max_download_workers: int = 5,
+        download_bandwidth_limit_bytes: int = 0,
+        url_resolver: URLResolverABC = URLResolver(),
+        listeners: List[Listener] = None
     ):
         print(f'ContentCache.__init__: cache_folder={cache_folder}, temporary_dir={temporary_dir}')
         self.cache_folder: str = cache_folder
         self.max_cache_size_bytes: int = max_cache_size_bytes
+        self.min_cache_size_bytes: int = int(max_cache_size_bytes * min_cache_size_ratio)
         self.temporary_dir = temporary_dir
-        self.contents_save_interval_secs = contents_save_interval_secs
+        os.makedirs(temporary_dir, exist_ok=True)
+        self.contents_journal_compact_ratio = contents_journal_compact_ratio
+        self.contents_journal_flush_interval_secs = contents_journal_flush_interval_secs
+        self.content_lock_poll_interval_secs = content_lock_poll_interval_secs
+        self.partial_content_max_age_secs = partial_content_max_age_secs
+        self.segment_count = segment_count
+        self.segment_min_size_bytes = segment_min_size_bytes
         self.url_resolver = url_resolver
+        self.listeners: List[Listener] = [] if listeners is None else listeners
 
         self._lock = threading.RLock()
 
         self._executor = ThreadPoolExecutor(max_workers)
         self._tasks: Dict[URL, Task] = {}
+        self.scheduler = FetchScheduler(
+            self._executor, self._fetch, max_workers, max_host_workers, max_download_workers, download_bandwidth_limit_bytes
+        )
+
+        self._maintenance_executor = ThreadPoolExecutor(1)
+        self._closed = False
+        self._evict_contents_scheduled = False
+        self._compact_contents_scheduled = False
+        self._flush_touches_timer: Optional[threading.Timer] = None
 
-        self._contents: OrderedDict[str, Content] = OrderedDict()
+        self._contents = ContentShards()
         self._contents_size: int = 0
 
-        self._contents_save_timer = None
+        self._contents_journal: Optional[ContentJournal] = self._new_contents_journal()
+
+        os.makedirs(os.path.join(cache_folder, 'locks'), exist_ok=True)
 
         if contents_load:
             self._load_contents()
+            self._schedule_evict_contents()
+            self._maintenance_executor.submit(self._remove_stale_partial_contents)
 
-    def __del__(self):
-        self._save_contents()
-        self._executor.shutdown()
+    def close(self):
+        # the scheduler holds the bound _fetch, so the garbage collector can not be relied on to finalize the cache
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+
+            for task in self._tasks.values():
+                if task.state in {Task.State.QUEUING, Task.State.RUNNING}:
+                    task.state = Task.State.CANCELED
+
+            self.scheduler.close()
+
+            # the compaction in _close_contents writes the batched touches
+            if self._flush_touches_timer is not None:
+                self._flush_touches_timer.cancel()
+                self._flush_touches_timer = None
+
+        # the running fetches stop at the next chunk
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+        # the dispatched fetches the shutdown dropped before they ran
+        with self._lock:
+            for task in self._tasks.values():
+                task.future.cancel()
+        self._maintenance_executor.shutdown(wait=True)
+        self._close_contents()
+
+    def _new_contents_journal(self) -> Optional[ContentJournal]:
+        return ContentJournal(self.cache_folder)
 
     def _load_contents(self):
-        contents_json_path = os.path.join(self.cache_folder, 'contents.json')
-        if not os.path.exists(contents_json_path):
-            return
+        with self._lock:
+            contents = self._contents_journal.load_legacy_json()
+            if contents is None:
+                contents = self._contents_journal.load()
+
+            sqlite_contents = self._take_over_sqlite_contents()
+            if sqlite_contents:
+                content_ids = {c.id for c in contents}
+                # least recently used first, the contents of the other backend are older
+                contents = [c for c in sqlite_contents if c.id not in content_ids] + contents
+                with self._contents_journal.file_lock():
+                    self._contents_journal.compact(contents)
+
+            self._contents = ContentShards()
+            for content in contents:
+                self._contents.put(content)
+            self._contents_size = sum(c.length for c in contents)
+
+            print(f'_load_contents: {len(contents)} from {self._contents_journal.journal_path}')
+
+    def _take_over_sqlite_contents(self) -> Optional[List[Content]]:
+        """Returns the contents of the SQLite backend and removes its database, the files would be orphaned otherwise."""
+        if sqlite3 is None or not os.path.exists(SQLiteContents.to_database_path(self.cache_folder)):
+            return None
+
+        sqlite_contents = SQLiteContents(self.cache_folder)
+        try:
+            contents = sqlite_contents.to_list()
+        finally:
+            sqlite_contents.close()
+
+        SQLiteContents.remove_database(self.cache_folder)
+        print(f'_take_over_sqlite_contents: {len(contents)} from {sqlite_contents.database_path}')
+        return contents
+
+    def _refresh_contents(self):
+        # merge the records appended by the other processes sharing the cache folder
+        with self._lock:
+            records = self._contents_journal.load_appended()
+            if records is None:
+                self._load_contents()
+                return
+
+            for record in records:
+                content_id = record['id']
+                operation = record['op']
+                if operation == 'put':
+                    content = self._contents.pop(content_id)
+                    if content is not None:
+                        self._contents_size -= content.length
+                    content = self._contents_journal.to_content(record)
+                    self._contents.put(content)
+                    self._contents_size += content.length
+                elif operation == 'touch':
+                    self._contents.touch(content_id)
+                elif operation == 'remove':
+                    content = self._contents.pop(content_id)
+                    if content is not None:
+                        self._contents_size -= content.length
+
+    def _close_contents(self):
+        self._compact_contents()
+        self._contents_journal.close()
+
+    def _on_content_put(self, content: Content):
+        self._contents_journal.append_put(content)
+        self._schedule_compact_contents()
+
+    def _on_content_touched(self, content_id: str):
+        self._contents_journal.append_touch(content_id)
+        self._schedule_flush_touches()
+
+    def _on_content_removed(self, content_id: str):
+        self._contents_journal.append_remove(content_id)
+        self._schedule_compact_contents()
+
+    def _compact_contents(self):
+        with self._lock, self._contents_journal.file_lock():
+            self._compact_contents_scheduled = False
+            # the other processes may have appended records since the last read
+            self._refresh_contents()
+            contents = self._contents.to_list()
+            print(f'_compact_contents: {len(contents)} to {self._contents_journal.journal_path}')
+            self._contents_journal.compact(contents)
+
+    def _flush_touches(self):
+        with self._lock:
+            self._flush_touches_timer = None
+            if self._closed:
+                return
+
+            # once per interval, not once per cache hit
+            self._contents_journal.flush_touches()
+
+        self._schedule_compact_contents()
+
+    def _schedule_flush_touches(self):
+        with self._lock:
+            if self._closed or self._flush_touches_timer is not None:
+                return
+
+            self._flush_touches_timer = threading.Timer(self.contents_journal_flush_interval_secs, self._flush_touches)
+            self._flush_touches_timer.daemon = True
+            self._flush_touches_timer.start()
+
+    def _schedule_compact_contents(self):
+        with self._lock:
+            if self._closed or self._compact_contents_scheduled:
+                return
+
+            if self._contents_journal.record_count <= max(1000, len(self._contents) * self.contents_journal_compact_ratio):
+                return
+
+            self._compact_contents_scheduled = True
+
+        self._maintenance_executor.submit(self._compact_contents)
+
+    def _notify(self, content_id: str):
+        for listener in self.listeners:
+            try:
+                listener(content_id)
+            except:  # pylint: disable=bare-except
+                traceback.print_exc()
 
+    def _schedule_evict_contents(self):
         with self._lock:
-            with open(contents_json_path, 'r') as file:
-                content_json = json.load(file, object_pairs_hook=OrderedDict)
-
-            self._contents = OrderedDict({
-                key: Content(
-                    id=value['id'],
-                    state=Content.State[value['state']],
-                    filepath=os.path.join(self.cache_folder, value['filepath']),
-                    type=value['type'],
-                    length=value['length']
-                ) for key, value in content_json.items()
-            })
-            self._contents_size = sum([c.length for c in self._contents.values()])
-
-            print(f'_load_contents: {len(self._contents)} from {contents_json_path}')
-
-    def _save_contents(self):
-        contents_json_path = os.path.join(self.cache_folder, 'contents.json')
-        with self._lock:
-            print(f'_save_contents: {len(self._contents)} to {contents_json_path}')
-            content_json = {
-                key: {
-                    'id': value.id,
-                    'state': value.state.name,
-                    'filepath': os.path.basename(value.filepath) if value.filepath else '',
-                    'type': value.type,
-                    'length': value.length
-                } for key, value in self._contents.items()
-            }
-            with open(contents_json_path, 'w') as file:
-                json.dump(content_json, file)
-
-    def _schedule_save_contents(self):
-        if self._contents_save_timer is not None:
-            self._contents_save_timer.cancel()
-
-        self._contents_save_timer = threading.Timer(self.contents_save_interval_secs, self._save_contents)
-        self._contents_save_timer.start()
+            if self._closed or self._evict_contents_scheduled or self._contents_size <= self.max_cache_size_bytes:
+                return
+
+            self._evict_contents_scheduled = True
+
+        self._maintenance_executor.submit(self._evict_contents)
+
+    def _evict_contents(self):
+        evicted_contents: List[Content] = []
+
+        with self._lock:
+            self._evict_contents_scheduled = False
+
+            # evict the least recently used contents down to the low watermark
+            for content in self._contents.least_recently_used():
+                if self._contents_size <= self.min_cache_size_bytes:
+                    break
+
+                if content.length == 0:
+                    continue
+
+                if self._contents.pop(content.id) is None:
+                    continue
+
+                self._contents_size -= content.length
+                evicted_contents.append(content)
+
+            contents_size = self._contents_size
+
+        if len(evicted_contents) == 0:
+            return
+
+        for content in evicted_contents:
+            if content.filepath and os.path.exists(content.filepath):
+                try:
+                    os.remove(content.filepath)
+                except:  # pylint: disable=bare-except
+                    traceback.print_exc()
+
+            self._remove_content_lock(content.id)
+            self._on_content_removed(content.id)
+            self._notify(content.id)
+
+        print(f'_evict_contents: {len(evicted_contents)} contents, {contents_size} bytes left')
+
+    def _remove_stale_partial_contents(self):
+        # the partial contents of the canceled fetches are kept to resume, until nobody asks for them again
+        expired_at = time.time() - self.partial_content_max_age_secs
+        removed_count = 0
+
+        for entry in os.scandir(self.temporary_dir):
+            if not entry.name.endswith(('.part', '.part.json')):
+                continue
+
+            try:
+                if entry.stat().st_mtime < expired_at:
+                    os.remove(entry.path)
+                    removed_count += 1
+            except:  # pylint: disable=bare-except
+                traceback.print_exc()
+
+        if removed_count > 0:
+            print(f'_remove_stale_partial_contents: {removed_count} files from {self.temporary_dir}')
 
     def _to_content_filepath(self, content_id: str) -> str:
         return os.path.join(self.cache_folder, content_id)
 
+    def _to_content_lock_path(self, content_id: str) -> str:
+        return os.path.join(self.cache_folder, 'locks', f'{content_id}.lock')
+
+    def _remove_content_lock(self, content_id: str):
+        try:
+            ContentFileLock(self._to_content_lock_path(content_id)).try_remove()
+        except:  # pylint: disable=bare-except
+            traceback.print_exc()
+
+    def _find_shared_content(self, content_id: str) -> Optional[Content]:
+        # another process may have fetched the content while waiting for the lock
+        content = self._contents.get(content_id)
+        if content is None or content.state is not Content.State.CACHED:
+            return None
+
+        if not content.filepath or not os.path.exists(content.filepath):
+            return None
+
+        return content
+
     def _fetch(self, task: Task):
         # pylint: disable=too-many-statements
         with self._lock:
@@ -208,41 +1168,43 @@ class ContentCache(CacheABC):
 
         content_filepath = self._to_content_filepath(content_id)
         content = Content(content_id, Content.State.FETCHING)
+        content_lock = ContentFileLock(self._to_content_lock_path(content_id))
+        partial_content = PartialContent(self.temporary_dir, content_id)
 
         try:
-            temp_fd, temp_path = tempfile.mkstemp(dir=self.temporary_dir)
-            with os.fdopen(temp_fd, 'bw') as temp_file:
-                response = self.url_resolver.resolve(task.url)
-                response.raise_for_status()
-
-                content_type = response.headers.get('Content-Type')
-                content_length_text = response.headers.get('Content-Length')
-                content_length = int(content_length_text) if content_length_text else 0
-                fetch_size = 0
-
+            # single-flight across the processes sharing the cache folder
+            while not content_lock.try_acquire():
+                if task.state is not Task.State.RUNNING:
+                    raise InterruptedError(f'task (={task.url}) fetch was interrupted')
+                time.sleep(self.content_lock_poll_interval_secs)
+
+            self._refresh_contents()
+            shared_content = self._find_shared_content(content_id)
+            if shared_content is not None:
                 with self._lock:
-                    task.content_length = content_length
-                    task.fetched_size = fetch_size
-
-                for chunk in response.iter_content(chunk_size=65536):
-                    fetch_size += len(chunk)
-                    with self._lock:
-                        task.fetched_size = fetch_size
-                        if task.state is not Task.State.RUNNING:
-                            raise InterruptedError(f'task (={task.url}) fetch was interrupted')
-                    temp_file.write(chunk)
+                    task.state = Task.State.SUCCESS
+                content = shared_content
+
+            else:
+                response, resume_headers = self._resolve_partial(task, partial_content)
+                if response is None:
+                    # the partial content was completed before the rename was interrupted
+                    content_type = partial_content.load_validators(task.url).get('content_type')
+                else:
+                    content_type = self._download(task, partial_content, response, resume_headers)
 
-            os.rename(temp_path, content_filepath)
+                os.rename(partial_content.data_path, content_filepath)
+                partial_content.remove_validators()
 
-            content_length = os.path.getsize(content_filepath)
-            with self._lock:
-                self._contents_size += content_length
-                task.state = Task.State.SUCCESS
+                content_length = os.path.getsize(content_filepath)
+                with self._lock:
+                    self._contents_size += content_length
+                    task.state = Task.State.SUCCESS
 
-                content.state = Content.State.CACHED
-                content.filepath = content_filepath
-                content.length = content_length
-                content.type = content_type
+                    content.state = Content.State.CACHED
+                    content.filepath = content_filepath
+                    content.length = content_length
+                    content.type = content_type
 
         except:  # pylint: disable=bare-except
             traceback.print_exc()
@@ -254,17 +1216,113 @@ class ContentCache(CacheABC):
                 else:
                     pass  # keep state
 
-            if temp_path is not None:
-                os.remove(temp_path)
+            try:
+                # keep the partial content to resume on retry
+                if not partial_content.is_resumable():
+                    partial_content.remove()
+            except:  # pylint: disable=bare-except
+                traceback.print_exc()
         finally:
             with self._lock:
-                self._contents[content_id] = content
+                self._contents.put(content)
                 del self._tasks[task.url]
 
-        self._invoke_callbacks(task)
-        self._schedule_save_contents()
+            try:
+                # the waiters of the other processes look the content up in the journal once they hold the lock
+                self._on_content_put(content)
+            finally:
+                content_lock.release()
+
+        self._notify(content_id)
+        self._invoke_callbacks(task, content)
+        self._schedule_evict_contents()
         return task
 
+    def _resolve_partial(
+        self, task: Task, partial_content: PartialContent
+    ) -> Tuple[Optional[requests.models.Response], Dict[str, str]]:
+        if partial_content.is_completed(task.url):
+            return None, {}
+
+        resume_headers = partial_content.to_resume_headers(task.url)
+        response = self.url_resolver.resolve(task.url, resume_headers)
+        if 'Range' not in resume_headers:
+            return response, resume_headers
+
+        if response.status_code == 416:
+            response.close()
+            if partial_content.is_completed(task.url, response):
+                return None, {}
+
+        elif response.status_code != 206 or partial_content.to_resumed_size(response, resume_headers) > 0:
+            return response, resume_headers
+
+        else:
+            # the served range does not continue the partial content
+            response.close()
+
+        # the partial content does not match the current content, download from the beginning
+        partial_content.remove()
+        return self.url_resolver.resolve(task.url, {}), {}
+
+    def _download(
+        self, task: Task, partial_content: PartialContent, response: requests.models.Response, resume_headers: Dict[str, str]
+    ) -> Optional[str]:
+        response.raise_for_status()
+
+        # resume with the range request, or download from the beginning
+        fetch_size = partial_content.to_resumed_size(response, resume_headers)
+        if fetch_size == 0 and response.status_code != 200:
+            raise IOError(f'task (={task.url}) response (={response.status_code}) is not the whole content')
+
+        content_type = response.headers.get('Content-Type')
+        content_length_text = response.headers.get('Content-Length')
+        content_length = fetch_size + int(content_length_text) if content_length_text else 0
+
+        with self._lock:
+            task.content_length = content_length
+            task.fetched_size = fetch_size
+
+        if self._is_segmentable(task, response, fetch_size, content_length):
+            response.close()
+            # a preallocated file has holes, it can not be resumed by appending
+            partial_content.remove_validators()
+            etag = response.headers.get('ETag')
+            SegmentedDownload(
+                self.url_resolver, task, partial_content.data_path, content_length, self.segment_count,
+                self.scheduler.get_bandwidth(task),
+                etag if etag and not etag.startswith('W/') else response.headers.get('Last-Modified')
+            ).run(self.scheduler)
+
+        else:
+            partial_content.save_validators(task.url, response, content_length)
+
+            bandwidth = self.scheduler.get_bandwidth(task)
+            with open(partial_content.data_path, 'ab' if fetch_size > 0 else 'wb') as partial_file:
+                for chunk in response.iter_content(chunk_size=65536):
+                    bandwidth.consume(len(chunk))
+                    partial_file.write(chunk)
+                    fetch_size += len(chunk)
+                    # the progress is only written by this thread, no lock is needed
+                    task.fetched_size = fetch_size
+                    if task.state is not Task.State.RUNNING:
+                        raise InterruptedError(f'task (={task.url}) fetch was interrupted')
+
+        return content_type
+
+    def _is_segmentable(self, task: Task, response: requests.models.Response, fetch_size: int, content_length: int) -> bool:
+        if self.segment_count < 2 or content_length < self.segment_min_size_bytes or fetch_size > 0:
+            return False
+
+        if not task.url.startswith('http://') and not task.url.startswith('https://'):
+            return False
+
+        if response.status_code != 200 or response.headers.get('Accept-Ranges') != 'bytes':
+            return False
+
+        # Content-Length of an encoded response is not the size of the decoded content
+        return response.headers.get('Content-Encoding', 'identity') == 'identity'
+
     @staticmethod
     def _invoke_callback(callback, content):
         try:
@@ -272,11 +1330,10 @@ class ContentCache(CacheABC):
         except:  # pylint: disable=bare-except
             traceback.print_exc()
 
-    def _invoke_callbacks(self, task: Task):
+    def _invoke_callbacks(self, task: Task, content: Content):
         with self._lock:
             task_callbacks_copy = list(task.callbacks)
             task.callbacks.clear()
-            content = self._contents[task.content_id]
 
         for callback in task_callbacks_copy:
             self._invoke_callback(callback, content)
@@ -289,6 +1346,13 @@ class ContentCache(CacheABC):
             if task is None:
                 return
 
+            if task.state is Task.State.QUEUING:
+                if task.future.cancel():
+                    task.state = Task.State.CANCELED
+                    del self._tasks[url]
+                    self._notify(task.content_id)
+                return
+
             if task.state != Task.State.RUNNING:
                 return
 
@@ -296,61 +1360,41 @@ class ContentCache(CacheABC):
 
     def remove_content(self, url: URL) -> bool:
         with self._lock:
-            content = self.try_get_content(url)
+            content = self.peek_content(url)
             if content is None:
                 return False
 
-            del self._contents[content.id]
-
-            self._schedule_save_contents()
-
-        return True
-
-    def try_get_content(self, url: URL) -> Optional[Content]:
-        content_id = Content.to_content_id(url)
-        with self._lock:
-            if content_id not in self._contents:
-                return None
-
-            content = self._contents[content_id]
-
-            # LRU implementation
-            self._contents.move_to_end(content_id)
-            excess_cache_size = max(0, self._contents_size - self.max_cache_size_bytes)
-            if excess_cache_size > 0:
-                for content_id in self._contents.keys():
-                    content = self._contents[content_id]
-
-                    if content.length == 0:
-                        continue
+            if self._contents.pop(content.id) is None:
+                return False
 
-                    del self._contents[content_id]
-                    self._contents_size -= content.length
+            self._contents_size -= content.length
 
-                    if os.path.exists(content.file_path):
-                        try:
-                            os.remove(content.file_path)
-                        except:  # pylint: disable=bare-except
-                            traceback.print_exc()
+        self._remove_content_lock(content.id)
+        self._on_content_removed(content.id)
+        self._notify(content.id)
 
-                    excess_cache_size -= content.length
-                    if excess_cache_size <= 0:
-                        break
+        return True
 
-                self._schedule_save_contents()
+    def peek_content(self, url: URL) -> Optional[Content]:
+        return self._contents.get(Content.to_content_id(url))
 
-            return content
+    def try_get_content(self, url: URL) -> Optional[Content]:
+        # LRU implementation, the eviction runs on the maintenance thread
+        content = self._contents.touch(Content.to_content_id(url))
+        if content is not None:
+            self._on_content_touched(content.id)
+        return content
 
     def try_get_task(self, url: URL) -> Optional[Task]:
-        with self._lock:
-            return self._tasks[url] if url in self._tasks else None
+        return self._tasks.get(url)
 
-    def async_get_content(self, url: URL, callback: Callback) -> Future:
+    def async_get_content(self, url: URL, callback: Callback, priority: Task.Priority = Task.Priority.DOWNLOAD) -> Future:
         def queue_callback():
             task = self._tasks[url]
             if task.state not in {Task.State.QUEUING, Task.State.RUNNING}:
                 raise ValueError(f'task (={task.url}) is invalid state (={task.state})')
             task.callbacks.append(callback)
+            self.scheduler.reprioritize(task, priority)
             return task.future
 
         with self._lock:
@@ -367,25 +1411,242 @@ class ContentCache(CacheABC):
                     case _: # maybe failed
                         self.remove_content(url)
 
-            task = Task(url, Task.State.QUEUING, [callback])
-            task.future = self._executor.submit(self._fetch, task)
+            task = Task(url, Task.State.QUEUING, [callback], priority)
+            self.scheduler.submit(task)
             self._tasks[url] = task
+            self._notify(task.content_id)
             return task.future
 
 
+class SQLiteContents:
+    BATCH_SIZE = 256
+    DATABASE_NAME = 'contents.sqlite3'
+
+    def __init__(self, cache_folder: str, database_name: str = DATABASE_NAME):
+        self.cache_folder = cache_folder
+        self.database_path = self.to_database_path(cache_folder, database_name)
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.database_path, timeout=30.0, isolation_level=None, check_same_thread=False)
+
+        with self._lock:
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            with self._transaction():
+                self._connection.execute(
+                    'CREATE TABLE IF NOT EXISTS contents ('
+                    ' id TEXT PRIMARY KEY,'
+                    ' state TEXT NOT NULL,'
+                    ' filepath TEXT NOT NULL,'
+                    ' type TEXT,'
+                    ' length INTEGER NOT NULL,'
+                    ' accessed_at REAL NOT NULL'
+                    ')'
+                )
+                self._connection.execute('CREATE INDEX IF NOT EXISTS contents_accessed_at ON contents (accessed_at, id)')
+
+                # the total length is updated with the contents, the eviction reads one row instead of summing all of them
+                self._connection.execute(
+                    'CREATE TABLE IF NOT EXISTS contents_size ('
+                    ' id INTEGER PRIMARY KEY CHECK (id = 0),'
+                    ' total_length INTEGER NOT NULL'
+                    ')'
+                )
+                self._connection.execute('INSERT OR IGNORE INTO contents_size (id, total_length) SELECT 0, COALESCE(SUM(length), 0) FROM contents')
+                self._connection.execute('DROP INDEX IF EXISTS contents_length')
+
+    @staticmethod
+    def to_database_path(cache_folder: str, database_name: str = DATABASE_NAME) -> str:
+        return os.path.join(cache_folder, database_name)
+
+    @staticmethod
+    def remove_database(cache_folder: str, database_name: str = DATABASE_NAME):
+        database_path = SQLiteContents.to_database_path(cache_folder, database_name)
+        for path in (database_path, database_path + '-wal', database_path + '-shm'):
+            if os.path.exists(path):
+                os.remove(path)
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        # the caller holds the _lock, IMMEDIATE serializes the writers of the processes sharing the database
+        self._connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield
+        except:  # pylint: disable=bare-except
+            self._connection.execute('ROLLBACK')
+            raise
+        self._connection.execute('COMMIT')
+
+    def _add_total_length(self, length: int):
+        if length != 0:
+            self._connection.execute('UPDATE contents_size SET total_length = total_length + ? WHERE id = 0', (length,))
+
+    def _to_content(self, row: Tuple[str, str, str, str, int]) -> Content:
+        content_id, state, filepath, content_type, length = row
+        return Content(
+            id=content_id,
+            state=Content.State[state],
+            filepath=os.path.join(self.cache_folder, filepath),
+            type=content_type,
+            length=length
+        )
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection.execute('SELECT COUNT(*) FROM contents').fetchone()[0]
+
+    def total_length(self) -> int:
+        with self._lock:
+            return self._connection.execute('SELECT total_length FROM contents_size WHERE id = 0').fetchone()[0]
+
+    def get(self, content_id: str) -> Optional[Content]:
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT id, state, filepath, type, length FROM contents WHERE id = ?', (content_id,)
+            ).fetchone()
+        return None if row is None else self._to_content(row)
+
+    def touch(self, content_id: str) -> Optional[Content]:
+        with self._lock:
+            self._connection.execute('UPDATE contents SET accessed_at = ? WHERE id = ?', (time.time(), content_id))
+        return self.get(content_id)
+
+    def _insert(self, content: Content, accessed_at: float, conflict: str = 'REPLACE'):
+        row = self._connection.execute('SELECT length FROM contents WHERE id = ?', (content.id,)).fetchone()
+        if row is not None and conflict == 'IGNORE':
+            return
+
+        self._connection.execute(
+            f'INSERT OR {conflict} INTO contents (id, state, filepath, type, length, accessed_at) VALUES (?, ?, ?, ?, ?, ?)',
+            (content.id, content.state.name, os.path.basename(content.filepath) if content.filepath else '', content.type, content.length, accessed_at)
+        )
+        self._add_total_length(content.length - (0 if row is None else row[0]))
+
+    def put(self, content: Content):
+        with self._lock, self._transaction():
+            self._insert(content, time.time())
+
+    def put_all_least_recently_used(self, contents: Iterable[Content]):
+        """Puts the contents of the other backend, least recently used first, they stay older than the contents already put."""
+        with self._lock, self._transaction():
+            for accessed_at, content in enumerate(contents):
+                self._insert(content, accessed_at, 'IGNORE')
+
+    def pop(self, content_id: str) -> Optional[Content]:
+        with self._lock, self._transaction():
+            row = self._connection.execute(
+                'SELECT id, state, filepath, type, length FROM contents WHERE id = ?', (content_id,)
+            ).fetchone()
+            if row is None:
+                return None
+
+            self._connection.execute('DELETE FROM contents WHERE id = ?', (content_id,))
+            self._add_total_length(-row[4])
+        return self._to_content(row)
+
+    def least_recently_used(self) -> Iterator[Content]:
+        # fetch in batches, the lock must not be held while the caller pops the contents
+        last_accessed_at, last_id = float('-inf'), ''
+        while True:
+            with self._lock:
+                rows = self._connection.execute(
+                    'SELECT id, state, filepath, type, length, accessed_at FROM contents'
+                    ' WHERE (accessed_at, id) > (?, ?) ORDER BY accessed_at, id LIMIT ?',
+                    (last_accessed_at, last_id, self.BATCH_SIZE)
+                ).fetchall()
+
+            for row in rows:
+                yield self._to_content(row[:5])
+
+            if len(rows) < self.BATCH_SIZE:
+                return
+
+            last_id, last_accessed_at = rows[-1][0], rows[-1][5]
+
+    def to_list(self) -> List[Content]:
+        return list(self.least_recently_used())
+
+    def close(self):
+        with self._lock:
+            if self._connection is None:
+                return
+
+            self._connection.close()
+            self._connection = None
+
+
+class SQLiteContentCache(ContentCache):
+    def _new_contents_journal(self) -> Optional[ContentJournal]:
+        # SQLite stores the contents on every change, nothing to journal
+        return None
+
+    def _load_contents(self):
+        with self._lock:
+            self._contents = SQLiteContents(self.cache_folder)
+            self._take_over_journal_contents()
+            self._contents_size = self._contents.total_length()
+
+            print(f'_load_contents: {self._contents_size} bytes in {self._contents.database_path}')
+
+    def _take_over_journal_contents(self):
+        """Puts the contents of the journal backend and removes the journal, the files would be orphaned otherwise."""
+        contents_journal = ContentJournal(self.cache_folder)
+        # the legacy contents.json is converted to the journal first
+        contents_journal.load_legacy_json()
+
+        with contents_journal.file_lock():
+            if not os.path.exists(contents_journal.journal_path):
+                return
+
+            contents = contents_journal.load()
+            self._contents.put_all_least_recently_used(contents)
+            os.remove(contents_journal.journal_path)
+
+        print(f'_take_over_journal_contents: {len(contents)} from {contents_journal.journal_path}')
+
+    def _refresh_contents(self):
+        # the database is shared by the processes, nothing to merge
+        pass
+
+    def _close_contents(self):
+        # an open database can not be removed on Windows, close() must run before the cache folder is deleted
+        if isinstance(self._contents, SQLiteContents):
+            self._contents.close()
+            self._contents = ContentShards()
+
+    def _schedule_evict_contents(self):
+        # other processes sharing the database change the total size, it is one row
+        if isinstance(self._contents, SQLiteContents):
+            with self._lock:
+                self._contents_size = self._contents.total_length()
+
+        super()._schedule_evict_contents()
+
+    # SQLite stores the contents on every change, nothing to journal
+    def _on_content_put(self, content: Content):
+        pass
+
+    def _on_content_touched(self, content_id: str):
+        pass
+
+    def _on_content_removed(self, content_id: str):
+        pass
+
+
 class ReloadableContentCache(CacheABC):
     _cache: CacheABC = None
 
     def __init__(self):
-        pass
+        self._listeners: List[Listener] = []
+
+    def add_listener(self, listener: Listener):
+        self._listeners.append(listener)
 
     def delete_cache_object(self):
         if self._cache is not None:
-            with self._cache._lock:  # pylint: disable=protected-access
-                try:
-                    del self._cache
-                except:  # pylint: disable=bare-except
-                    traceback.print_exc()
+            try:
+                self._cache.close()
+            except:  # pylint: disable=bare-except
+                traceback.print_exc()
             self._cache = None
 
     def reload(self):
@@ -396,26 +1657,50 @@ class ReloadableContentCache(CacheABC):
         if not os.path.exists(asset_cache_folder):
             os.makedirs(asset_cache_folder, exist_ok=True)
 
-        self._cache = ContentCache(
+        if preferences.asset_cache_backend == 'SQLITE' and sqlite3 is not None:
+            cache_class = SQLiteContentCache
+        else:
+            cache_class = ContentCache
+
+        self._cache = cache_class(
             cache_folder=asset_cache_folder,
             max_cache_size_bytes=preferences.asset_max_cache_size*1024*1024,
-            temporary_dir=tempfile.mkdtemp()
+            temporary_dir=os.path.join(asset_cache_folder, 'temporary'),
+            max_host_workers=preferences.asset_max_fetches_per_host,
+            download_bandwidth_limit_bytes=preferences.asset_download_bandwidth_limit*1024,
+            listeners=self._listeners
         )
 
+        for listener in self._listeners:
+            listener(None)
+
+    def update_scheduler(self):
+        if self._cache is None:
+            return
+
+        preferences = get_preferences()
+        scheduler: FetchScheduler = self._cache.scheduler
+        scheduler.max_host_workers = preferences.asset_max_fetches_per_host
+        scheduler.download_bandwidth.rate_bytes_per_sec = preferences.asset_download_bandwidth_limit*1024
+        scheduler.dispatch()
+
     def cancel_fetch(self, url: URL):
         self._cache.cancel_fetch(url)
 
     def remove_content(self, url: URL) -> bool:
         return self._cache.remove_content(url)
 
+    def peek_content(self, url: URL) -> Optional[Content]:
+        return self._cache.peek_content(url)
+
     def try_get_content(self, url: URL) -> Optional[Content]:
         return self._cache.try_get_content(url)
 
     def try_get_task(self, url: URL) -> Optional[Task]:
         return self._cache.try_get_task(url)
 
-    def async_get_content(self, url: URL, callback: Callback) -> Future:
-        return self._cache.async_get_content(url, callback)
+    def async_get_content(self, url: URL, callback: Callback, priority: Task.Priority = Task.Priority.DOWNLOAD) -> Future:
+        return self._cache.async_get_content(url, callback, priority)
 
     def delete_cache_folder(self):
         cache_folder = self._cache.cache_folder
@@ -427,3 +1712,4 @@ class ReloadableContentCache(CacheABC):
 
 CONTENT_CACHE = ReloadableContentCache()
 REGISTER_HOOKS.append(CONTENT_CACHE.reload)
+UNREGISTER_HOOKS.append(CONTENT_CACHE.delete_cache_object)
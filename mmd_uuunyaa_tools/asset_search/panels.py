@@ -3,20 +3,22 @@
 # This file is part of MMD UuuNyaa Tools.
 
 import functools
+import math
 import os
+import threading
 import time
 from enum import Enum
-from typing import List, Optional, Tuple
+from typing import Callable, Dict, List, Optional, Set, Tuple
 
 import bpy
 import bpy.utils.previews
 from mmd_uuunyaa_tools import PACKAGE_PATH
-from mmd_uuunyaa_tools.asset_search.actions import ImportActionExecutor, MessageException
-from mmd_uuunyaa_tools.asset_search.assets import ASSETS, AssetDescription, AssetType
+from mmd_uuunyaa_tools.asset_search.actions import IMPORT_TASKS, ImportActionExecutor, ImportTask, MessageException
+from mmd_uuunyaa_tools.asset_search.assets import ASSETS, AssetDescription
 from mmd_uuunyaa_tools.asset_search.cache import CONTENT_CACHE, Content, Task
 from mmd_uuunyaa_tools.asset_search.operators import DeleteDebugAssetJson, ReloadAssetJsons, UpdateAssetJson, UpdateDebugAssetJson
 from mmd_uuunyaa_tools.m17n import _, iface_
-from mmd_uuunyaa_tools.utilities import get_preferences, label_multiline, to_human_friendly_text, to_int32
+from mmd_uuunyaa_tools.utilities import get_preferences, label_multiline, to_context_override, to_human_friendly_text, to_int32
 
 PREVIEWS: Optional[bpy.utils.previews.ImagePreviewCollection]
 
@@ -27,24 +29,20 @@ class AssetState(Enum):
     CACHED = 2
     EXTRACTED = 3
     FAILED = 4
+    EXTRACTING = 5
     UNKNOWN = -1
 
 
 class Utilities:
     @staticmethod
-    def is_importable(asset: AssetDescription) -> bool:
-        return (
-            ASSETS.is_extracted(asset.id)
-            or
-            CONTENT_CACHE.try_get_content(asset.download_action) is not None
-        )
+    def get_asset_state(asset: AssetDescription, is_extracted: Callable[[str], bool] = ASSETS.is_extracted) -> Tuple[AssetState, Optional[Content], Optional[Task]]:
+        if IMPORT_TASKS.try_get_task(asset.id) is not None:
+            return (AssetState.EXTRACTING, None, None)
 
-    @staticmethod
-    def get_asset_state(asset: AssetDescription) -> Tuple[AssetState, Optional[Content], Optional[Task]]:
-        if ASSETS.is_extracted(asset.id):
+        if is_extracted(asset.id):
             return (AssetState.EXTRACTED, None, None)
 
-        content = CONTENT_CACHE.try_get_content(asset.download_action)
+        content = CONTENT_CACHE.peek_content(asset.download_action)
         if content is not None:
             if content.state is Content.State.CACHED:
                 return (AssetState.CACHED, content, None)
@@ -67,11 +65,96 @@ class Utilities:
         return ASSETS.resolve_path(asset.id)
 
 
+class AssetStateTable:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._states: Dict[str, Tuple[AssetDescription, Tuple[AssetState, Optional[Content], Optional[Task]]]] = {}
+        self._content_id2asset_ids: Dict[str, Set[str]] = {}
+        self._asset_id2extracted: Dict[str, bool] = {}
+        self._generation: int = 0
+
+    def get(self, asset: AssetDescription) -> Tuple[AssetState, Optional[Content], Optional[Task]]:
+        entry = self._states.get(asset.id)
+        if entry is not None and entry[0] is asset:
+            return entry[1]
+
+        generation = self._generation
+        state = Utilities.get_asset_state(asset, self.is_extracted)
+        if state[0] is AssetState.UNKNOWN:
+            return state
+
+        with self._lock:
+            self._content_id2asset_ids.setdefault(Content.to_content_id(asset.download_action), set()).add(asset.id)
+            if generation == self._generation:
+                self._states[asset.id] = (asset, state)
+
+        return state
+
+    def is_extracted(self, asset_id: str) -> bool:
+        """Memoizes the file system check of ASSETS.is_extracted, only the import tasks change it."""
+        extracted = self._asset_id2extracted.get(asset_id)
+        if extracted is not None:
+            return extracted
+
+        generation = self._generation
+        extracted = ASSETS.is_extracted(asset_id)
+
+        with self._lock:
+            if generation == self._generation:
+                self._asset_id2extracted[asset_id] = extracted
+
+        return extracted
+
+    def is_importable(self, asset: AssetDescription) -> bool:
+        return self.get(asset)[0] in {AssetState.EXTRACTED, AssetState.EXTRACTING, AssetState.CACHED, AssetState.FAILED}
+
+    def invalidate(self, asset_id: str):
+        with self._lock:
+            self._generation += 1
+            self._states.pop(asset_id, None)
+            self._asset_id2extracted.pop(asset_id, None)
+
+    def invalidate_content(self, content_id: Optional[str]):
+        with self._lock:
+            self._generation += 1
+
+            if content_id is None:
+                self._states.clear()
+                self._asset_id2extracted.clear()
+                return
+
+            for asset_id in self._content_id2asset_ids.get(content_id, ()):
+                self._states.pop(asset_id, None)
+
+    def clear(self):
+        self.invalidate_content(None)
+
+
+ASSET_STATES = AssetStateTable()
+CONTENT_CACHE.add_listener(ASSET_STATES.invalidate_content)
+IMPORT_TASKS.add_listener(ASSET_STATES.invalidate)
+
+
 class AssetSearch(bpy.types.Operator):
     bl_idname = 'mmd_uuunyaa_tools.asset_search'
     bl_label = 'Search Asset'
     bl_options = {'INTERNAL'}
 
+    _asset_ids: List[str] = []
+    _thumbnail_urls: Set[str] = set()
+
+    @staticmethod
+    def _tag_redraw(region: Optional[bpy.types.Region]):
+        if region is not None:
+            region.tag_redraw()
+            return
+
+        # searches scheduled by timers have no region
+        for window in bpy.context.window_manager.windows:
+            for area in window.screen.areas:
+                if area.type == 'VIEW_3D':
+                    area.tag_redraw()
+
     @staticmethod
     def _on_thumbnail_fetched(search_result, region, update_time, asset, content):
         if search_result.update_time != update_time:
@@ -86,14 +169,50 @@ class AssetSearch(bpy.types.Operator):
                 content.filepath = os.path.join(PACKAGE_PATH, 'thumbnails', 'ASSET_THUMBNAIL_EMPTY.png')
             PREVIEWS.load(asset.thumbnail_url, content.filepath, 'IMAGE')
 
-        region.tag_redraw()
+        AssetSearch._tag_redraw(region)
+
+    @staticmethod
+    def _on_thumbnail_prefetched(_content):
+        pass
+
+    @staticmethod
+    def show_page(search_result, region, page: int):
+        page_size = get_preferences().asset_search_results_max_display_count
+        page = max(0, min(page, search_result.page_count - 1))
+
+        page_assets = [ASSETS[i] for i in AssetSearch._asset_ids[page*page_size:(page+1)*page_size] if i in ASSETS]
+        next_page_assets = [ASSETS[i] for i in AssetSearch._asset_ids[(page+1)*page_size:(page+2)*page_size] if i in ASSETS]
+
+        update_time = to_int32(time.time_ns() >> 10)
+        search_result.page = page
+        search_result.count = len(page_assets)
+        search_result.asset_items.clear()
+        search_result.update_time = update_time
+
+        thumbnail_urls = {asset.thumbnail_url for asset in page_assets + next_page_assets}
+
+        # cancel the thumbnail fetches of the superseded search
+        for thumbnail_url in AssetSearch._thumbnail_urls - thumbnail_urls:
+            CONTENT_CACHE.cancel_fetch(thumbnail_url)
+        AssetSearch._thumbnail_urls = thumbnail_urls
+
+        for asset in page_assets:
+            CONTENT_CACHE.async_get_content(
+                asset.thumbnail_url,
+                functools.partial(AssetSearch._on_thumbnail_fetched, search_result, region, update_time, asset),
+                Task.Priority.VISIBLE
+            )
+
+        # warm up the cache for the next page
+        for asset in next_page_assets:
+            CONTENT_CACHE.async_get_content(asset.thumbnail_url, AssetSearch._on_thumbnail_prefetched, Task.Priority.PREFETCH)
 
     def execute(self, context):
         # pylint: disable=too-many-locals
 
         preferences = get_preferences()
 
-        max_search_result_count = preferences.asset_search_results_max_display_count
+        page_size = preferences.asset_search_results_max_display_count
 
         query = context.scene.mmd_uuunyaa_tools_asset_search.query
         query_type = query.type
@@ -102,31 +221,18 @@ class AssetSearch(bpy.types.Operator):
         query_is_cached = query.is_cached
 
         enabled_tag_names = {tag.name for tag in query_tags if tag.enabled}
-        enabled_tag_count = len(enabled_tag_names)
-
-        search_results: List[AssetDescription] = []
-        search_results = [
-            asset for asset in ASSETS.values() if (
-                query_type in {AssetType.ALL.name, asset.type.name}
-                and enabled_tag_count == len(asset.tag_names & enabled_tag_names)
-                and query_text in asset.keywords
-                and (Utilities.is_importable(asset) if query_is_cached else True)
-            )
-        ]
+
+        search_results: List[AssetDescription] = ASSETS.search(query_type, query_text, enabled_tag_names)
+        if query_is_cached:
+            search_results = [asset for asset in search_results if ASSET_STATES.is_importable(asset)]
 
         hit_count = len(search_results)
-        update_time = to_int32(time.time_ns() >> 10)
         result = context.scene.mmd_uuunyaa_tools_asset_search.result
-        result.count = min(max_search_result_count, hit_count)
         result.hit_count = hit_count
-        result.asset_items.clear()
-        result.update_time = update_time
+        result.page_count = max(1, math.ceil(hit_count / page_size))
 
-        for asset in search_results[:max_search_result_count]:
-            CONTENT_CACHE.async_get_content(
-                asset.thumbnail_url,
-                functools.partial(self._on_thumbnail_fetched, result, context.region, update_time, asset)
-            )
+        AssetSearch._asset_ids = [asset.id for asset in search_results]
+        self.show_page(result, context.region, 0)
 
         tag_names = set()
         for asset in search_results:
@@ -146,6 +252,18 @@ class AssetSearch(bpy.types.Operator):
         return {'FINISHED'}
 
 
+class AssetSearchPage(bpy.types.Operator):
+    bl_idname = 'mmd_uuunyaa_tools.asset_search_page'
+    bl_label = 'Show Asset Search Page'
+    bl_options = {'INTERNAL'}
+
+    page: bpy.props.IntProperty()
+
+    def execute(self, context):
+        AssetSearch.show_page(context.scene.mmd_uuunyaa_tools_asset_search.result, context.region, self.page)
+        return {'FINISHED'}
+
+
 class AssetDownload(bpy.types.Operator):
     bl_idname = 'mmd_uuunyaa_tools.asset_download'
     bl_label = 'Download Asset'
@@ -154,13 +272,30 @@ class AssetDownload(bpy.types.Operator):
     asset_id: bpy.props.StringProperty()
 
     @staticmethod
-    def __on_fetched(_, asset, content):
+    def __on_fetched(_, asset, extract_on_download, content):
         print(f'done: {asset.name}, {asset.id}, {content.state}, {content.id}')
 
+        if not extract_on_download or content.state is not Content.State.CACHED:
+            return
+
+        # called on the fetch thread, the preferences are read on the main thread
+        IMPORT_TASKS.call_on_main_thread(functools.partial(AssetDownload.__extract_on_download, asset, content))
+
+    @staticmethod
+    def __extract_on_download(asset, content):
+        # speculatively extract, the import only has to run the Blender operators
+        if ImportActionExecutor.is_extraction_first(asset) and not ASSETS.is_extracted(asset.id):
+            IMPORT_TASKS.submit(asset, content.filepath)
+
     def execute(self, context):
         print(f'do: {self.bl_idname}, {self.asset_id}')
         asset = ASSETS[self.asset_id]
-        CONTENT_CACHE.async_get_content(asset.download_action, functools.partial(self.__on_fetched, context, asset))
+        extract_on_download = get_preferences().asset_extract_on_download
+        CONTENT_CACHE.async_get_content(
+            asset.download_action,
+            functools.partial(self.__on_fetched, context, asset, extract_on_download),
+            Task.Priority.DOWNLOAD
+        )
         return {'FINISHED'}
 
 
@@ -215,17 +350,52 @@ class AssetImport(bpy.types.Operator):
     def poll(cls, context):
         return bpy.context.mode == 'OBJECT'
 
+    @staticmethod
+    def _report_error(message: str):
+        def draw(menu, _context):
+            label_multiline(menu.layout, text=message, width=400)
+
+        bpy.context.window_manager.popup_menu(draw, title=iface_('Import Asset'), icon='ERROR')
+
+    @staticmethod
+    def _on_file_actions_executed(task: ImportTask):
+        print(f'done: {task.asset.name}, {task.asset.id}, {task.state}')
+
+        with bpy.context.temp_override(**to_context_override()):
+            if task.state is ImportTask.State.FAILURE:
+                AssetImport._report_error(str(task.exception))
+                return
+
+            if task.state is not ImportTask.State.SUCCESS:
+                return
+
+            try:
+                ImportActionExecutor.execute_blender_actions(task.asset, task.target_file)
+            except MessageException as ex:
+                AssetImport._report_error(str(ex))
+
     def execute(self, context):
         print(f'do: {self.bl_idname}')
 
         asset = ASSETS[self.asset_id]
         content = CONTENT_CACHE.try_get_content(asset.download_action)
 
-        try:
-            ImportActionExecutor.execute_import_action(asset, content.filepath if content is not None else None)
-        except MessageException as ex:
-            self.report(type={'ERROR'}, message=str(ex))
+        # extract on a worker thread, then import on the main thread
+        IMPORT_TASKS.submit(asset, content.filepath if content is not None else None, AssetImport._on_file_actions_executed)
+
+        return {'FINISHED'}
+
 
+class AssetImportCancel(bpy.types.Operator):
+    bl_idname = 'mmd_uuunyaa_tools.asset_import_cancel'
+    bl_label = 'Cancel Asset Import'
+    bl_options = {'INTERNAL'}
+
+    asset_id: bpy.props.StringProperty()
+
+    def execute(self, context):
+        print(f'do: {self.bl_idname}')
+        IMPORT_TASKS.cancel(self.asset_id)
         return {'FINISHED'}
 
 
@@ -278,7 +448,7 @@ class AssetDetailPopup(bpy.types.Operator):
 
         draw_title(col, _('Source:')).operator('wm.url_open', text=asset.source_url, icon='URL').url = asset.source_url
 
-        (asset_state, content, task) = Utilities.get_asset_state(asset)
+        (asset_state, content, task) = ASSET_STATES.get(asset)
 
         if asset_state is AssetState.INITIALIZED:
             layout.operator(AssetDownload.bl_idname, text=_('Download'), icon='TRIA_DOWN_BAR').asset_id = asset.id
@@ -304,6 +474,15 @@ class AssetDetailPopup(bpy.types.Operator):
             draw_title(layout, _('Path:')).operator('wm.path_open', text=asset_path, icon='FILEBROWSER').filepath = asset_path
             layout.operator(AssetImport.bl_idname, text=_('Import'), icon='IMPORT').asset_id = asset.id
 
+        elif asset_state is AssetState.EXTRACTING:
+            import_task = IMPORT_TASKS.try_get_task(asset.id)
+            if import_task is not None and import_task.progress.total_size > 0:
+                text = f'{iface_("Extracting")} {to_human_friendly_text(import_task.progress.extracted_size)}B / {to_human_friendly_text(import_task.progress.total_size)}B'
+            else:
+                text = iface_('Extracting')
+            draw_titled_label(layout, title=_('Import:'), text=text)
+            layout.operator(AssetImportCancel.bl_idname, text=_('Cancel'), icon='CANCEL').asset_id = asset.id
+
         elif asset_state is AssetState.FAILED:
             layout.operator(AssetDownload.bl_idname, text=_('Retry'), icon='FILE_REFRESH').asset_id = asset.id
 
@@ -370,6 +549,17 @@ class AssetSearchPanel(bpy.types.Panel):
             search_result_hit_count=search.result.hit_count,
         ))
 
+        if search.result.page_count > 1:
+            row = layout.row(align=True)
+            row.alignment = 'CENTER'
+            col = row.column(align=True)
+            col.enabled = search.result.page > 0
+            col.operator(AssetSearchPage.bl_idname, text='', icon='TRIA_LEFT').page = search.result.page - 1
+            row.label(text=f'{search.result.page + 1} / {search.result.page_count}')
+            col = row.column(align=True)
+            col.enabled = search.result.page < search.result.page_count - 1
+            col.operator(AssetSearchPage.bl_idname, text='', icon='TRIA_RIGHT').page = search.result.page + 1
+
         asset_items = context.scene.mmd_uuunyaa_tools_asset_search.result.asset_items
 
         display_count = 0
@@ -386,11 +576,11 @@ class AssetSearchPanel(bpy.types.Panel):
             if asset.thumbnail_url not in PREVIEWS:
                 continue
 
-            (asset_state, _content, _task) = Utilities.get_asset_state(asset)
+            (asset_state, _content, _task) = ASSET_STATES.get(asset)
 
             if asset_state is AssetState.INITIALIZED:
                 icon = 'NONE'
-            elif asset_state is AssetState.DOWNLOADING:
+            elif asset_state in {AssetState.DOWNLOADING, AssetState.EXTRACTING}:
                 icon = 'SORTTIME'
             elif asset_state is AssetState.CACHED:
                 icon = 'SOLO_OFF'
@@ -4,13 +4,27 @@
 
 import bpy
 from mmd_uuunyaa_tools.asset_search.assets import AssetType, AssetUpdater
+from mmd_uuunyaa_tools.utilities import to_context_override
+
+
+SEARCH_DEBOUNCE_INTERVAL_SECS = 0.2
+
+
+def _execute_search():
+    # timers run without a window, the search redraws the 3D viewports when the region is left out
+    with bpy.context.temp_override(**to_context_override(region_type=None)):
+        bpy.ops.mmd_uuunyaa_tools.asset_search()  # pylint: disable=no-member
 
 
 def update_search_query(_, context):
     if context.scene.mmd_uuunyaa_tools_asset_search.query.is_updating:
         return
 
-    bpy.ops.mmd_uuunyaa_tools.asset_search()  # pylint: disable=no-member
+    # coalesce rapid query changes into a single search
+    if bpy.app.timers.is_registered(_execute_search):
+        bpy.app.timers.unregister(_execute_search)
+
+    bpy.app.timers.register(_execute_search, first_interval=SEARCH_DEBOUNCE_INTERVAL_SECS)
 
 
 class TagItem(bpy.types.PropertyGroup):
@@ -26,6 +40,8 @@ class AssetItem(bpy.types.PropertyGroup):
 class AssetSearchResult(bpy.types.PropertyGroup):
     count: bpy.props.IntProperty(options={'SKIP_SAVE'})
     hit_count: bpy.props.IntProperty(options={'SKIP_SAVE'})
+    page: bpy.props.IntProperty(options={'SKIP_SAVE'})
+    page_count: bpy.props.IntProperty(options={'SKIP_SAVE'})
     asset_items: bpy.props.CollectionProperty(type=AssetItem, options={'SKIP_SAVE'})
     update_time: bpy.props.IntProperty(options={'SKIP_SAVE'})
 
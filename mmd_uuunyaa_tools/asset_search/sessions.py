@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021 UuuNyaa <UuuNyaa@gmail.com>
+# This file is part of MMD UuuNyaa Tools.
+
+import threading
+import urllib.parse
+from typing import Dict, Tuple
+
+import requests
+from mmd_uuunyaa_tools import UNREGISTER_HOOKS
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+class PooledSession(requests.Session):
+    def __init__(self, registry: 'SessionRegistry'):
+        super().__init__()
+        self._registry = registry
+
+    def get_adapter(self, url: str) -> requests.adapters.BaseAdapter:
+        parsed = urllib.parse.urlparse(url)
+        if parsed.scheme not in {'http', 'https'}:
+            return super().get_adapter(url)
+
+        return self._registry.get_adapter(parsed.scheme, parsed.netloc)
+
+    def close(self):
+        # the adapters are owned by the registry
+        pass
+
+
+class SessionRegistry:
+    def __init__(
+        self,
+        pool_maxsize: int = 10,
+        retry_total: int = 3,
+        retry_backoff_factor: float = 0.5,
+        retry_status_forcelist: Tuple[int, ...] = (429, 500, 502, 503, 504),
+    ):
+        self.pool_maxsize = pool_maxsize
+        self.retry_total = retry_total
+        self.retry_backoff_factor = retry_backoff_factor
+        self.retry_status_forcelist = retry_status_forcelist
+
+        self._lock = threading.Lock()
+        self._adapters: Dict[Tuple[str, str], HTTPAdapter] = {}
+        self._local = threading.local()
+
+    def get_adapter(self, scheme: str, host: str) -> HTTPAdapter:
+        key = (scheme, host)
+        with self._lock:
+            adapter = self._adapters.get(key)
+            if adapter is None:
+                adapter = HTTPAdapter(
+                    pool_connections=1,
+                    pool_maxsize=self.pool_maxsize,
+                    max_retries=Retry(
+                        total=self.retry_total,
+                        backoff_factor=self.retry_backoff_factor,
+                        status_forcelist=self.retry_status_forcelist,
+                        raise_on_status=False,
+                    ),
+                )
+                self._adapters[key] = adapter
+
+        return adapter
+
+    @property
+    def session(self) -> requests.Session:
+        # the cookie jar of a session is not thread-safe, each thread has its own session sharing the connection pools
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = PooledSession(self)
+            self._local.session = session
+        return session
+
+    def new_session(self) -> requests.Session:
+        # the cookies are not shared, but the connection pools are
+        return PooledSession(self)
+
+    def close(self):
+        with self._lock:
+            adapters = list(self._adapters.values())
+            self._adapters.clear()
+
+        for adapter in adapters:
+            adapter.close()
+
+
+SESSIONS = SessionRegistry()
+UNREGISTER_HOOKS.append(SESSIONS.close)
@@ -3,19 +3,23 @@
 # This file is part of MMD UuuNyaa Tools.
 
 from abc import ABC, abstractmethod
+from typing import Dict, Optional
 
 import requests
 from mmd_uuunyaa_tools.asset_search.actions import DownloadActionExecutor
+from mmd_uuunyaa_tools.asset_search.sessions import SESSIONS
 
 
 class URLResolverABC(ABC):
     @abstractmethod
-    def resolve(self, url: str) -> requests.models.Response:
+    def resolve(self, url: str, headers: Optional[Dict[str, str]] = None) -> requests.models.Response:
         pass
 
 
 class URLResolver(URLResolverABC):
-    def resolve(self, url: str) -> requests.models.Response:
+    def resolve(self, url: str, headers: Optional[Dict[str, str]] = None) -> requests.models.Response:
         if url.startswith('http://') or url.startswith('https://'):
-            return requests.get(url, stream=True)
+            return SESSIONS.session.get(url, stream=True, headers=headers)
+
+        # the download actions issue their own requests, they always start from the beginning
         return DownloadActionExecutor.execute_action(url)
@@ -335,6 +335,11 @@ class ConvertRigidBodyToClothOperator(bpy.types.Operator):
         name=_('Extend Ribbon Area'),
         default=True
     )
+    batch_mode: bpy.props.BoolProperty(
+        name=_('Batch Mode'),
+        description=_('Convert each joint-connected group of the selected rigid bodies to a separate cloth'),
+        default=False
+    )
 
     @classmethod
     def poll(cls, context: bpy.types.Context):
@@ -389,15 +394,31 @@ class ConvertRigidBodyToClothOperator(bpy.types.Operator):
                 elif obj.mmd_type == 'NONE':
                     mesh_objects.append(obj)
 
-            RigidBodyToClothConverter.convert(
-                target_mmd_root_object,
-                rigid_body_objects,
-                mesh_objects,
-                self.subdivision_level,
-                self.ribbon_stiffness,
-                PhysicsMode[self.physics_mode],
-                self.extend_ribbon_area
-            )
+            if not self.batch_mode:
+                RigidBodyToClothConverter.convert(
+                    target_mmd_root_object,
+                    rigid_body_objects,
+                    mesh_objects,
+                    self.subdivision_level,
+                    self.ribbon_stiffness,
+                    PhysicsMode[self.physics_mode],
+                    self.extend_ribbon_area
+                )
+            else:
+                component_times = RigidBodyToClothConverter.convert_batch(
+                    target_mmd_root_object,
+                    rigid_body_objects,
+                    mesh_objects,
+                    self.subdivision_level,
+                    self.ribbon_stiffness,
+                    PhysicsMode[self.physics_mode],
+                    self.extend_ribbon_area
+                )
+
+                self.report({'INFO'}, ', '.join(
+                    f'#{i}: {rigid_body_count} rigid bodies {component_time.total_seconds():.3f}s'
+                    for i, (rigid_body_count, component_time) in enumerate(component_times)
+                ))
 
         except MessageException as ex:
             self.report(type={'ERROR'}, message=str(ex))
@@ -3,8 +3,11 @@
 # This file is part of MMD UuuNyaa Tools.
 
 import datetime
+import hashlib
 import math
-from dataclasses import dataclass
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import dataclass, field
 from enum import IntEnum
 from typing import Dict, List, Optional, Set, Tuple
 
@@ -356,26 +359,198 @@ def build_pyramid_bones(armature_object: bpy.types.Object, pyramid_mesh_object:
 
     bpy.ops.object.mode_set(mode='OBJECT')
 
-def assign_deform_weights(pyramid_armature_object: bpy.types.Object, deform_mesh_object: bpy.types.Object, target_bone_name: str, boundary_expansion_hop_count: int):
-    mesh_editor = MeshEditor(deform_mesh_object)
-    deform_bmesh: bmesh.types.BMesh = bmesh.new()
 
-    start_time = datetime.datetime.now()
+class HeatDiffusion(ABC):
+    """Applies the heat kernel exp(-time * L) of a weighted graph laplacian L to column vectors."""
 
-    print(f'assign deform weights:begin: {target_bone_name}')
+    DENSE_MAX_NODE_COUNT = 1000
+    LANCZOS_MAX_STEP_COUNT = 64
+    LANCZOS_CHECK_INTERVAL = 4
+    LANCZOS_TOLERANCE = 1e-8
 
-    # pylint: disable=no-member
-    depsgraph: bpy.types.Depsgraph = bpy.context.evaluated_depsgraph_get()
-    deform_bmesh.from_object(mesh_editor.mesh_object, depsgraph)
-    deform_bmesh.transform(deform_mesh_object.matrix_world)
+    def __init__(self, node_count: int, node_pair2magnitude: Dict[Tuple[int, int], float], time: float):
+        self.node_count = node_count
+        self.time = time
 
-    vid2weight = expand_boundary(
-        to_vid2weight(deform_bmesh, mesh_editor.get_vertex_group(target_bone_name).index),
-        deform_bmesh, boundary_expansion_hop_count
-    )
-    deform_bmesh_verts = deform_bmesh.verts
+        from_nodes = np.fromiter((f for f, _t in node_pair2magnitude), dtype=np.int64, count=len(node_pair2magnitude))
+        to_nodes = np.fromiter((t for _f, t in node_pair2magnitude), dtype=np.int64, count=len(node_pair2magnitude))
+        magnitudes = np.fromiter(node_pair2magnitude.values(), dtype=np.float64, count=len(node_pair2magnitude))
+
+        # symmetric COO entries of the adjacency matrix, sorted by row
+        rows = np.concatenate((from_nodes, to_nodes))
+        cols = np.concatenate((to_nodes, from_nodes))
+        data = np.concatenate((magnitudes, magnitudes))
+        order = np.argsort(rows, kind='stable')
+        self.rows = rows[order]
+        self.cols = cols[order]
+        self.data = data[order]
+        self.degrees = np.bincount(self.rows, weights=self.data, minlength=node_count)
+
+        # CSR style row segments, only for the rows that have entries
+        self.nonempty_rows, self.row_starts = np.unique(self.rows, return_index=True)
+
+    @staticmethod
+    def build(node_count: int, node_pair2magnitude: Dict[Tuple[int, int], float], time: float) -> 'HeatDiffusion':
+        if node_count <= HeatDiffusion.DENSE_MAX_NODE_COUNT:
+            return DenseHeatDiffusion(node_count, node_pair2magnitude, time)
+        return SparseHeatDiffusion(node_count, node_pair2magnitude, time)
+
+    @abstractmethod
+    def apply(self, vectors: np.ndarray) -> np.ndarray:
+        pass
+
+    def __repr__(self) -> str:
+        return f'{type(self).__name__}(node_count={self.node_count}, edge_count={len(self.data)//2})'
+
+
+class DenseHeatDiffusion(HeatDiffusion):
+    def __init__(self, node_count: int, node_pair2magnitude: Dict[Tuple[int, int], float], time: float):
+        super().__init__(node_count, node_pair2magnitude, time)
+
+        laplacian_matrix = np.diag(self.degrees)
+        laplacian_matrix[self.rows, self.cols] -= self.data
+        self.eigen_values, self.eigen_vectors = np.linalg.eigh(laplacian_matrix)
+        self.diffusion = np.exp(-self.eigen_values*time)
+
+    def apply(self, vectors: np.ndarray) -> np.ndarray:
+        return self.eigen_vectors @ (self.diffusion[:, np.newaxis] * (self.eigen_vectors.T @ vectors))
+
+
+class SparseHeatDiffusion(HeatDiffusion):
+    """Approximates the heat kernel with a Lanczos process on a sparse laplacian.
+
+    Each column gets its own Krylov subspace, but all columns advance together.
+    """
 
-    print(f'assign deform weights:build_adjacencies: vid_count={len(vid2weight)}, {datetime.datetime.now() - start_time}')
+    def dot_laplacian(self, vectors: np.ndarray) -> np.ndarray:
+        result = self.degrees[:, np.newaxis] * vectors
+        if len(self.data) > 0:
+            result[self.nonempty_rows] -= np.add.reduceat(self.data[:, np.newaxis] * vectors[self.cols], self.row_starts, axis=0)
+        return result
+
+    def to_coefficients(self, alphas: List[np.ndarray], betas: List[np.ndarray]) -> np.ndarray:
+        """Returns exp(-time * T) e_1 of the Lanczos tridiagonal matrix T of each column."""
+        alphas_array = np.array(alphas)
+        betas_array = np.array(betas)
+        coefficients = np.zeros_like(alphas_array)
+        for column in range(alphas_array.shape[1]):
+            tridiagonal_matrix = np.diag(alphas_array[:, column]) + np.diag(betas_array[:-1, column], 1) + np.diag(betas_array[:-1, column], -1)
+            eigen_values, eigen_vectors = np.linalg.eigh(tridiagonal_matrix)
+            coefficients[:, column] = eigen_vectors @ (np.exp(-eigen_values*self.time) * eigen_vectors[0])
+        return coefficients
+
+    def apply(self, vectors: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(vectors, axis=0)
+
+        bases: List[np.ndarray] = []
+        alphas: List[np.ndarray] = []
+        betas: List[np.ndarray] = []
+
+        basis = np.divide(vectors, norms, out=np.zeros_like(vectors, dtype=np.float64), where=norms > 0)
+        previous_basis = np.zeros_like(basis)
+        previous_beta = np.zeros(vectors.shape[1])
+        for step in range(min(self.LANCZOS_MAX_STEP_COUNT, self.node_count)):
+            bases.append(basis)
+            w = self.dot_laplacian(basis) - previous_beta * previous_basis
+            alpha = np.sum(w * basis, axis=0)
+            w -= alpha * basis
+            beta = np.linalg.norm(w, axis=0)
+
+            alphas.append(alpha)
+            betas.append(beta)
+
+            if (step + 1) % self.LANCZOS_CHECK_INTERVAL == 0:
+                # a posteriori error estimate of the unit vectors
+                if np.all(beta * np.abs(self.to_coefficients(alphas, betas)[-1]) <= self.LANCZOS_TOLERANCE):
+                    break
+
+            previous_basis = basis
+            previous_beta = beta
+            # an exhausted subspace continues with zero vectors, which contribute nothing
+            basis = np.divide(w, beta, out=np.zeros_like(w), where=beta > 1e-12)
+
+        coefficients = self.to_coefficients(alphas, betas)
+
+        result = np.zeros_like(vectors, dtype=np.float64)
+        for step, basis in enumerate(bases):
+            result += coefficients[step] * basis
+
+        return norms * result
+
+
+@dataclass
+class DeformWeightGraph:
+    vid2weight: Dict[int, float]
+    uid2nid: Dict[int, int]
+    uid2vids: Dict[int, List[int]]
+    nid2uid: Dict[int, int]
+    sink_nids: Set[int]
+    vertex_kdtree: mathutils.kdtree.KDTree
+    heat_diffusion: HeatDiffusion
+    bone_locations2weights: 'OrderedDict[Tuple[float, ...], np.ndarray]' = field(default_factory=OrderedDict)
+
+
+class DeformWeightGraphCache:
+    """LRU cache of the deform weight graphs, keyed by the content of the deform mesh.
+
+    Artists re-run the weight assignment while tuning the parameters,
+    so the graph and the diffusion results are reused while the mesh is not changed.
+    """
+
+    def __init__(self, max_graph_count: int = 8, max_weights_count: int = 8):
+        self.max_graph_count = max_graph_count
+        self.max_weights_count = max_weights_count
+        self._graphs: OrderedDict[str, DeformWeightGraph] = OrderedDict()
+
+    @staticmethod
+    def to_key(deform_mesh: bpy.types.Mesh, matrix_world: Matrix, vid2weight: Dict[int, float], boundary_expansion_hop_count: int) -> str:
+        """Hashes the evaluated mesh read with foreach_get, its world matrix and the target weights."""
+        vertex_cos = np.empty(len(deform_mesh.vertices) * 3, dtype=np.float32)
+        deform_mesh.vertices.foreach_get('co', vertex_cos)
+        edge_vids = np.empty(len(deform_mesh.edges) * 2, dtype=np.int32)
+        deform_mesh.edges.foreach_get('vertices', edge_vids)
+
+        digest = hashlib.sha1()
+        digest.update(vertex_cos.tobytes())
+        digest.update(edge_vids.tobytes())
+        digest.update(np.array([c for row in matrix_world for c in row], dtype=np.float32).tobytes())
+        digest.update(np.fromiter(vid2weight.keys(), dtype=np.int32, count=len(vid2weight)).tobytes())
+        digest.update(np.fromiter(vid2weight.values(), dtype=np.float32, count=len(vid2weight)).tobytes())
+        digest.update(boundary_expansion_hop_count.to_bytes(4, 'little'))
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[DeformWeightGraph]:
+        graph = self._graphs.get(key)
+        if graph is not None:
+            self._graphs.move_to_end(key)
+        return graph
+
+    def put(self, key: str, graph: DeformWeightGraph):
+        self._graphs[key] = graph
+        self._graphs.move_to_end(key)
+        while len(self._graphs) > self.max_graph_count:
+            self._graphs.popitem(last=False)
+
+    def get_weights(self, graph: DeformWeightGraph, bone_locations: Tuple[float, ...]) -> Optional[np.ndarray]:
+        weights = graph.bone_locations2weights.get(bone_locations)
+        if weights is not None:
+            graph.bone_locations2weights.move_to_end(bone_locations)
+        return weights
+
+    def put_weights(self, graph: DeformWeightGraph, bone_locations: Tuple[float, ...], weights: np.ndarray):
+        graph.bone_locations2weights[bone_locations] = weights
+        while len(graph.bone_locations2weights) > self.max_weights_count:
+            graph.bone_locations2weights.popitem(last=False)
+
+    def clear(self):
+        self._graphs.clear()
+
+
+DEFORM_WEIGHT_GRAPH_CACHE = DeformWeightGraphCache()
+
+
+def build_deform_weight_graph(deform_bmesh: bmesh.types.BMesh, vid2weight: Dict[int, float]) -> DeformWeightGraph:
+    deform_bmesh_verts = deform_bmesh.verts
 
     adjacencies, vid2uid = build_adjacencies(deform_bmesh_verts, vid2weight)
 
@@ -393,11 +568,14 @@ def assign_deform_weights(pyramid_armature_object: bpy.types.Object, deform_mesh
 
     nid_count = len(uid2nid)
 
-    adjacency_matrix = np.zeros((nid_count, nid_count))
+    nid_pair2magnitude: Dict[Tuple[int, int], float] = {}
     for (from_uid, to_uid), span in adjacencies.items():
-        magnitude = math.exp(-span)
-        adjacency_matrix[uid2nid[from_uid], uid2nid[to_uid]] = magnitude
-        adjacency_matrix[uid2nid[to_uid], uid2nid[from_uid]] = magnitude
+        from_nid = uid2nid[from_uid]
+        to_nid = uid2nid[to_uid]
+        if from_nid == to_nid:
+            # self loops cancel out in the laplacian
+            continue
+        nid_pair2magnitude[(from_nid, to_nid) if from_nid < to_nid else (to_nid, from_nid)] = math.exp(-span)
 
     deform_bmesh_verts.ensure_lookup_table()
     vertex_kdtree = mathutils.kdtree.KDTree(nid_count)
@@ -407,6 +585,60 @@ def assign_deform_weights(pyramid_armature_object: bpy.types.Object, deform_mesh
         vertex_kdtree.insert(deform_bmesh_verts[uid].co, uid)
     vertex_kdtree.balance()
 
+    return DeformWeightGraph(
+        vid2weight,
+        uid2nid,
+        uid2vids,
+        nid2uid,
+        sink_nids,
+        vertex_kdtree,
+        HeatDiffusion.build(nid_count, nid_pair2magnitude, 2.0),
+    )
+
+
+def assign_deform_weights(pyramid_armature_object: bpy.types.Object, deform_mesh_object: bpy.types.Object, target_bone_name: str, boundary_expansion_hop_count: int):
+    mesh_editor = MeshEditor(deform_mesh_object)
+    deform_bmesh: bmesh.types.BMesh = bmesh.new()
+
+    start_time = datetime.datetime.now()
+
+    print(f'assign deform weights:begin: {target_bone_name}')
+
+    # pylint: disable=no-member
+    depsgraph: bpy.types.Depsgraph = bpy.context.evaluated_depsgraph_get()
+    deform_bmesh.from_object(mesh_editor.mesh_object, depsgraph)
+    deform_bmesh.transform(deform_mesh_object.matrix_world)
+
+    vid2weight = to_vid2weight(deform_bmesh, mesh_editor.get_vertex_group(target_bone_name).index)
+
+    # the evaluated mesh has the vertices of deform_bmesh before the transform
+    graph_key = DeformWeightGraphCache.to_key(
+        mesh_editor.mesh_object.evaluated_get(depsgraph).data,
+        deform_mesh_object.matrix_world,
+        vid2weight,
+        boundary_expansion_hop_count,
+    )
+    graph = DEFORM_WEIGHT_GRAPH_CACHE.get(graph_key)
+    if graph is None:
+        vid2weight = expand_boundary(vid2weight, deform_bmesh, boundary_expansion_hop_count)
+
+        print(f'assign deform weights:build_adjacencies: vid_count={len(vid2weight)}, {datetime.datetime.now() - start_time}')
+
+        graph = build_deform_weight_graph(deform_bmesh, vid2weight)
+        DEFORM_WEIGHT_GRAPH_CACHE.put(graph_key, graph)
+    else:
+        print(f'assign deform weights:build_adjacencies: cached, {datetime.datetime.now() - start_time}')
+
+    deform_bmesh.free()
+
+    vid2weight = graph.vid2weight
+    uid2nid = graph.uid2nid
+    uid2vids = graph.uid2vids
+    nid2uid = graph.nid2uid
+    vertex_kdtree = graph.vertex_kdtree
+    heat_diffusion = graph.heat_diffusion
+    nid_count = len(uid2nid)
+
     def collect_nid2weight(position: Vector, scale: float):
         max_weight: Optional[float] = None
         nid2weight: Dict[int, float] = {}
@@ -432,71 +664,92 @@ def assign_deform_weights(pyramid_armature_object: bpy.types.Object, deform_mesh
     pyramid_origin = pyramid_armature_object.location
     bone_length = pyramid_armature.bones[bone_names.apex].length
 
-    bone_name2nid2weight: Dict[str, Dict[int, float]] = {
-        bone_names.apex: collect_nid2weight(pyramid_armature.bones[bone_names.apex].tail_local + pyramid_origin, bone_length),
-        bone_names.base_a: collect_nid2weight(pyramid_armature.bones[bone_names.base_a].head_local + pyramid_origin, bone_length),
-        bone_names.base_b: collect_nid2weight(pyramid_armature.bones[bone_names.base_b].head_local + pyramid_origin, bone_length),
-        bone_names.base_c: collect_nid2weight(pyramid_armature.bones[bone_names.base_c].head_local + pyramid_origin, bone_length),
-        bone_names.base_d: collect_nid2weight(pyramid_armature.bones[bone_names.base_d].head_local + pyramid_origin, bone_length),
+    bone_name2location: Dict[str, Vector] = {
+        bone_names.apex: pyramid_armature.bones[bone_names.apex].tail_local + pyramid_origin,
+        bone_names.base_a: pyramid_armature.bones[bone_names.base_a].head_local + pyramid_origin,
+        bone_names.base_b: pyramid_armature.bones[bone_names.base_b].head_local + pyramid_origin,
+        bone_names.base_c: pyramid_armature.bones[bone_names.base_c].head_local + pyramid_origin,
+        bone_names.base_d: pyramid_armature.bones[bone_names.base_d].head_local + pyramid_origin,
     }
 
-    print(f'assign deform weights:auto_weight: nid_count={nid_count}, {datetime.datetime.now() - start_time}')
+    bone_locations: Tuple[float, ...] = (bone_length, *(c for location in bone_name2location.values() for c in location))
+    weights = DEFORM_WEIGHT_GRAPH_CACHE.get_weights(graph, bone_locations)
 
-    laplacian_matrix = np.diag(np.sum(adjacency_matrix, axis=1))
-    laplacian_matrix -= adjacency_matrix
-    eigen_values, eigen_vector = np.linalg.eigh(laplacian_matrix)
-    diffusion = np.exp(-eigen_values*2)
-
-    for bone_name in bone_name2nid2weight:
-        nid2weight = {
-            nid: (weight * 10 if b == bone_name else -weight)
-            for b, n2w in bone_name2nid2weight.items()
-            for nid, weight in n2w.items()
+    if weights is None:
+        bone_name2nid2weight: Dict[str, Dict[int, float]] = {
+            bone_name: collect_nid2weight(location, bone_length)
+            for bone_name, location in bone_name2location.items()
         }
 
-        print(f'assign deform weights:auto_weight: {bone_name}, {datetime.datetime.now() - start_time}')
+        print(f'assign deform weights:auto_weight: {heat_diffusion}, {datetime.datetime.now() - start_time}')
+
+        # one column per bone, so that all bones are diffused at once
+        bone_count = len(bone_name2nid2weight)
+        source_weights = np.zeros((nid_count, bone_count))
+        reset_masks = np.zeros((nid_count, bone_count), dtype=bool)
+        for column, bone_name in enumerate(bone_name2nid2weight):
+            nid2weight = {
+                nid: (weight * 10 if b == bone_name else -weight)
+                for b, n2w in bone_name2nid2weight.items()
+                for nid, weight in n2w.items()
+            }
 
-        weights = np.zeros(nid_count)
-        for _iteration in range(min(60, nid_count//2)):
             for nid, weight in nid2weight.items():
                 if weight > 0:
-                    weights[nid] += weight
+                    source_weights[nid, column] = weight
                 else:
-                    weights[nid] = 0
+                    reset_masks[nid, column] = True
+
+        sink_nid_array = np.fromiter(graph.sink_nids, dtype=np.int64, count=len(graph.sink_nids))
+
+        weights = np.zeros((nid_count, bone_count))
+        for _iteration in range(min(60, nid_count//2)):
+            weights += source_weights
+            weights[reset_masks] = 0
 
-            weights = eigen_vector.T @ weights
-            weights *= diffusion
-            weights = eigen_vector @ weights
+            weights = heat_diffusion.apply(weights)
 
-            for nid in sink_nids:
-                weights[nid] = 0
+            weights[sink_nid_array] = 0
 
         # normalize
         weights[weights < 0] = 0
-        weights = weights / np.max(weights)
+        weights = weights / np.max(weights, axis=0)
 
+        DEFORM_WEIGHT_GRAPH_CACHE.put_weights(graph, bone_locations, weights)
+    else:
+        print(f'assign deform weights:auto_weight: cached, {datetime.datetime.now() - start_time}')
+
+    for column, bone_name in enumerate(bone_name2location):
         mesh_editor.edit_vertex_group(bone_name, [
-            (uid2vids[nid2uid[nid]], weights[nid].item() * vid2weight[nid2uid[nid]]) for nid in range(nid_count)
+            (uid2vids[nid2uid[nid]], weights[nid, column].item() * vid2weight[nid2uid[nid]]) for nid in range(nid_count)
         ])
 
-    deform_bmesh.free()
     print(f'assign deform weights:finish: {datetime.datetime.now() - start_time}')
 
 
-def to_vid2weight(deform_bmesh: bmesh.types.BMesh, vertex_group_index: int) -> Dict[int, float]:
-    vid2weight: Dict[int, float] = {}
-
+def to_vertex_group_weights(deform_bmesh: bmesh.types.BMesh, vertex_group_index: int) -> np.ndarray:
     deform_layer = deform_bmesh.verts.layers.deform.verify()
+    return np.fromiter(
+        (v[deform_layer].get(vertex_group_index, 0.0) for v in deform_bmesh.verts),
+        dtype=np.float64,
+        count=len(deform_bmesh.verts)
+    )
 
-    tri_loops: Tuple[bmesh.types.BMLoop, bmesh.types.BMLoop, bmesh.types.BMLoop]
-    for tri_loops in deform_bmesh.calc_loop_triangles():
-        loop_vid2weight = {l.vert.index: l.vert[deform_layer].get(vertex_group_index, 0.0) for l in tri_loops}
-        if max(loop_vid2weight.values()) == 0:
-            continue
 
-        vid2weight.update(loop_vid2weight)
+def to_vid2weight(deform_bmesh: bmesh.types.BMesh, vertex_group_index: int) -> Dict[int, float]:
+    vertex_weights = to_vertex_group_weights(deform_bmesh, vertex_group_index)
+
+    tri_vids = np.array(
+        [l.vert.index for tri_loops in deform_bmesh.calc_loop_triangles() for l in tri_loops],
+        dtype=np.int64
+    ).reshape(-1, 3)
+    tri_vids = tri_vids[np.max(vertex_weights[tri_vids], axis=1, initial=0.0) != 0]
 
-    return vid2weight
+    # keep the first appearance order of the vertices
+    vids, first_indices = np.unique(tri_vids.ravel(), return_index=True)
+    vids = vids[np.argsort(first_indices)]
+
+    return dict(zip(vids.tolist(), vertex_weights[vids].tolist()))
 
 
 def expand_boundary(vid2weight: Dict[int, float], deform_bmesh: bmesh.types.BMesh, boundary_expansion_hop_count: int):
@@ -505,43 +758,45 @@ def expand_boundary(vid2weight: Dict[int, float], deform_bmesh: bmesh.types.BMes
 
     limit_weight = max(vid2weight.values())
 
-    new_boundary_vids: Set[int] = set()
-    old_boundary_vids: Set[int] = set()
+    verts = deform_bmesh.verts
+    verts.ensure_lookup_table()
+    deform_bmesh.edges.index_update()
 
-    for _iteration in range(boundary_expansion_hop_count):
-        edge: bmesh.types.BMEdge
-        for edge in deform_bmesh.edges:
-            vert0_vid = edge.verts[0].index
-            vert0_isin = vert0_vid in vid2weight
-            vert1_vid = edge.verts[1].index
-            vert1_isin = vert1_vid in vid2weight
+    member_vids: List[int] = list(vid2weight.keys())
+    member_weights = np.array(list(vid2weight.values()), dtype=np.float64)
+    vid2member_index: Dict[int, int] = {vid: index for index, vid in enumerate(member_vids)}
+    member_has_edges = np.array([len(verts[vid].link_edges) > 0 for vid in member_vids], dtype=bool)
 
-            if vert0_isin and vert1_isin:
-                old_boundary_vids.add(vert0_vid)
-                old_boundary_vids.add(vert1_vid)
+    # every neighbor of the older members is already a member,
+    # so only the edges of the last added vertices can reach new vertices.
+    frontier_vids: List[int] = list(member_vids)
+    for _iteration in range(boundary_expansion_hop_count):
+        edge_index_new_vids: List[Tuple[int, int]] = []
+        for vid in frontier_vids:
+            vert: bmesh.types.BMVert = verts[vid]
+            edge: bmesh.types.BMEdge
+            for edge in vert.link_edges:
+                other_vid = edge.other_vert(vert).index
+                if other_vid not in vid2member_index:
+                    edge_index_new_vids.append((edge.index, other_vid))
 
-            elif vert0_isin:
-                old_boundary_vids.add(vert0_vid)
-                new_boundary_vids.add(vert1_vid)
+        # add to a set in the edge order, so that the new vertices are iterated in the same order as scanning all the edges
+        edge_index_new_vids.sort()
+        new_boundary_vids: Set[int] = set(vid for _edge_index, vid in edge_index_new_vids)
 
-            elif vert1_isin:
-                new_boundary_vids.add(vert0_vid)
-                old_boundary_vids.add(vert1_vid)
+        member_weights[member_has_edges] += 0.1
 
         for vid in new_boundary_vids:
-            vid2weight.setdefault(vid, 0)
-        new_boundary_vids.clear()
+            vid2member_index[vid] = len(member_vids)
+            member_vids.append(vid)
 
-        for vid in old_boundary_vids:
-            vid2weight[vid] += 0.1
-        old_boundary_vids.clear()
+        member_weights = np.concatenate((member_weights, np.zeros(len(new_boundary_vids))))
+        member_has_edges = np.concatenate((member_has_edges, np.ones(len(new_boundary_vids), dtype=bool)))
+        frontier_vids = list(new_boundary_vids)
 
-    weight_scale = limit_weight / max(vid2weight.values())
+    weight_scale = limit_weight / np.max(member_weights)
 
-    return {
-        vid: weight * weight_scale
-        for vid, weight in vid2weight.items()
-    }
+    return dict(zip(member_vids, (member_weights * weight_scale).tolist()))
 
 
 def build_adjacencies(
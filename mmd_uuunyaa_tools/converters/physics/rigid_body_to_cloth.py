@@ -4,6 +4,7 @@
 #   UuuNyaa <UuuNyaa@gmail.com>
 # This file is part of MMD UuuNyaa Tools.
 
+import datetime
 from dataclasses import dataclass, field
 from enum import Enum
 from typing import Dict, Iterable, List, Optional, Set, Tuple
@@ -44,6 +45,13 @@ class Vertices:
     all_ribbon: bool = False
 
 
+@dataclass
+class ClothBinding:
+    cloth_mesh_object: bpy.types.Object
+    deform_vertex_group: bpy.types.VertexGroup
+    all_ribbon: bool
+
+
 class RigidBodyToClothConverter:
     @classmethod
     def convert(
@@ -56,9 +64,128 @@ class RigidBodyToClothConverter:
         physics_mode: PhysicsMode,
         extend_ribbon_area: bool
     ):  # pylint: disable=too-many-arguments
-        # pylint: disable=too-many-locals, too-many-statements
+        start_time = datetime.datetime.now()
+        print(f'convert rigid body to cloth:begin: rigid_body_count={len(rigid_body_objects)}')
+
         mmd_model = import_mmd_tools().core.model.Model(mmd_root_object)
         mmd_mesh_object = mesh_objects[0]
+
+        cloth_binding = cls.build_cloth(
+            mmd_model, rigid_body_objects, mmd_mesh_object, mmd_model.joints(),
+            subdivision_level, ribbon_stiffness, physics_mode, extend_ribbon_area,
+            start_time
+        )
+
+        cls.bind_cloth(mmd_mesh_object, cloth_binding, physics_mode)
+
+        print(f'convert rigid body to cloth:finish: {datetime.datetime.now() - start_time}')
+
+    @classmethod
+    def convert_batch(
+        cls,
+        mmd_root_object: bpy.types.Object,
+        rigid_body_objects: List[bpy.types.Object],
+        mesh_objects: List[bpy.types.Object],
+        subdivision_level: int,
+        ribbon_stiffness: float,
+        physics_mode: PhysicsMode,
+        extend_ribbon_area: bool
+    ) -> List[Tuple[int, datetime.timedelta]]:
+        # pylint: disable=too-many-arguments, too-many-locals
+        start_time = datetime.datetime.now()
+        print(f'convert rigid body to cloth batch:begin: rigid_body_count={len(rigid_body_objects)}')
+
+        mmd_model = import_mmd_tools().core.model.Model(mmd_root_object)
+        mmd_mesh_object = mesh_objects[0]
+
+        components = cls.partition_rigid_bodies(rigid_body_objects, mmd_model.joints())
+
+        print(f'convert rigid body to cloth batch:partition: component_count={len(components)}, {datetime.datetime.now() - start_time}')
+
+        component_times: List[datetime.timedelta] = []
+        cloth_bindings: List[ClothBinding] = []
+        for component_rigid_body_objects, component_joint_objects in components:
+            component_start_time = datetime.datetime.now()
+            cloth_bindings.append(cls.build_cloth(
+                mmd_model, component_rigid_body_objects, mmd_mesh_object, component_joint_objects,
+                subdivision_level, ribbon_stiffness, physics_mode, extend_ribbon_area,
+                component_start_time
+            ))
+            component_times.append(datetime.datetime.now() - component_start_time)
+
+        print(f'convert rigid body to cloth batch:build_cloth: {datetime.datetime.now() - start_time}')
+
+        for index, cloth_binding in enumerate(cloth_bindings):
+            bind_start_time = datetime.datetime.now()
+            cls.bind_cloth(mmd_mesh_object, cloth_binding, physics_mode)
+            component_times[index] += datetime.datetime.now() - bind_start_time
+
+        print(f'convert rigid body to cloth batch:finish: {datetime.datetime.now() - start_time}')
+
+        return [
+            (len(component_rigid_body_objects), component_time)
+            for (component_rigid_body_objects, _joint_objects), component_time in zip(components, component_times)
+        ]
+
+    @staticmethod
+    def partition_rigid_bodies(
+        rigid_body_objects: List[bpy.types.Object],
+        joint_objects: Iterable[bpy.types.Object]
+    ) -> List[Tuple[List[bpy.types.Object], List[bpy.types.Object]]]:
+        rigid_body_index_dict = {
+            rigid_body_object: i
+            for i, rigid_body_object in enumerate(rigid_body_objects)
+        }
+
+        index2parent = list(range(len(rigid_body_objects)))
+
+        def find(index: int) -> int:
+            while index2parent[index] != index:
+                index2parent[index] = index2parent[index2parent[index]]
+                index = index2parent[index]
+            return index
+
+        related_joints: List[Tuple[bpy.types.Object, int]] = []
+
+        for obj in joint_objects:
+            index1 = rigid_body_index_dict.get(obj.rigid_body_constraint.object1)
+            index2 = rigid_body_index_dict.get(obj.rigid_body_constraint.object2)
+            if index1 is None and index2 is None:
+                continue
+
+            if index1 is not None and index2 is not None:
+                index2parent[find(index1)] = find(index2)
+
+            related_joints.append((obj, index1 if index1 is not None else index2))
+
+        root2component: Dict[int, int] = {}
+        components: List[Tuple[List[bpy.types.Object], List[bpy.types.Object]]] = []
+        for index, rigid_body_object in enumerate(rigid_body_objects):
+            root = find(index)
+            if root not in root2component:
+                root2component[root] = len(components)
+                components.append(([], []))
+            components[root2component[root]][0].append(rigid_body_object)
+
+        for obj, index in related_joints:
+            components[root2component[find(index)]][1].append(obj)
+
+        return components
+
+    @classmethod
+    def build_cloth(
+        cls,
+        mmd_model,
+        rigid_body_objects: List[bpy.types.Object],
+        mmd_mesh_object: bpy.types.Object,
+        candidate_joint_objects: Iterable[bpy.types.Object],
+        subdivision_level: int,
+        ribbon_stiffness: float,
+        physics_mode: PhysicsMode,
+        extend_ribbon_area: bool,
+        start_time: datetime.datetime
+    ) -> ClothBinding:
+        # pylint: disable=too-many-arguments, too-many-locals, too-many-statements
         mmd_armature_object = mmd_model.armature()
 
         rigid_bodys_count = len(rigid_body_objects)
@@ -83,10 +210,12 @@ class RigidBodyToClothConverter:
             for obj in objects:
                 bpy.data.objects.remove(obj)
 
-        joint_objects, joint_edge_indices, side_joint_objects = cls.collect_joints(mmd_model, rigid_body_index_dict)
+        joint_objects, joint_edge_indices, side_joint_objects = cls.collect_joints(candidate_joint_objects, rigid_body_index_dict)
 
         remove_objects(joint_objects)
 
+        print(f'convert rigid body to cloth:collect_joints: joint_count={len(joint_edge_indices)}, {datetime.datetime.now() - start_time}')
+
         cloth_mesh = bpy.data.meshes.new('physics_cloth')
         cloth_mesh.from_pydata([r.location for r in rigid_body_objects], joint_edge_indices, [])
         cloth_mesh.validate()
@@ -103,6 +232,8 @@ class RigidBodyToClothConverter:
 
         cls.clean_mesh(cloth_bm, joint_edge_indices)
 
+        print(f'convert rigid body to cloth:clean_mesh: {datetime.datetime.now() - start_time}')
+
         # 标出头部，尾部，飘带顶点
         # try mark head,tail,ribbon vertex
         cloth_bm.verts.ensure_lookup_table()
@@ -131,6 +262,8 @@ class RigidBodyToClothConverter:
         cloth_bm.edges.ensure_lookup_table()
         cloth_bm.to_mesh(cloth_mesh)
 
+        print(f'convert rigid body to cloth:build_cloth_mesh: {datetime.datetime.now() - start_time}')
+
         pin_vertex_group = cls.new_pin_vertex_group(cloth_mesh_object, side_joint_objects, new_up_verts, new_side_verts, rigid_body_index_dict)
 
         remove_objects(side_joint_objects)
@@ -144,6 +277,8 @@ class RigidBodyToClothConverter:
         mesh_editor.edit_cloth_modifier('physics_cloth', vertex_group_mass=pin_vertex_group.name)
 
         corrective_smooth_modifier = mesh_editor.add_corrective_smooth_modifier('physics_cloth_smooth', smooth_type='LENGTH_WEIGHTED', rest_source='BIND')
+        # bind the rest shape before bind_mmd_mesh adds the stretch constraints, which change the armature pose
+        bpy.context.view_layer.objects.active = cloth_mesh_object
         bpy.ops.object.correctivesmooth_bind(modifier=corrective_smooth_modifier.name)
         if subdivision_level == 0:
             corrective_smooth_modifier.show_viewport = False
@@ -154,20 +289,26 @@ class RigidBodyToClothConverter:
         cls.bind_mmd_mesh(mmd_mesh_object, cloth_mesh_object, cloth_bm, pose_bones, deform_vertex_group_index, vertices_ribbon_verts, physics_mode)
         cls.set_pin_vertex_weight(pin_vertex_group, vertices_ribbon_verts, ribbon_stiffness, physics_mode)
 
+        print(f'convert rigid body to cloth:bind_mmd_mesh: {datetime.datetime.now() - start_time}')
+
         remove_objects(rigid_body_objects)
 
-        if not vertices.all_ribbon and physics_mode in {PhysicsMode.AUTO, PhysicsMode.SURFACE_DEFORM}:
+        cloth_bm.free()
+
+        return ClothBinding(cloth_mesh_object, deform_vertex_group, vertices.all_ribbon)
+
+    @staticmethod
+    def bind_cloth(mmd_mesh_object: bpy.types.Object, cloth_binding: ClothBinding, physics_mode: PhysicsMode):
+        if not cloth_binding.all_ribbon and physics_mode in {PhysicsMode.AUTO, PhysicsMode.SURFACE_DEFORM}:
             bpy.context.view_layer.objects.active = mmd_mesh_object
             bpy.ops.object.surfacedeform_bind(
                 modifier=MeshEditor(mmd_mesh_object).add_surface_deform_modifier(
                     'physics_cloth_deform',
-                    target=cloth_mesh_object,
-                    vertex_group=deform_vertex_group.name
+                    target=cloth_binding.cloth_mesh_object,
+                    vertex_group=cloth_binding.deform_vertex_group.name
                 ).name
             )
 
-        cloth_bm.free()
-
     @staticmethod
     def bind_mmd_mesh(mmd_mesh_object: bpy.types.Object, cloth_mesh_object: bpy.types.Object, cloth_bm: bmesh.types.BMesh, pose_bones, deform_vertex_group_index, vertices_ribbon_verts, physics_mode):
         # pylint: disable=too-many-arguments, too-many-locals
@@ -373,12 +514,12 @@ class RigidBodyToClothConverter:
         return new_down_verts
 
     @staticmethod
-    def collect_joints(mmd_model, rigid_body_index_dict: Dict[bpy.types.Object, int]) -> Tuple[List[bpy.types.Object], List[Tuple[int, int]], List[bpy.types.Object]]:
+    def collect_joints(candidate_joint_objects: Iterable[bpy.types.Object], rigid_body_index_dict: Dict[bpy.types.Object, int]) -> Tuple[List[bpy.types.Object], List[Tuple[int, int]], List[bpy.types.Object]]:
         joint_objects: List[bpy.types.Object] = []
         joint_edge_indices: List[Tuple[int, int]] = []
         side_joint_objects: List[bpy.types.Object] = []
 
-        for obj in mmd_model.joints():
+        for obj in candidate_joint_objects:
             obj1 = obj.rigid_body_constraint.object1
             obj2 = obj.rigid_body_constraint.object2
             if obj1 in rigid_body_index_dict and obj2 in rigid_body_index_dict:
@@ -473,15 +614,20 @@ class RigidBodyToClothConverter:
         def remove_edges(cloth_bm: bmesh.types.BMesh, save_edges):
             # 删除多余边
             # remove extra edge
+            save_vertex_index_pairs: Set[Tuple[int, int]] = {
+                (i0, i1) if i0 < i1 else (i1, i0)
+                for i0, i1 in save_edges
+            }
+
+            extra_edges: List[bmesh.types.BMEdge] = []
             for edge in cloth_bm.edges:
-                is_save_edge = False
-                for i in save_edges:
-                    if edge.verts[0].index in i and edge.verts[1].index in i:
-                        is_save_edge = True
-                        break
+                i0 = edge.verts[0].index
+                i1 = edge.verts[1].index
+                if ((i0, i1) if i0 < i1 else (i1, i0)) not in save_vertex_index_pairs:
+                    extra_edges.append(edge)
 
-                if not is_save_edge:
-                    cloth_bm.edges.remove(edge)
+            for edge in extra_edges:
+                cloth_bm.edges.remove(edge)
 
         bmesh.ops.holes_fill(cloth_bm, edges=cloth_bm.edges, sides=4)
         remove_edges(cloth_bm, save_edges)
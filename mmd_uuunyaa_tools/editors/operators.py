@@ -518,6 +518,12 @@ class AutoSegmentationOperator(bpy.types.Operator):
 
     edge_length_factor: bpy.props.FloatProperty(name=_('Edge Length Factor'), default=1.0, min=0, soft_max=1.0, step=1)
 
+    engine: bpy.props.EnumProperty(
+        name=_('Engine'),
+        items=segmentation.ENGINE_ITEMS,
+        default='HEAP',
+    )
+
     segmentation_vertex_color_random_seed: bpy.props.IntProperty(name=_('Segmentation Vertex Color Random Seed'), default=0, min=0)
     segmentation_vertex_color_attribute_name: bpy.props.StringProperty(name=_('Segmentation Vertex Color Attribute Name'), default='Segmentation')
 
@@ -556,7 +562,9 @@ class AutoSegmentationOperator(bpy.types.Operator):
                 self.material_change_cost_factor,
                 self.edge_sharp_cost_factor,
                 self.edge_seam_cost_factor,
-                segmentation.get_ignore_vertex_group_indices(mesh_object)
+                segmentation.get_ignore_vertex_group_indices(mesh_object),
+                self.engine,
+                mesh,
             )
 
             auto_segment_end_secs = time.perf_counter()
@@ -596,7 +604,7 @@ class AutoSegmentationOperator(bpy.types.Operator):
             self.report({'INFO'}, f"""contact: {len(cost_sorted_segment_contacts)}, cost last/max: {segment_result.last_merged_cost}/{max_cost_normalized}
 segment: {len(segments)}, area min/max: {min_segment_area}/{max_segment_area}
 loop: {total_tri_loops}
-operation: {operator_end_secs-operator_start_secs} secs, auto_segment {auto_segment_end_secs-auto_segment_start_secs} secs
+operation: {operator_end_secs-operator_start_secs} secs, auto_segment ({self.engine}) {auto_segment_end_secs-auto_segment_start_secs} secs
 """)
 
         finally:
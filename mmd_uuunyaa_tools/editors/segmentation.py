@@ -6,6 +6,7 @@
 import bisect
 import collections
 import dataclasses
+import heapq
 import itertools
 import math
 import random
@@ -14,6 +15,8 @@ from typing import Dict, List, Optional, Set, Tuple
 import bmesh
 import bpy
 import mathutils
+import numpy as np
+from mmd_uuunyaa_tools.m17n import _
 
 
 def _to_blender_color(uint8_color: int) -> float:
@@ -71,6 +74,12 @@ SegmentContactId = int
 SegmentPairId = int
 
 
+ENGINE_ITEMS = [
+    ('SCAN', _('Scan'), _('Merge segments by rescanning the sorted contacts after every merge')),
+    ('HEAP', _('Heap'), _('Merge segments with a priority queue, O(E log E). Produces the same segments as Scan')),
+]
+
+
 @dataclasses.dataclass
 class Segment:
     index: int
@@ -158,6 +167,11 @@ class SegmentResult:
     tri_loops: List[bmesh.types.BMLoop]
 
 
+def _to_pair_id_shift(count: int) -> int:
+    # the smaller one of the indices 0 to count takes the bits below the shift
+    return count.bit_length()
+
+
 def _to_loop_pair_id(loop0: bmesh.types.BMLoop, loop1: bmesh.types.BMLoop, loop_pair_shift: int) -> LoopPairId:
     loop0_index = loop0.index
     loop1_index = loop1.index
@@ -235,9 +249,11 @@ def auto_segment(
     edge_sharp_cost_factor: float,
     edge_seam_cost_factor: float,
     ignore_vertex_group_indices: Set[int],
+    engine: str = 'HEAP',
+    mesh: Optional[bpy.types.Mesh] = None,
 ) -> SegmentResult:
     tri_loops = target_bmesh.calc_loop_triangles()
-    sci2segment_contacts, segment_count = _calc_segment_contacts(
+    cost_factors = (
         contact_length_factor,
         face_angle_cost_factor,
         perimeter_cost_factor,
@@ -246,15 +262,60 @@ def auto_segment(
         material_change_cost_factor,
         edge_sharp_cost_factor,
         edge_seam_cost_factor,
-        _calc_vi2vgi2weights(target_bmesh, ignore_vertex_group_indices),
-        target_bmesh,
-        tri_loops
     )
+    vertex_group_weights = _read_vertex_group_weights(target_bmesh, ignore_vertex_group_indices)
+
+    segment_contacts = None
+    if mesh is not None:
+        # the mesh must be in sync with target_bmesh
+        segment_contacts = _calc_segment_contacts_batched(*cost_factors, vertex_group_weights, mesh, tri_loops)
+
+    if segment_contacts is None:
+        vi2vgi2weights = _calc_vi2vgi2weights(target_bmesh, vertex_group_weights)
+        segment_contacts = _calc_segment_contacts(*cost_factors, vi2vgi2weights, target_bmesh, tri_loops)
+
+    sci2segment_contacts, segment_count = segment_contacts
 
     if segment_count == 0:
         return SegmentResult(set(), [], 0.0, [])
 
-    segment_pair_shift = int(math.log2(segment_count) / 2 + 1)
+    if engine == 'HEAP':
+        merge_segment_contacts = _merge_segment_contacts_by_heap
+    elif engine == 'SCAN':
+        merge_segment_contacts = _merge_segment_contacts_by_scan
+    else:
+        raise ValueError(f'Unknown engine: {engine}')
+
+    result_segments, cost_sorted_segment_contacts, last_merged_cost = merge_segment_contacts(
+        sci2segment_contacts,
+        segment_count,
+        cost_threshold,
+        maximum_area_threshold,
+        minimum_area_threshold,
+        contact_length_factor,
+        perimeter_cost_factor,
+    )
+
+    return SegmentResult(result_segments, cost_sorted_segment_contacts, last_merged_cost, tri_loops)
+
+
+def _calc_merged_cost_normalized(segment_contact: SegmentContact, contact_length_factor: float, perimeter_cost_factor: float) -> float:
+    return (
+        (perimeter_cost_factor * segment_contact.calc_perimeter_cost() if perimeter_cost_factor != 0 else 0)
+        + (segment_contact.cost / (segment_contact.length * contact_length_factor if contact_length_factor > 0 else 1))
+    )
+
+
+def _merge_segment_contacts_by_scan(
+    sci2segment_contacts: Dict[SegmentContactId, SegmentContact],
+    segment_count: int,
+    cost_threshold: float,
+    maximum_area_threshold: float,
+    minimum_area_threshold: float,
+    contact_length_factor: float,
+    perimeter_cost_factor: float,
+) -> Tuple[Set[Segment], List[SegmentContact], float]:
+    segment_pair_shift = _to_pair_id_shift(segment_count)
 
     cost_sorted_segment_contacts = sorted(sci2segment_contacts.values(), key=_get_cost_normalized)
 
@@ -346,7 +407,7 @@ def auto_segment(
                     break
 
                 # update the cost and then sort cost_sorted_segment_contacts
-                merged_sc.cost_normalized = (perimeter_cost_factor * merged_sc.calc_perimeter_cost() if is_not_perimeter_cost_factor_0 else 0) + (merged_sc.cost / (merged_sc.length * contact_length_factor if contact_length_factor > 0 else 1))
+                merged_sc.cost_normalized = _calc_merged_cost_normalized(merged_sc, contact_length_factor, perimeter_cost_factor)
                 bisect.insort_left(
                     cost_sorted_segment_contacts,
                     cost_sorted_segment_contacts.pop(i),
@@ -362,7 +423,251 @@ def auto_segment(
         for s in (sc.segment0, sc.segment1)
     })
 
-    return SegmentResult(result_segments, cost_sorted_segment_contacts, last_merged_cost, tri_loops)
+    return result_segments, cost_sorted_segment_contacts, last_merged_cost
+
+
+class _SortedKeys:
+    """Sorted keys split into buckets, so that an insertion or a removal moves the items of one bucket only."""
+
+    BUCKET_SIZE = 1000
+
+    def __init__(self):
+        self._buckets: List[List[Tuple[float, int]]] = []
+        self._maxes: List[Tuple[float, int]] = []
+
+    def add(self, key: Tuple[float, int]):
+        if not self._buckets:
+            self._buckets.append([key])
+            self._maxes.append(key)
+            return
+
+        index = bisect.bisect_left(self._maxes, key)
+        if index == len(self._buckets):
+            index -= 1
+            self._buckets[index].append(key)
+            self._maxes[index] = key
+        else:
+            bisect.insort(self._buckets[index], key)
+
+        bucket = self._buckets[index]
+        if len(bucket) > 2 * self.BUCKET_SIZE:
+            self._buckets[index:index+1] = [bucket[:self.BUCKET_SIZE], bucket[self.BUCKET_SIZE:]]
+            self._maxes[index:index+1] = [bucket[self.BUCKET_SIZE-1], bucket[-1]]
+
+    def remove(self, key: Tuple[float, int]):
+        index = bisect.bisect_left(self._maxes, key)
+        bucket = self._buckets[index]
+        del bucket[bisect.bisect_left(bucket, key)]
+        if bucket:
+            self._maxes[index] = bucket[-1]
+        else:
+            del self._buckets[index]
+            del self._maxes[index]
+
+    def first_after(self, key: Tuple[float, int]) -> Optional[Tuple[float, int]]:
+        index = bisect.bisect_right(self._maxes, key)
+        if index == len(self._buckets):
+            return None
+        bucket = self._buckets[index]
+        return bucket[bisect.bisect_right(bucket, key)]
+
+
+def _merge_segment_contacts_by_heap(
+    sci2segment_contacts: Dict[SegmentContactId, SegmentContact],
+    segment_count: int,
+    cost_threshold: float,
+    maximum_area_threshold: float,
+    minimum_area_threshold: float,
+    contact_length_factor: float,
+    perimeter_cost_factor: float,
+) -> Tuple[Set[Segment], List[SegmentContact], float]:
+    """Same merges as the scan engine, with a priority queue instead of the rescans of the sorted contacts.
+
+    A contact is ordered by (cost_normalized, seq), seq reproduces its position in the sorted list of the scan engine:
+    the contacts are numbered in the initial order, and a re-sorted contact gets a decreasing number,
+    because bisect.insort_left puts it in front of the contacts of the same cost.
+    The heap is invalidated lazily, an entry is stale when its contact has been removed or re-sorted since it was pushed.
+
+    The contacts blocked by the area thresholds never become mergeable again, they are moved out of the heap,
+    only their order is kept for the iteration after an isolating merge:
+    the scan engine keeps iterating the list then, and skips the items shifted into the positions of the removed contacts.
+    The segment contact id sets are updated in the same order as the scan engine,
+    so the parallel contacts are coalesced into the same contact with the same float sums,
+    and the merged triangles are resolved through a union-find forest after the merging is done.
+    """
+    # pylint: disable=too-many-locals, too-many-statements, too-many-branches
+    segment_pair_shift = _to_pair_id_shift(segment_count)
+
+    is_not_perimeter_cost_factor_0 = perimeter_cost_factor != 0
+
+    sci2seq: Dict[SegmentContactId, int] = {sci: seq for seq, sci in enumerate(sci2segment_contacts)}
+    next_seqs = itertools.count(-1, -1)
+
+    cost_heap: List[Tuple[float, int, SegmentContactId]] = [(sc.cost_normalized, sci2seq[sci], sci) for sci, sc in sci2segment_contacts.items()]
+    heapq.heapify(cost_heap)
+
+    blocked_scis: Set[SegmentContactId] = set()
+    blocked_keys = _SortedKeys()
+
+    segment2parent: Dict[Segment, Segment] = {}
+
+    def _remove_segment_contact(sc: SegmentContact) -> Tuple[float, int]:
+        sci = sc.index
+        del sci2segment_contacts[sci]
+        sc.segment0.segment_contact_ids.discard(sci)
+        sc.segment1.segment_contact_ids.discard(sci)
+
+        key = (sc.cost_normalized, sci2seq.pop(sci))
+        if sci in blocked_scis:
+            blocked_scis.remove(sci)
+            blocked_keys.remove(key)
+        return key
+
+    def _peek_cost_heap() -> Optional[Tuple[float, int, SegmentContactId]]:
+        while cost_heap:
+            entry = cost_heap[0]
+            if sci2seq.get(entry[2]) == entry[1]:
+                return entry
+            # stale entry
+            heapq.heappop(cost_heap)
+        return None
+
+    def _find_root_segment(segment: Segment) -> Segment:
+        while (parent := segment2parent.get(segment)) is not None:
+            grandparent = segment2parent.get(parent)
+            if grandparent is not None:
+                # path halving
+                segment2parent[segment] = grandparent
+            segment = parent
+        return segment
+
+    result_segments: Set[Segment] = set()
+
+    last_merged_cost: float = 0
+
+    # the candidates the current iteration of the scan engine has passed over
+    skipped_entries: List[Tuple[float, int, SegmentContactId]] = []
+    is_iterating = False
+
+    while True:
+        entry = _peek_cost_heap()
+        if entry is None or entry[0] > cost_threshold:
+            if not is_iterating:
+                break
+
+            # the next iteration starts from the front
+            for skipped_entry in skipped_entries:
+                heapq.heappush(cost_heap, skipped_entry)
+            skipped_entries.clear()
+            is_iterating = False
+            continue
+
+        heapq.heappop(cost_heap)
+        cost, seq, sci = entry
+        segment_contact = sci2segment_contacts[sci]
+
+        dst_segment = segment_contact.segment0
+        src_segment = segment_contact.segment1
+
+        src_segment_area = src_segment.area
+        if src_segment_area > minimum_area_threshold and dst_segment.area + src_segment_area > maximum_area_threshold:
+            # the areas never shrink, so this contact will never be merged
+            blocked_scis.add(sci)
+            blocked_keys.add((cost, seq))
+            continue
+
+        last_merged_cost = cost
+
+        segment2parent[src_segment] = dst_segment
+        dst_segment.area += src_segment_area
+
+        _remove_segment_contact(segment_contact)
+
+        removed_keys: List[Tuple[float, int]] = []
+        dst_segment_contact_ids = dst_segment.segment_contact_ids
+        src_segment_contact_ids = src_segment.segment_contact_ids
+        for src_sci in src_segment_contact_ids:
+            sc = sci2segment_contacts[src_sci]
+            if sc.segment_replace(src_segment, dst_segment):
+                if sc.segment0 == sc.segment1:
+                    removed_keys.append(_remove_segment_contact(sc))
+                else:
+                    dst_segment_contact_ids.add(src_sci)
+
+        if len(dst_segment_contact_ids) == 0:
+            # dst_segment is isolated
+            result_segments.add(dst_segment)
+
+            # the scan engine keeps iterating the list, the items shifted into the removed positions are skipped
+            key = (cost, seq)
+            skip_count = 1 + sum(1 for removed_key in removed_keys if removed_key < key)
+            for _ in range(skip_count):
+                next_entry = _peek_cost_heap()
+                next_blocked_key = blocked_keys.first_after(key)
+                if next_entry is None and next_blocked_key is None:
+                    break
+
+                if next_blocked_key is None or (next_entry is not None and next_entry[:2] < next_blocked_key):
+                    skipped_entries.append(heapq.heappop(cost_heap))
+                    key = next_entry[:2]
+                else:
+                    key = next_blocked_key
+
+            is_iterating = True
+            continue
+
+        if is_not_perimeter_cost_factor_0:
+            dst_segment.perimeter = dst_segment.non_contact_perimeter + sum(sci2segment_contacts[sci].length for sci in dst_segment_contact_ids)
+
+        # collect mergable segment contacts
+        spi2mergable_segment_contacts: Dict[SegmentPairId, Set[SegmentContact]] = collections.defaultdict(set)
+        for edge_sci in dst_segment_contact_ids:
+            sc = sci2segment_contacts[edge_sci]
+            spi = _to_segment_pair_id(sc.segment0, sc.segment1, segment_pair_shift)
+            spi2mergable_segment_contacts[spi].add(sc)
+
+        # merge mergable segment contacts
+        for mergable_segment_contacts in spi2mergable_segment_contacts.values():
+            if len(mergable_segment_contacts) <= 1:
+                continue
+
+            mergable_segment_contacts_iter = iter(mergable_segment_contacts)
+            merged_sc = next(mergable_segment_contacts_iter)
+            for sc in mergable_segment_contacts_iter:
+                merged_sc.cost += sc.cost
+                merged_sc.length += sc.length
+                _remove_segment_contact(sc)
+
+            # update the cost and then re-sort merged_sc in front of the contacts of the same cost
+            merged_sci = merged_sc.index
+            old_key = (merged_sc.cost_normalized, sci2seq[merged_sci])
+            merged_sc.cost_normalized = _calc_merged_cost_normalized(merged_sc, contact_length_factor, perimeter_cost_factor)
+            sci2seq[merged_sci] = next(next_seqs)
+            if merged_sci in blocked_scis:
+                blocked_keys.remove(old_key)
+                blocked_keys.add((merged_sc.cost_normalized, sci2seq[merged_sci]))
+            else:
+                heapq.heappush(cost_heap, (merged_sc.cost_normalized, sci2seq[merged_sci], merged_sci))
+
+        # since the cost has been updated, the next iteration starts from the front
+        for skipped_entry in skipped_entries:
+            heapq.heappush(cost_heap, skipped_entry)
+        skipped_entries.clear()
+        is_iterating = False
+
+    for segment in segment2parent:
+        root_segment = _find_root_segment(segment)
+        root_segment.tri_loop0s.update(segment.tri_loop0s)
+
+    cost_sorted_segment_contacts = sorted(sci2segment_contacts.values(), key=lambda sc: (sc.cost_normalized, sci2seq[sc.index]))
+
+    result_segments.update({
+        s
+        for sc in cost_sorted_segment_contacts
+        for s in (sc.segment0, sc.segment1)
+    })
+
+    return result_segments, cost_sorted_segment_contacts, last_merged_cost
 
 
 def get_color_layer(target_bmesh: bmesh.types.BMesh, segmentation_vertex_color_attribute_name: str) -> bmesh.types.BMLayerItem:
@@ -445,7 +750,7 @@ def _calc_segment_contacts(
     tri_loops: List[bmesh.types.BMLoop],
 ) -> Tuple[Dict[SegmentContactId, SegmentContact], int]:
     vertex_count = len(target_bmesh.verts)
-    vertex_pair_shift = int(math.log2(vertex_count) / 2 + 1)
+    vertex_pair_shift = _to_pair_id_shift(vertex_count)
 
     vpi2weights: Dict[VertexPairId, float] = {}
 
@@ -498,7 +803,7 @@ def _calc_segment_contacts(
         return Segment(__next_segment_id)
 
     loop_count = 3 * len(tri_loops)
-    loop_pair_shift = int(math.log2(loop_count) / 2 + 1)
+    loop_pair_shift = _to_pair_id_shift(loop_count)
 
     # tri_loop_index to segment map
     tli2segment: Dict[TriLoopIndex, Segment] = collections.defaultdict(_new_segment)
@@ -610,16 +915,347 @@ def _calc_segment_contacts(
     return sci2segment_contacts, len(tli2segment)
 
 
-def _calc_vi2vgi2weights(target_bmesh: bmesh.types.BMesh, ignore_vertex_group_indices: Set[int]) -> Dict[int, Dict[int, float]]:
+SEGMENT_CONTACT_DTYPE = np.dtype([
+    ('index', np.int64),
+    ('cost', np.float64),
+    ('cost_normalized', np.float64),
+    ('length', np.float64),
+    ('segment0', np.int64),
+    ('segment1', np.int64),
+])
+
+
+VERTEX_GROUP_WEIGHT_DTYPE = np.dtype([
+    ('vertex_index', np.int32),
+    ('vertex_group_index', np.int32),
+    ('weight', np.float64),
+])
+
+
+def _to_vertex_group_arrays(vertex_group_weights: np.ndarray, vertex_count: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Pack the vertex group weights into (vertex_count, max_group_count) arrays padded by -1 indices and 0 weights."""
+    # a stable sort keeps the order of the groups within a vertex, the heaviest vertex group ties depend on it
+    vertex_group_weights = vertex_group_weights[np.argsort(vertex_group_weights['vertex_index'], kind='stable')]
+    vertex_indices = vertex_group_weights['vertex_index']
+    group_counts = np.bincount(vertex_indices, minlength=vertex_count)
+    columns = np.arange(len(vertex_group_weights)) - (np.cumsum(group_counts) - group_counts)[vertex_indices]
+
+    column_count = max(int(group_counts.max(initial=0)), 1)
+    vertex_group_indices = np.full((vertex_count, column_count), -1, dtype=np.int32)
+    vertex_group_indices[vertex_indices, columns] = vertex_group_weights['vertex_group_index']
+    weights = np.zeros((vertex_count, column_count), dtype=np.float64)
+    weights[vertex_indices, columns] = vertex_group_weights['weight']
+    return vertex_group_indices, weights
+
+
+def _calc_vertex_group_weight_costs(
+    vertex_indices0: np.ndarray,
+    vertex_indices1: np.ndarray,
+    vertex_group_indices: np.ndarray,
+    vertex_group_weights: np.ndarray,
+    chunk_element_count: int = 1 << 20,
+) -> np.ndarray:
+    # the matches take chunk_size*G*G elements, bound them rather than the rows so that many groups per vertex stay in memory
+    group_count = vertex_group_indices.shape[1]
+    chunk_size = max(chunk_element_count // (group_count * group_count), 1)
+
+    costs = np.empty(len(vertex_indices0), dtype=np.float64)
+    for start in range(0, len(vertex_indices0), chunk_size):
+        stop = start + chunk_size
+        vgis0 = vertex_group_indices[vertex_indices0[start:stop]]
+        vgis1 = vertex_group_indices[vertex_indices1[start:stop]]
+        weights0 = vertex_group_weights[vertex_indices0[start:stop]]
+        weights1 = vertex_group_weights[vertex_indices1[start:stop]]
+
+        # padded columns have no match and 0 weights, so they add nothing
+        matches = (vgis0[:, :, np.newaxis] == vgis1[:, np.newaxis, :]) & (vgis0[:, :, np.newaxis] >= 0)
+        weights1_of_vgis0 = np.sum(matches * weights1[:, np.newaxis, :], axis=2)
+        weights0_of_vgis1 = np.sum(matches * weights0[:, :, np.newaxis], axis=1)
+
+        costs[start:stop] = np.sum(np.abs(weights0 - weights1_of_vgis0), axis=1) + np.sum(np.abs(weights1 - weights0_of_vgis1), axis=1)
+    return costs
+
+
+def _calc_heaviest_vertex_group_indices(face_vertex_indices: np.ndarray, vertex_group_indices: np.ndarray, vertex_group_weights: np.ndarray) -> np.ndarray:
+    face_count = len(face_vertex_indices)
+    slot_vgis = vertex_group_indices[face_vertex_indices].reshape(face_count, -1)
+    slot_weights = vertex_group_weights[face_vertex_indices].reshape(face_count, -1)
+
+    # accumulate in the same order as _calc_heaviest_vertex_group_index, so that ties are broken identically
+    running_weights = np.empty_like(slot_weights)
+    for slot in range(slot_vgis.shape[1]):
+        previous_weights = np.zeros(face_count, dtype=np.float64)
+        found = np.zeros(face_count, dtype=bool)
+        for previous_slot in range(slot-1, -1, -1):
+            hit = ~found & (slot_vgis[:, previous_slot] == slot_vgis[:, slot])
+            previous_weights[hit] = running_weights[hit, previous_slot]
+            found |= hit
+        running_weights[:, slot] = slot_weights[:, slot] + previous_weights
+
+    running_weights[slot_vgis < 0] = -np.inf
+    return slot_vgis[np.arange(face_count), np.argmax(running_weights, axis=1)]
+
+
+def _calc_perimeter_costs(areas0: np.ndarray, perimeters0: np.ndarray, areas1: np.ndarray, perimeters1: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    # vectorized SegmentContact.calc_perimeter_cost
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_ratios = (
+            (areas0+areas1)
+            / (
+                areas0/(perimeters0/(np.sqrt(areas0)/SQRT_PI))
+                + areas1/(perimeters1/(np.sqrt(areas1)/SQRT_PI))
+            )
+        )
+        merged_ratios = (perimeters0+perimeters1-2*lengths)/(np.sqrt(areas0+areas1)/SQRT_PI)
+        return np.nan_to_num(np.maximum(merged_ratios/mean_ratios - 1, 0))
+
+
+def _calc_segment_contacts_batched(
+    contact_length_factor: float,
+    face_angle_cost_factor: float,
+    perimeter_cost_factor: float,
+    vertex_group_weight_cost_factor: float,
+    vertex_group_change_cost_factor: float,
+    material_change_cost_factor: float,
+    edge_sharp_cost_factor: float,
+    edge_seam_cost_factor: float,
+    vertex_group_weights: np.ndarray,
+    mesh: bpy.types.Mesh,
+    tri_loops: List[bmesh.types.BMLoop],
+) -> Optional[Tuple[Dict[SegmentContactId, SegmentContact], int]]:
+    """NumPy version of _calc_segment_contacts for triangulated meshes.
+
+    Reads the mesh with foreach_get and computes the contact costs as array expressions.
+    The vertex group weights are a VERTEX_GROUP_WEIGHT_DTYPE array from _read_vertex_group_weights.
+    The segment and contact indices are assigned in the same order as _calc_segment_contacts.
+    Returns None if the mesh has non triangle faces.
+    """
+    polygons = mesh.polygons
+    polygon_count = len(polygons)
+    if polygon_count == 0 or polygon_count != len(tri_loops):
+        return None
+
+    loop_totals = np.empty(polygon_count, dtype=np.int32)
+    polygons.foreach_get('loop_total', loop_totals)
+    if np.any(loop_totals != 3):
+        return None
+
+    loop_starts = np.empty(polygon_count, dtype=np.int32)
+    polygons.foreach_get('loop_start', loop_starts)
+    polygon_selects = np.empty(polygon_count, dtype=bool)
+    polygons.foreach_get('select', polygon_selects)
+    polygon_material_indices = np.empty(polygon_count, dtype=np.int32)
+    polygons.foreach_get('material_index', polygon_material_indices)
+    polygon_normals = np.empty(polygon_count * 3, dtype=np.float32)
+    polygons.foreach_get('normal', polygon_normals)
+    polygon_normals = polygon_normals.reshape(-1, 3).astype(np.float64)
+
+    loop_count = len(mesh.loops)
+    loop_vertex_indices = np.empty(loop_count, dtype=np.int32)
+    mesh.loops.foreach_get('vertex_index', loop_vertex_indices)
+    loop_edge_indices = np.empty(loop_count, dtype=np.int32)
+    mesh.loops.foreach_get('edge_index', loop_edge_indices)
+
+    edge_count = len(mesh.edges)
+    edge_sharps = np.empty(edge_count, dtype=bool)
+    mesh.edges.foreach_get('use_edge_sharp', edge_sharps)
+    edge_seams = np.empty(edge_count, dtype=bool)
+    mesh.edges.foreach_get('use_seam', edge_seams)
+
+    vertex_count = len(mesh.vertices)
+    vertex_cos = np.empty(vertex_count * 3, dtype=np.float32)
+    mesh.vertices.foreach_get('co', vertex_cos)
+    vertex_cos = vertex_cos.reshape(-1, 3).astype(np.float64)
+
+    vertex_group_indices, vertex_group_weights = _to_vertex_group_arrays(vertex_group_weights, vertex_count)
+
+    # corner k of a face is the loop from vertex k to vertex k+1, its opposite vertex is vertex k+2
+    face_loop_indices = loop_starts[:, np.newaxis] + np.arange(3, dtype=np.int32)
+    face_vertex_indices = loop_vertex_indices[face_loop_indices]
+    face_edge_indices = loop_edge_indices[face_loop_indices]
+
+    selected_face_indices = np.flatnonzero(polygon_selects)
+    segment_count = len(selected_face_indices)
+    if segment_count == 0:
+        return {}, 0
+
+    # pair up the corners of the selected faces sharing an edge
+    corner_face_indices = np.repeat(selected_face_indices, 3)
+    corner_ks = np.tile(np.arange(3), segment_count)
+    corner_edge_indices = face_edge_indices[selected_face_indices].ravel()
+    corner_order = np.lexsort((corner_ks, corner_face_indices, corner_edge_indices))
+    sorted_edge_indices = corner_edge_indices[corner_order]
+
+    this_corners_list: List[np.ndarray] = []
+    that_corners_list: List[np.ndarray] = []
+    for offset in range(1, len(corner_order)):
+        same_edges = sorted_edge_indices[offset:] == sorted_edge_indices[:-offset]
+        if not np.any(same_edges):
+            break
+        this_corners_list.append(corner_order[:-offset][same_edges])
+        that_corners_list.append(corner_order[offset:][same_edges])
+
+    this_corners = np.concatenate(this_corners_list) if this_corners_list else np.empty(0, dtype=np.int64)
+    that_corners = np.concatenate(that_corners_list) if that_corners_list else np.empty(0, dtype=np.int64)
+
+    this_faces = corner_face_indices[this_corners]
+    that_faces = corner_face_indices[that_corners]
+    is_not_same_face = this_faces != that_faces
+    this_corners = this_corners[is_not_same_face]
+    that_corners = that_corners[is_not_same_face]
+
+    # the discovery order of _calc_segment_contacts
+    contact_order = np.lexsort((corner_face_indices[that_corners], corner_ks[this_corners], corner_face_indices[this_corners]))
+    this_faces = corner_face_indices[this_corners[contact_order]]
+    this_ks = corner_ks[this_corners[contact_order]]
+    that_faces = corner_face_indices[that_corners[contact_order]]
+    that_ks = corner_ks[that_corners[contact_order]]
+    contact_count = len(this_faces)
+
+    edge_vertex_indices0 = face_vertex_indices[this_faces, this_ks]
+    edge_vertex_indices1 = face_vertex_indices[this_faces, (this_ks + 1) % 3]
+    this_vertex_indices2 = face_vertex_indices[this_faces, (this_ks + 2) % 3]
+    that_vertex_indices2 = face_vertex_indices[that_faces, (that_ks + 2) % 3]
+    contact_edge_indices = face_edge_indices[this_faces, this_ks]
+
+    edge_lengths = np.linalg.norm(vertex_cos[edge_vertex_indices0] - vertex_cos[edge_vertex_indices1], axis=1)
+
+    # cost:vertex weight = 1:1
+    cost_vertex_group_weight = edge_lengths * 0.25 * (
+        _calc_vertex_group_weight_costs(edge_vertex_indices0, this_vertex_indices2, vertex_group_indices, vertex_group_weights)
+        + _calc_vertex_group_weight_costs(edge_vertex_indices1, this_vertex_indices2, vertex_group_indices, vertex_group_weights)
+        + _calc_vertex_group_weight_costs(edge_vertex_indices0, that_vertex_indices2, vertex_group_indices, vertex_group_weights)
+        + _calc_vertex_group_weight_costs(edge_vertex_indices1, that_vertex_indices2, vertex_group_indices, vertex_group_weights)
+    )
+
+    # segment indices follow the order in which _calc_segment_contacts first touches each face,
+    # and the heaviest vertex group is accumulated from the corner of that first touch.
+    touched_faces = np.concatenate((selected_face_indices, that_faces))
+    touched_ks = np.concatenate((np.zeros(segment_count, dtype=np.int64), that_ks))
+    touched_order = np.lexsort((
+        np.concatenate((np.full(segment_count, -1), np.arange(contact_count))),
+        np.concatenate((selected_face_indices, this_faces)),
+    ))
+    unique_faces, first_touches = np.unique(touched_faces[touched_order], return_index=True)
+    face_segment_indices = np.zeros(polygon_count, dtype=np.int64)
+    face_segment_indices[unique_faces[np.argsort(first_touches)]] = np.arange(1, segment_count+1)
+    first_touch_ks = touched_ks[touched_order][first_touches]
+
+    # cost:vertex group change = 1:1
+    face_heaviest_vertex_group_indices = np.full(polygon_count, -1, dtype=np.int32)
+    face_heaviest_vertex_group_indices[unique_faces] = _calc_heaviest_vertex_group_indices(
+        face_vertex_indices[unique_faces[:, np.newaxis], (first_touch_ks[:, np.newaxis] + np.arange(3)) % 3],
+        vertex_group_indices,
+        vertex_group_weights,
+    )
+    cost_vertex_group_change = edge_lengths * (face_heaviest_vertex_group_indices[this_faces] != face_heaviest_vertex_group_indices[that_faces])
+
+    # cost:angle = 1:90 degrees
+    this_normals = polygon_normals[this_faces]
+    that_normals = polygon_normals[that_faces]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        face_angle_cosines = np.sum(this_normals * that_normals, axis=1) / (np.linalg.norm(this_normals, axis=1) * np.linalg.norm(that_normals, axis=1))
+    face_angles = np.arccos(np.clip(np.nan_to_num(face_angle_cosines, nan=1.0), -1.0, 1.0))
+    cost_face_angle = edge_lengths * (2 / math.pi) * face_angles
+
+    # cost:material = 1:1
+    cost_material_change = edge_lengths * (polygon_material_indices[this_faces] != polygon_material_indices[that_faces])
+
+    # cost:sharp = 1:1
+    cost_edge_sharp = edge_lengths * edge_sharps[contact_edge_indices]
+
+    # cost:seam = 1:1
+    cost_edge_seam = edge_lengths * edge_seams[contact_edge_indices]
+
+    cost_totals = (
+        vertex_group_weight_cost_factor * cost_vertex_group_weight
+        + vertex_group_change_cost_factor * cost_vertex_group_change
+        + face_angle_cost_factor * cost_face_angle
+        + material_change_cost_factor * cost_material_change
+        + edge_sharp_cost_factor * cost_edge_sharp
+        + edge_seam_cost_factor * cost_edge_seam
+    )
+
+    face_cos = vertex_cos[face_vertex_indices[selected_face_indices]]
+    selected_face_areas = 0.5 * np.linalg.norm(np.cross(face_cos[:, 1] - face_cos[:, 0], face_cos[:, 2] - face_cos[:, 0]), axis=1)
+    selected_face_perimeters = (
+        np.linalg.norm(face_cos[:, 0] - face_cos[:, 1], axis=1)
+        + np.linalg.norm(face_cos[:, 1] - face_cos[:, 2], axis=1)
+        + np.linalg.norm(face_cos[:, 2] - face_cos[:, 0], axis=1)
+    )
+    face_areas = np.zeros(polygon_count, dtype=np.float64)
+    face_areas[selected_face_indices] = selected_face_areas
+    face_perimeters = np.zeros(polygon_count, dtype=np.float64)
+    face_perimeters[selected_face_indices] = selected_face_perimeters
+    face_non_contact_perimeters = face_perimeters - np.bincount(this_faces, weights=edge_lengths, minlength=polygon_count)
+
+    segment_contacts = np.empty(contact_count, dtype=SEGMENT_CONTACT_DTYPE)
+    segment_contacts['index'] = np.arange(1, contact_count+1)
+    segment_contacts['cost'] = cost_totals
+    segment_contacts['cost_normalized'] = cost_totals / (edge_lengths * contact_length_factor if contact_length_factor > 0 else 1)
+    segment_contacts['length'] = edge_lengths
+    segment_contacts['segment0'] = face_segment_indices[this_faces]
+    segment_contacts['segment1'] = face_segment_indices[that_faces]
+
+    if perimeter_cost_factor != 0:
+        segment_contacts['cost_normalized'] += perimeter_cost_factor * _calc_perimeter_costs(
+            face_areas[this_faces], face_perimeters[this_faces],
+            face_areas[that_faces], face_perimeters[that_faces],
+            edge_lengths
+        )
+
+    si2segment: Dict[int, Segment] = {}
+    for face_index, segment_index, area, perimeter, non_contact_perimeter in zip(
+        selected_face_indices.tolist(),
+        face_segment_indices[selected_face_indices].tolist(),
+        selected_face_areas.tolist(),
+        selected_face_perimeters.tolist(),
+        face_non_contact_perimeters[selected_face_indices].tolist(),
+    ):
+        si2segment[segment_index] = Segment(
+            segment_index,
+            area=area,
+            perimeter=perimeter,
+            non_contact_perimeter=non_contact_perimeter,
+            tri_loop0s={tri_loops[face_index][0]},
+        )
+
+    sci2segment_contacts: Dict[SegmentContactId, SegmentContact] = {}
+    for sci, cost, cost_normalized, length, segment0_index, segment1_index in segment_contacts.tolist():
+        segment0 = si2segment[segment0_index]
+        segment1 = si2segment[segment1_index]
+        sci2segment_contacts[sci] = SegmentContact(sci, cost, cost_normalized, length, segment0, segment1)
+        segment0.segment_contact_ids.add(sci)
+        segment1.segment_contact_ids.add(sci)
+
+    return sci2segment_contacts, segment_count
+
+
+def _read_vertex_group_weights(target_bmesh: bmesh.types.BMesh, ignore_vertex_group_indices: Set[int]) -> np.ndarray:
+    """Read the deform weights into a VERTEX_GROUP_WEIGHT_DTYPE array in the vertex order.
+
+    BMesh has no bulk access to the deform layer, so the weights are read in one flat pass
+    and the ignored vertex groups are filtered as an array.
+    """
     deform_layer = target_bmesh.verts.layers.deform.verify()
-    return {
-        v.index: {
-            vgi: weight
-            for vgi, weight in v[deform_layer].items()
-            if vgi not in ignore_vertex_group_indices
-        }
+    vertex_group_weights = np.array([
+        (v.index, vgi, weight)
         for v in target_bmesh.verts
-    }
+        for vgi, weight in v[deform_layer].items()
+    ], dtype=VERTEX_GROUP_WEIGHT_DTYPE)
+
+    if ignore_vertex_group_indices:
+        ignore_vertex_group_indices = np.fromiter(ignore_vertex_group_indices, dtype=np.int32, count=len(ignore_vertex_group_indices))
+        vertex_group_weights = vertex_group_weights[~np.isin(vertex_group_weights['vertex_group_index'], ignore_vertex_group_indices)]
+
+    return vertex_group_weights
+
+
+def _calc_vi2vgi2weights(target_bmesh: bmesh.types.BMesh, vertex_group_weights: np.ndarray) -> Dict[int, Dict[int, float]]:
+    vi2vgi2weights: Dict[int, Dict[int, float]] = {v.index: {} for v in target_bmesh.verts}
+    for vi, vgi, weight in vertex_group_weights.tolist():
+        vi2vgi2weights[vi][vgi] = weight
+    return vi2vgi2weights
 
 
 def get_ignore_vertex_group_indices(mesh_object: bpy.types.Object) -> Set[int]:
@@ -18,6 +18,7 @@ from mmd_uuunyaa_tools.converters.physics.cloth_pyramid import (
     ConvertPyramidMeshToClothOperator)
 from mmd_uuunyaa_tools.converters.physics.collision import (
     RemoveMeshCollision, SelectCollisionMesh)
+from mmd_uuunyaa_tools.editors import segmentation
 from mmd_uuunyaa_tools.editors.operators import (PaintSelectedFacesOperator, RestoreSegmentationColorPaletteOperator, SetupSegmentationColorPaletteOperator, AutoSegmentationOperator,
                                                  SetupRenderEngineForEevee,
                                                  SetupRenderEngineForToonEevee,
@@ -234,6 +235,7 @@ class UuuNyaaSegmentationPanel(bpy.types.Panel):
         flow = box.grid_flow()
         flow.row().prop(mmd_uuunyaa_tools_segmentation, 'edge_length_factor')
         flow.row().prop(mmd_uuunyaa_tools_segmentation, 'segmentation_vertex_color_random_seed', text=_("Color Random Seed"))
+        flow.row().prop(mmd_uuunyaa_tools_segmentation, 'engine')
 
         op = col.operator(AutoSegmentationOperator.bl_idname, text=_("Execute Auto Segmentation"), icon='BRUSH_DATA')
         op.cost_threshold = mmd_uuunyaa_tools_segmentation.cost_threshold
@@ -247,6 +249,7 @@ class UuuNyaaSegmentationPanel(bpy.types.Panel):
         op.vertex_group_weight_cost_factor = mmd_uuunyaa_tools_segmentation.vertex_group_weight_cost_factor
         op.vertex_group_change_cost_factor = mmd_uuunyaa_tools_segmentation.vertex_group_change_cost_factor
         op.edge_length_factor = mmd_uuunyaa_tools_segmentation.edge_length_factor
+        op.engine = mmd_uuunyaa_tools_segmentation.engine
         op.segmentation_vertex_color_random_seed = mmd_uuunyaa_tools_segmentation.segmentation_vertex_color_random_seed
         op.segmentation_vertex_color_attribute_name = mmd_uuunyaa_tools_segmentation.segmentation_vertex_color_attribute_name
 
@@ -269,6 +272,12 @@ class SegmentationPropertyGroup(bpy.types.PropertyGroup):
 
     edge_length_factor: bpy.props.FloatProperty(name=_('Edge Length Factor'), default=1.0, min=0, soft_max=1.0, step=1)
 
+    engine: bpy.props.EnumProperty(
+        name=_('Engine'),
+        items=segmentation.ENGINE_ITEMS,
+        default='HEAP',
+    )
+
     segmentation_vertex_color_random_seed: bpy.props.IntProperty(name=_('Segmentation Vertex Color Random Seed'), default=0, min=0)
     segmentation_vertex_color_attribute_name: bpy.props.StringProperty(name=_('Segmentation Vertex Color Attribute Name'), default='Segmentation')
 
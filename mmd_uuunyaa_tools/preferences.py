@@ -10,7 +10,9 @@ import bpy
 
 from mmd_uuunyaa_tools import addon_updater_ops, utilities
 from mmd_uuunyaa_tools.asset_search.assets import AssetUpdater
+from mmd_uuunyaa_tools.asset_search.cache import CONTENT_CACHE
 from mmd_uuunyaa_tools.asset_search.operators import DeleteCachedFiles
+from mmd_uuunyaa_tools.asset_search.panels import ASSET_STATES
 from mmd_uuunyaa_tools.m17n import _
 
 
@@ -19,8 +21,8 @@ class MMDUuuNyaaToolsAddonPreferences(bpy.types.AddonPreferences):
     bl_idname = __package__
 
     asset_search_results_max_display_count: bpy.props.IntProperty(
-        name=_('Asset Search Results Max. Display Count'),
-        description=_('Larger value is slower'),
+        name=_('Asset Search Results per Page'),
+        description=_('Number of the search results shown on a page'),
         min=10,
         soft_max=200,
         default=50,
@@ -57,6 +59,16 @@ class MMDUuuNyaaToolsAddonPreferences(bpy.types.AddonPreferences):
         default=os.path.join(tempfile.gettempdir(), 'mmd_uuunyaa_tools_cache'),
     )
 
+    asset_cache_backend: bpy.props.EnumProperty(
+        name=_('Asset Cache Backend'),
+        description=_('Storage of the asset cache index, applied on next blender session'),
+        items=[
+            ('JOURNAL', _('Journal'), _('Store the index in a JSON lines journal')),
+            ('SQLITE', _('SQLite'), _('Store the index in a SQLite database')),
+        ],
+        default='JOURNAL',
+    )
+
     asset_max_cache_size: bpy.props.IntProperty(
         name=_('Asset Max. Cache Size (MB)'),
         description=_('Maximum size (Mega bytes) of the asset cache folder'),
@@ -65,18 +77,39 @@ class MMDUuuNyaaToolsAddonPreferences(bpy.types.AddonPreferences):
         default=10_000,
     )
 
+    asset_max_fetches_per_host: bpy.props.IntProperty(
+        name=_('Asset Max. Fetches per Host'),
+        description=_('Maximum number of simultaneous fetches from a single host'),
+        min=1,
+        soft_max=16,
+        default=10,
+        update=lambda _, __: CONTENT_CACHE.update_scheduler(),
+    )
+
+    asset_download_bandwidth_limit: bpy.props.IntProperty(
+        name=_('Asset Download Bandwidth Limit (KB/s)'),
+        description=_('Maximum bandwidth (Kilo bytes per second) of the asset downloads, 0 is unlimited.\n'
+                      'Thumbnails are not limited'),
+        min=0,
+        soft_max=1_000_000,
+        default=0,
+        update=lambda _, __: CONTENT_CACHE.update_scheduler(),
+    )
+
     asset_extract_root_folder: bpy.props.StringProperty(
         name=_('Asset Extract Root Folder'),
         description=_('Path to extract the cached assets'),
         subtype='DIR_PATH',
-        default=os.path.join(pathlib.Path.home(), 'BlenderAssets')
+        default=os.path.join(pathlib.Path.home(), 'BlenderAssets'),
+        update=lambda _, __: ASSET_STATES.clear(),
     )
 
     asset_extract_folder: bpy.props.StringProperty(
         name=_('Asset Extract Folder'),
         description=_('Path to assets. Create it under the Asset Extract Root Folder.\n'
                       'The following variables are available: {id}, {type}, {name}, {aliases[en]}, {aliases[ja]}'),
-        default='{type}/{id}.{name}'
+        default='{type}/{id}.{name}',
+        update=lambda _, __: ASSET_STATES.clear(),
     )
 
     asset_extract_json: bpy.props.StringProperty(
@@ -84,7 +117,21 @@ class MMDUuuNyaaToolsAddonPreferences(bpy.types.AddonPreferences):
         description=_('Name to assets marker JSON. Create it under the Asset Extract Folder.\n'
                       'The presence of this file is used to determine the existence of the asset.\n'
                       'The following variables are available: {id}, {type}, {name}, {aliases[en]}, {aliases[ja]}'),
-        default='{id}.json'
+        default='{id}.json',
+        update=lambda _, __: ASSET_STATES.clear(),
+    )
+
+    asset_extract_lazy: bpy.props.BoolProperty(
+        name=_('Asset Lazy Extract'),
+        description=_('Extract only the PMX, VMD and VPD files to import and the textures of the PMX models from zip and 7z archives.\n'
+                      'The other files are extracted when the asset is imported with this option off, the assets importing .blend files are extracted entirely'),
+        default=False,
+    )
+
+    asset_extract_on_download: bpy.props.BoolProperty(
+        name=_('Asset Extract on Download'),
+        description=_('Extract the downloaded archives in the background before the import'),
+        default=False,
     )
 
     # Addon updater preferences.
@@ -176,7 +223,10 @@ class MMDUuuNyaaToolsAddonPreferences(bpy.types.AddonPreferences):
         cache_folder_size = sum(f.stat().st_size for f in pathlib.Path(self.asset_cache_folder).glob('**/*') if f.is_file())
         usage_row.label(text=f'{utilities.to_human_friendly_text(cache_folder_size)}B')
 
+        col.prop(self, 'asset_cache_backend')
         col.prop(self, 'asset_max_cache_size')
+        col.prop(self, 'asset_max_fetches_per_host')
+        col.prop(self, 'asset_download_bandwidth_limit')
 
         col.operator(DeleteCachedFiles.bl_idname)
 
@@ -184,6 +234,8 @@ class MMDUuuNyaaToolsAddonPreferences(bpy.types.AddonPreferences):
         col.prop(self, 'asset_extract_root_folder')
         col.prop(self, 'asset_extract_folder')
         col.prop(self, 'asset_extract_json')
+        col.prop(self, 'asset_extract_on_download')
+        col.prop(self, 'asset_extract_lazy')
 
         col = layout.box().column()
         col.label(text=_('(Experimental) Add-on Update'), icon='ERROR')
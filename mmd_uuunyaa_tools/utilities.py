@@ -2,10 +2,14 @@
 # Copyright 2021 UuuNyaa <UuuNyaa@gmail.com>
 # This file is part of MMD UuuNyaa Tools.
 
+import contextlib
 import hashlib
 import importlib
 import math
 import re
+import threading
+import types
+from typing import Any, Dict, Optional
 
 import bpy
 from mmd_uuunyaa_tools.m17n import _
@@ -36,10 +40,34 @@ def to_human_friendly_text(number: float) -> str:
     return f'{number / 10**(3 * prefix_index):.2f}{SI_PREFIXES[prefix_index]}'
 
 
+_PREFERENCES_SNAPSHOTS = threading.local()
+
+
 def get_preferences():
+    # the worker threads must not touch bpy, they read the snapshot taken on the main thread
+    preferences_snapshot = getattr(_PREFERENCES_SNAPSHOTS, 'preferences', None)
+    if preferences_snapshot is not None:
+        return preferences_snapshot
+
     return bpy.context.preferences.addons[__package__].preferences
 
 
+def snapshot_preferences() -> types.SimpleNamespace:
+    preferences = get_preferences()
+    return types.SimpleNamespace(**{
+        name: getattr(preferences, name) for name in preferences.bl_rna.properties.keys() if name != 'rna_type'
+    })
+
+
+@contextlib.contextmanager
+def use_preferences_snapshot(preferences_snapshot: types.SimpleNamespace):
+    _PREFERENCES_SNAPSHOTS.preferences = preferences_snapshot
+    try:
+        yield preferences_snapshot
+    finally:
+        _PREFERENCES_SNAPSHOTS.preferences = None
+
+
 def sanitize_path_fragment(path_fragment: str) -> str:
     illegal_re = r'[\/\?<>\\:\*\|"]'
     control_re = r'[\x00-\x1f\x80-\x9f]'
@@ -89,6 +117,28 @@ def label_multiline(layout, text='', width=0):
         layout.label(text=line)
 
 
+def to_context_override(region_type: Optional[str] = 'WINDOW') -> Dict[str, Any]:
+    """Returns the first 3D viewport for bpy.context.temp_override, timers run without a window.
+
+    The region is left out if region_type is None.
+    """
+    window_manager = bpy.context.window_manager
+    for window in window_manager.windows:
+        for area in window.screen.areas:
+            if area.type != 'VIEW_3D':
+                continue
+
+            if region_type is None:
+                return {'window': window, 'screen': window.screen, 'area': area}
+
+            for region in area.regions:
+                if region.type == region_type:
+                    return {'window': window, 'screen': window.screen, 'area': area, 'region': region}
+
+    window = window_manager.windows[0]
+    return {'window': window, 'screen': window.screen}
+
+
 def raise_installation_error(base_from):
     raise RuntimeError(_("MMD UuuNyaa Tools is not installed correctly. Please reinstall MMD UuuNyaa Tools using the correct steps.")) from base_from
 
@@ -0,0 +1,395 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021 UuuNyaa <UuuNyaa@gmail.com>
+# This file is part of MMD UuuNyaa Tools.
+
+import contextlib
+import dataclasses
+import os
+import struct
+import types
+import zipfile
+from concurrent.futures import Future
+from typing import List, Optional
+
+import pytest
+
+try:
+    import requests  # pylint: disable=unused-import
+    REQUESTS_STUB_MODULES = {}
+except ImportError:
+    # the actions use requests only for the type annotations
+    REQUESTS_STUB_MODULES = {'requests': {'models': types.SimpleNamespace(Response=object)}}
+
+
+class StubUtilities:
+    """Resolves the assets into the folder of the test, like assets._Utilities with the default preferences."""
+
+    root_path = ''
+
+    @staticmethod
+    def resolve_path(asset):
+        asset_path = os.path.join(StubUtilities.root_path, asset.id)
+        return (asset_path, os.path.join(asset_path, f'{asset.id}.json'))
+
+    @staticmethod
+    def is_extracted(asset) -> bool:
+        return os.path.exists(StubUtilities.resolve_path(asset)[1])
+
+    @staticmethod
+    def write_json(asset):
+        with open(StubUtilities.resolve_path(asset)[1], 'w', encoding='utf-8') as file:
+            file.write('{}')
+
+
+class MessageException(Exception):
+    pass
+
+
+@pytest.fixture
+def actions_module(load_module, tmp_path):
+    StubUtilities.root_path = str(tmp_path / 'assets')
+    return load_module('asset_search/actions.py', {
+        **REQUESTS_STUB_MODULES,
+        'bpy': {},
+        'mmd_uuunyaa_tools': {'PACKAGE_PATH': str(tmp_path), 'REGISTER_HOOKS': [], 'UNREGISTER_HOOKS': []},
+        'mmd_uuunyaa_tools.asset_search.assets': {'AssetDescription': object, '_Utilities': StubUtilities},
+        'mmd_uuunyaa_tools.asset_search.sessions': {'SESSIONS': None},
+        'mmd_uuunyaa_tools.m17n': {'_': lambda text: text},
+        'mmd_uuunyaa_tools.utilities': {
+            'MessageException': MessageException,
+            'get_preferences': None,
+            'snapshot_preferences': lambda: None,
+            'use_preferences_snapshot': lambda _preferences: contextlib.nullcontext(),
+        },
+    })
+
+
+def to_text(text: str) -> bytes:
+    data = text.encode('utf-16-le')
+    return struct.pack('<i', len(data)) + data
+
+
+def new_pmx(texture_paths: List[str]) -> bytes:
+    """A PMX 2.0 model with a BDEF1 and a BDEF2 vertex, a face and the textures."""
+    data = b'PMX ' + struct.pack('<f', 2.0)
+    # UTF-16, no additional UVs, the index sizes are 1 byte
+    data += bytes((8, 0, 0, 1, 1, 1, 1, 1, 1))
+    data += b''.join(to_text(t) for t in ('model', 'model', 'comment', 'comment'))
+
+    data += struct.pack('<i', 2)
+    vertex = struct.pack('<8f', 0, 0, 0, 0, 1, 0, 0, 0)
+    data += vertex + bytes((0, 0)) + struct.pack('<f', 1.0)
+    data += vertex + bytes((1, 0, 1)) + struct.pack('<f', 0.5) + struct.pack('<f', 1.0)
+
+    data += struct.pack('<i', 3) + bytes((0, 1, 0))
+
+    data += struct.pack('<i', len(texture_paths)) + b''.join(to_text(p) for p in texture_paths)
+    return data
+
+
+def test_pmx_textures_are_read(actions_module, tmp_path):
+    pmx_file_path = tmp_path / 'model.pmx'
+    pmx_file_path.write_bytes(new_pmx(['tex\\body.png', 'スフィア.spa']))
+
+    assert actions_module.PmxTextures.read(str(pmx_file_path)) == ['tex\\body.png', 'スフィア.spa']
+
+
+def test_pmx_textures_of_truncated_file_fail(actions_module, tmp_path):
+    pmx_file_path = tmp_path / 'model.pmx'
+    pmx_file_path.write_bytes(new_pmx(['tex\\body.png'])[:-4])
+
+    with pytest.raises(EOFError):
+        actions_module.PmxTextures.read(str(pmx_file_path))
+
+
+def test_pmx_textures_of_other_file_are_empty(actions_module, tmp_path):
+    pmx_file_path = tmp_path / 'model.pmd'
+    pmx_file_path.write_bytes(b'Pmd\x00\x00\x80\x3f')
+
+    assert not actions_module.PmxTextures.read(str(pmx_file_path))
+
+
+@pytest.fixture
+def zip_file_path(tmp_path):
+    zip_file_path = str(tmp_path / 'asset.zip')
+    with zipfile.ZipFile(zip_file_path, 'w') as zip_file:
+        zip_file.writestr('Model/model.pmx', new_pmx(['Tex\\body.png']))
+        zip_file.writestr('Model/tex/body.png', b'body')
+        zip_file.writestr('Model/tex/unused.png', b'unused')
+        zip_file.writestr('readme.txt', b'readme')
+    return zip_file_path
+
+
+def list_files(path: str) -> List[str]:
+    return sorted(
+        os.path.relpath(os.path.join(root, file), path).replace(os.sep, '/')
+        for root, _dirs, files in os.walk(path)
+        for file in files
+    )
+
+
+def test_lazy_extraction_extracts_targets_and_textures(actions_module, zip_file_path):
+    asset = types.SimpleNamespace(id='asset')
+    asset_path, asset_json = StubUtilities.resolve_path(asset)
+
+    actions_module.ImportActionExecutor.unzip(zip_file_path, asset=asset, target_paths=['model/MODEL.pmx'])
+
+    # the texture path is resolved case-insensitively against the folder of the model
+    assert list_files(asset_path) == ['Model/model.pmx', 'Model/tex/body.png', 'asset.lazy.json']
+    assert not os.path.exists(asset_json)
+
+    # importing again extracts nothing
+    extracted_member_names = []
+    lazy_extraction = actions_module.LazyExtraction(asset_path, asset_json, ['Model/model.pmx', 'Model/tex/body.png', 'Model/tex/unused.png', 'readme.txt'])
+    lazy_extraction.extract(['model/MODEL.pmx'], extracted_member_names.extend)
+    assert not extracted_member_names
+
+
+def test_full_extraction_extracts_skipped_members(actions_module, zip_file_path):
+    asset = types.SimpleNamespace(id='asset')
+    asset_path, asset_json = StubUtilities.resolve_path(asset)
+
+    actions_module.ImportActionExecutor.unzip(zip_file_path, asset=asset, target_paths=['Model/model.pmx'])
+    with open(os.path.join(asset_path, 'Model', 'model.pmx'), 'ab') as file:
+        # the extracted members are not extracted again
+        file.write(b'modified')
+
+    actions_module.ImportActionExecutor.unzip(zip_file_path, asset=asset)
+
+    assert list_files(asset_path) == ['Model/model.pmx', 'Model/tex/body.png', 'Model/tex/unused.png', 'asset.json', 'readme.txt']
+    assert (open(os.path.join(asset_path, 'Model', 'model.pmx'), 'rb').read()).endswith(b'modified')
+
+
+def test_full_extraction_without_lazy_extraction(actions_module, zip_file_path):
+    asset = types.SimpleNamespace(id='asset')
+    asset_path, _asset_json = StubUtilities.resolve_path(asset)
+
+    actions_module.ImportActionExecutor.unzip(zip_file_path, asset=asset)
+
+    assert list_files(asset_path) == ['Model/model.pmx', 'Model/tex/body.png', 'Model/tex/unused.png', 'asset.json', 'readme.txt']
+
+
+@dataclasses.dataclass
+class StubX7ZipInfo:
+    filename: str
+    file_size: int
+    block: Optional[int] = None
+    date_time: Optional[tuple] = (2021, 1, 2, 3, 4, 5)
+
+    def is_dir(self) -> bool:
+        return self.filename.endswith('/')
+
+
+class StubX7ZipFile:
+    def __init__(self, on_extract=None):
+        self.extracted_batches: List[List[str]] = []
+        self.on_extract = on_extract
+
+    def extractall(self, path=None, members=None, pwd=None):
+        # pylint: disable=unused-argument
+        (list_file_name,) = members
+        with open(list_file_name[1:], 'r', encoding='utf-8') as file:
+            self.extracted_batches.append(file.read().splitlines())
+
+        if self.on_extract is not None:
+            self.on_extract()
+
+
+def test_x7zip_members_are_extracted_by_blocks(actions_module, monkeypatch, tmp_path):
+    monkeypatch.setattr(actions_module.X7ZipExtractor, 'BATCH_MEMBER_COUNT', 2)
+    zip_file = StubX7ZipFile()
+    extractor = actions_module.X7ZipExtractor(zip_file)
+
+    extractor.extract(str(tmp_path), [
+        StubX7ZipInfo('a/', 0),
+        StubX7ZipInfo('a/0', 1, 0), StubX7ZipInfo('a/1', 2, 0), StubX7ZipInfo('a/2', 3, 0),
+        StubX7ZipInfo('b/0', 4, 1), StubX7ZipInfo('b/1', 5, 1),
+        StubX7ZipInfo('c', 6), StubX7ZipInfo('d', 7), StubX7ZipInfo('e', 8),
+    ])
+
+    # a solid block is decompressed once
+    assert zip_file.extracted_batches == [['a/0', 'a/1', 'a/2'], ['b/0', 'b/1'], ['c', 'd'], ['e']]
+    assert extractor.progress.total_size == extractor.progress.extracted_size == 36
+
+
+def test_x7zip_extraction_is_canceled_between_batches(actions_module, monkeypatch, tmp_path):
+    monkeypatch.setattr(actions_module.X7ZipExtractor, 'BATCH_MEMBER_COUNT', 1)
+    progress = actions_module.ExtractionProgress()
+    zip_file = StubX7ZipFile(progress.cancel)
+
+    with pytest.raises(InterruptedError):
+        actions_module.X7ZipExtractor(zip_file, progress).extract(str(tmp_path), [StubX7ZipInfo('a', 1), StubX7ZipInfo('b', 1)])
+
+    assert zip_file.extracted_batches == [['a']]
+
+
+class StubExecutor:
+    """Runs the submitted functions when it is told to, like a ThreadPoolExecutor without idle workers."""
+
+    def __init__(self):
+        self.calls = []
+
+    def submit(self, function, *args) -> Future:
+        future = Future()
+        self.calls.append((future, function, args))
+        return future
+
+    def run_all(self):
+        calls, self.calls = self.calls, []
+        for future, function, args in calls:
+            if future.set_running_or_notify_cancel():
+                future.set_result(function(*args))
+
+
+@pytest.fixture
+def import_tasks(actions_module):
+    import_tasks = actions_module.ImportTaskQueue()
+    import_tasks._executor.shutdown()  # pylint: disable=protected-access
+    import_tasks._executor = StubExecutor()  # pylint: disable=protected-access
+    return import_tasks
+
+
+@pytest.fixture
+def executed_assets(actions_module, monkeypatch):
+    executed_assets = []
+
+    def execute_file_actions(asset, _target_file, progress):
+        progress.check_canceled()
+        executed_assets.append(asset)
+        if asset.id == 'failure':
+            raise ValueError('broken archive')
+
+    monkeypatch.setattr(actions_module.ImportActionExecutor, 'execute_file_actions', execute_file_actions)
+    return executed_assets
+
+
+def test_import_task_runs_and_finishes_on_main_thread(actions_module, import_tasks, executed_assets):
+    State = actions_module.ImportTask.State  # pylint: disable=invalid-name
+    notified_asset_ids = []
+    finished_states = []
+    import_tasks.add_listener(notified_asset_ids.append)
+    asset = types.SimpleNamespace(id='asset')
+
+    task = import_tasks.submit(asset, 'asset.zip', lambda t: finished_states.append(t.state))
+    assert import_tasks.submit(asset, 'asset.zip', lambda t: finished_states.append(t.state)) is task
+    assert task.state is State.QUEUING
+    assert import_tasks.try_get_task('asset') is task
+
+    import_tasks._executor.run_all()  # pylint: disable=protected-access
+    assert task.state is State.SUCCESS
+    assert executed_assets == [asset]
+    # the callbacks wait for the main thread
+    assert not finished_states
+    assert import_tasks.try_get_task('asset') is task
+
+    import_tasks._run_main_thread_calls()  # pylint: disable=protected-access
+    assert finished_states == [State.SUCCESS, State.SUCCESS]
+    assert import_tasks.try_get_task('asset') is None
+    assert notified_asset_ids == ['asset', 'asset', 'asset']
+
+
+def test_import_task_failure_is_kept(actions_module, import_tasks, executed_assets):
+    # pylint: disable=unused-argument
+    task = import_tasks.submit(types.SimpleNamespace(id='failure'), 'failure.zip')
+
+    import_tasks._executor.run_all()  # pylint: disable=protected-access
+
+    assert task.state is actions_module.ImportTask.State.FAILURE
+    assert isinstance(task.exception, ValueError)
+
+
+def test_queued_import_task_is_canceled(actions_module, import_tasks, executed_assets):
+    finished_tasks = []
+    task = import_tasks.submit(types.SimpleNamespace(id='asset'), 'asset.zip', finished_tasks.append)
+
+    import_tasks.cancel('asset')
+    import_tasks._executor.run_all()  # pylint: disable=protected-access
+
+    assert task.state is actions_module.ImportTask.State.CANCELED
+    assert import_tasks.try_get_task('asset') is None
+    assert not executed_assets
+    assert not finished_tasks
+
+
+def test_running_import_task_is_canceled(actions_module, import_tasks, executed_assets):
+    task = import_tasks.submit(types.SimpleNamespace(id='asset'), 'asset.zip')
+    future, function, args = import_tasks._executor.calls.pop()  # pylint: disable=protected-access
+    assert future.set_running_or_notify_cancel()
+
+    # the running extraction stops at the next check
+    import_tasks.cancel('asset')
+    assert task.state is actions_module.ImportTask.State.QUEUING
+    function(*args)
+
+    assert task.state is actions_module.ImportTask.State.CANCELED
+    assert not executed_assets
+    import_tasks._run_main_thread_calls()  # pylint: disable=protected-access
+    assert import_tasks.try_get_task('asset') is None
+
+
+class StubX7ZipModule:
+    """The x7zipfile module, x7ZipFile counts the listings."""
+
+    x7ZipInfo = StubX7ZipInfo  # pylint: disable=invalid-name
+
+    def __init__(self):
+        self.listed_paths: List[str] = []
+
+    def x7ZipFile(self, zip_file_path, pwd=None):  # pylint: disable=invalid-name
+        # pylint: disable=unused-argument
+        listed_paths = self.listed_paths
+
+        class X7ZipFile:
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *_args):
+                pass
+
+            @staticmethod
+            def infolist():
+                listed_paths.append(zip_file_path)
+                return [StubX7ZipInfo('a', 1, 0), StubX7ZipInfo('b', 2, 0)]
+
+        return X7ZipFile()
+
+
+@pytest.fixture
+def new_archive_listings(actions_module, monkeypatch, tmp_path):
+    monkeypatch.setattr(actions_module, 'get_preferences', lambda: types.SimpleNamespace(asset_cache_folder=str(tmp_path / 'cache')))
+    x7zipfile = StubX7ZipModule()
+    archive_modules = types.SimpleNamespace(load=lambda namespace: x7zipfile, remember_executor=lambda namespace: None)
+
+    def new():
+        return actions_module.ArchiveListings(archive_modules)
+
+    return new, x7zipfile
+
+
+def test_cached_archive_listing_is_returned_without_listing(new_archive_listings, tmp_path):
+    new, x7zipfile = new_archive_listings
+    zip_file_path = tmp_path / '0123456789abcdef'
+    zip_file_path.write_bytes(b'7z archive')
+
+    infos = new().list_x7zip(str(zip_file_path))
+    assert x7zipfile.listed_paths == [str(zip_file_path)]
+
+    # from the memory, and from the file after a restart
+    archive_listings = new()
+    assert archive_listings.list_x7zip(str(zip_file_path)) == infos
+    assert archive_listings.list_x7zip(str(zip_file_path)) == infos
+    assert x7zipfile.listed_paths == [str(zip_file_path)]
+
+
+def test_archive_listing_is_dropped_when_archive_changes(new_archive_listings, tmp_path):
+    new, x7zipfile = new_archive_listings
+    zip_file_path = tmp_path / '0123456789abcdef'
+    zip_file_path.write_bytes(b'7z archive')
+    archive_listings = new()
+    archive_listings.list_x7zip(str(zip_file_path))
+
+    zip_file_path.write_bytes(b'other 7z archive')
+    archive_listings.list_x7zip(str(zip_file_path))
+    new().list_x7zip(str(zip_file_path))
+
+    assert x7zipfile.listed_paths == [str(zip_file_path)] * 2
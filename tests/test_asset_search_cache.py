@@ -0,0 +1,715 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021 UuuNyaa <UuuNyaa@gmail.com>
+# This file is part of MMD UuuNyaa Tools.
+
+import json
+import os
+import re
+import threading
+import time
+import types
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import pytest
+
+try:
+    import requests  # pylint: disable=unused-import
+    REQUESTS_STUB_MODULES = {}
+except ImportError:
+    # the cache uses requests only for the type annotations
+    REQUESTS_STUB_MODULES = {'requests': {'models': types.SimpleNamespace(Response=object)}}
+
+URL = 'https://example.com/asset.zip'
+DATA = bytes(range(256)) * 1024
+ETAG = '"0123456789"'
+
+
+class StubResponse:
+    def __init__(self, status_code: int, headers: Dict[str, str], data: bytes = b'', fail_at: Optional[int] = None):
+        self.status_code = status_code
+        self.headers = headers
+        self.data = data
+        self.fail_at = fail_at
+        self.closed = False
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise IOError(f'{self.status_code} Error')
+
+    def iter_content(self, chunk_size: int):
+        for offset in range(0, len(self.data), chunk_size):
+            if self.fail_at is not None and offset >= self.fail_at:
+                raise IOError('connection was reset')
+            yield self.data[offset:offset + chunk_size]
+
+    def close(self):
+        self.closed = True
+
+
+class StubURLResolver:
+    """Serves DATA with the range requests, like a static file server."""
+
+    def __init__(self, data: bytes = DATA):
+        self.data = data
+        self.requested_headers: List[Dict[str, str]] = []
+        self.fail_at: Optional[int] = None
+        # serves the range requests from this offset instead of the requested one
+        self.range_first: Optional[int] = None
+        self.accept_ranges = True
+
+    def resolve(self, url: str, headers: Optional[Dict[str, str]] = None) -> StubResponse:
+        headers = headers or {}
+        self.requested_headers.append(dict(headers))
+
+        response_headers = {'Content-Type': 'application/zip', 'ETag': ETAG}
+        if self.accept_ranges:
+            response_headers['Accept-Ranges'] = 'bytes'
+
+        match = re.match(r'^bytes=(\d+)-(\d*)$', headers.get('Range', ''))
+        if match is None or headers.get('If-Range') != ETAG or not self.accept_ranges:
+            response_headers['Content-Length'] = str(len(self.data))
+            return StubResponse(200, response_headers, self.data, self.fail_at)
+
+        first = int(match.group(1)) if self.range_first is None else self.range_first
+        if first >= len(self.data):
+            response_headers['Content-Range'] = f'bytes */{len(self.data)}'
+            return StubResponse(416, response_headers)
+
+        last = min(int(match.group(2)), len(self.data) - 1) if match.group(2) else len(self.data) - 1
+        response_headers['Content-Length'] = str(last + 1 - first)
+        response_headers['Content-Range'] = f'bytes {first}-{last}/{len(self.data)}'
+        return StubResponse(206, response_headers, self.data[first:last + 1], self.fail_at)
+
+
+@pytest.fixture
+def cache_module(load_module):
+    class URLResolverABC:
+        pass
+
+    return load_module('asset_search/cache.py', {
+        **REQUESTS_STUB_MODULES,
+        'mmd_uuunyaa_tools': {'REGISTER_HOOKS': [], 'UNREGISTER_HOOKS': []},
+        'mmd_uuunyaa_tools.asset_search.url_resolvers': {'URLResolver': StubURLResolver, 'URLResolverABC': URLResolverABC},
+        'mmd_uuunyaa_tools.utilities': {'get_preferences': None},
+    })
+
+
+@pytest.fixture
+def url_resolver():
+    return StubURLResolver()
+
+
+@pytest.fixture
+def new_cache(cache_module, url_resolver, tmp_path):
+    caches = []
+
+    def new(cache_class_name: str = 'ContentCache', **kwargs):
+        cache = getattr(cache_module, cache_class_name)(
+            cache_folder=str(tmp_path),
+            temporary_dir=str(tmp_path / 'temporary'),
+            url_resolver=url_resolver,
+            **kwargs
+        )
+        caches.append(cache)
+        return cache
+
+    yield new
+
+    for cache in caches:
+        cache.close()
+
+
+def fetch(cache, url: str = URL):
+    contents = []
+    cache.async_get_content(url, contents.append).result()
+    return contents[0]
+
+
+def write_partial(cache_module, tmp_path, data: bytes, content_length: int = len(DATA), etag: str = ETAG):
+    partial_content = cache_module.PartialContent(str(tmp_path / 'temporary'), cache_module.Content.to_content_id(URL))
+    os.makedirs(os.path.dirname(partial_content.data_path), exist_ok=True)
+
+    with open(partial_content.data_path, 'wb') as file:
+        file.write(data)
+
+    with open(partial_content.validators_path, 'w', encoding='utf-8') as file:
+        json.dump({
+            'url': URL,
+            'etag': etag,
+            'last_modified': None,
+            'content_length': content_length,
+            'content_type': 'application/zip',
+        }, file)
+
+    return partial_content
+
+
+def read_content(content) -> bytes:
+    with open(content.filepath, 'rb') as file:
+        return file.read()
+
+
+def test_interrupted_fetch_resumes_with_range_request(cache_module, new_cache, url_resolver, tmp_path):
+    cache = new_cache()
+
+    url_resolver.fail_at = 65536 * 2
+    content = fetch(cache)
+    assert content.state is cache_module.Content.State.FAILED
+
+    partial_content = cache_module.PartialContent(cache.temporary_dir, content.id)
+    assert os.path.getsize(partial_content.data_path) == 65536 * 2
+    assert partial_content.is_resumable()
+
+    url_resolver.fail_at = None
+    content = fetch(cache)
+    assert content.state is cache_module.Content.State.CACHED
+    assert read_content(content) == DATA
+    assert url_resolver.requested_headers[-1] == {'Range': f'bytes={65536 * 2}-', 'If-Range': ETAG}
+    assert not os.path.exists(partial_content.data_path)
+    assert not os.path.exists(partial_content.validators_path)
+
+
+def test_changed_content_is_downloaded_from_the_beginning(cache_module, new_cache, url_resolver, tmp_path):
+    # the server answers a stale If-Range with the whole content
+    write_partial(cache_module, tmp_path, b'x' * 1000, etag='"stale"')
+    cache = new_cache()
+
+    content = fetch(cache)
+
+    assert content.state is cache_module.Content.State.CACHED
+    assert read_content(content) == DATA
+    assert url_resolver.requested_headers == [{'Range': 'bytes=1000-', 'If-Range': '"stale"'}]
+
+
+def test_completed_partial_is_finalized_without_request(cache_module, new_cache, url_resolver, tmp_path):
+    # the previous session crashed before the rename
+    write_partial(cache_module, tmp_path, DATA)
+    cache = new_cache()
+
+    content = fetch(cache)
+
+    assert content.state is cache_module.Content.State.CACHED
+    assert content.type == 'application/zip'
+    assert read_content(content) == DATA
+    assert not url_resolver.requested_headers
+
+
+def test_range_not_satisfiable_finalizes_completed_partial(cache_module, new_cache, url_resolver, tmp_path):
+    # the saved length is unknown, the 416 response tells it
+    write_partial(cache_module, tmp_path, DATA, content_length=0)
+    cache = new_cache()
+
+    content = fetch(cache)
+
+    assert content.state is cache_module.Content.State.CACHED
+    assert read_content(content) == DATA
+    assert len(url_resolver.requested_headers) == 1
+
+
+def test_range_not_satisfiable_restarts_broken_partial(cache_module, new_cache, url_resolver, tmp_path):
+    # longer than the content, e.g. the content was replaced with a smaller one
+    write_partial(cache_module, tmp_path, DATA + b'broken', content_length=0)
+    cache = new_cache()
+
+    content = fetch(cache)
+
+    assert content.state is cache_module.Content.State.CACHED
+    assert read_content(content) == DATA
+    assert url_resolver.requested_headers == [{'Range': f'bytes={len(DATA) + 6}-', 'If-Range': ETAG}, {}]
+
+
+def test_validators_of_other_url_are_ignored(cache_module, tmp_path):
+    partial_content = write_partial(cache_module, tmp_path, b'x' * 1000)
+
+    assert partial_content.to_resume_headers(URL) == {'Range': 'bytes=1000-', 'If-Range': ETAG}
+    assert partial_content.to_resume_headers('https://example.com/other.zip') == {}
+    assert not partial_content.is_completed('https://example.com/other.zip')
+
+
+def test_resumed_size_requires_matching_content_range(cache_module, tmp_path):
+    partial_content = write_partial(cache_module, tmp_path, b'x' * 1000)
+    resume_headers = partial_content.to_resume_headers(URL)
+
+    def to_resumed_size(status_code: int, content_range: str) -> int:
+        return partial_content.to_resumed_size(StubResponse(status_code, {'Content-Range': content_range}), resume_headers)
+
+    assert to_resumed_size(206, f'bytes 1000-{len(DATA) - 1}/{len(DATA)}') == 1000
+    assert to_resumed_size(206, f'bytes 1000-{len(DATA) - 1}/*') == 1000
+    assert to_resumed_size(206, f'bytes 0-{len(DATA) - 1}/{len(DATA)}') == 0
+    assert to_resumed_size(200, '') == 0
+
+
+def test_misaligned_range_restarts_download(cache_module, new_cache, url_resolver, tmp_path):
+    write_partial(cache_module, tmp_path, DATA[:1000])
+    url_resolver.range_first = 500
+    cache = new_cache()
+
+    content = fetch(cache)
+
+    assert content.state is cache_module.Content.State.CACHED
+    assert read_content(content) == DATA
+    assert url_resolver.requested_headers == [{'Range': 'bytes=1000-', 'If-Range': ETAG}, {}]
+
+
+def test_partial_response_to_full_request_fails(cache_module, new_cache, url_resolver, tmp_path):
+    resolve = url_resolver.resolve
+    url_resolver.resolve = lambda url, headers=None: resolve(url, {'Range': 'bytes=500-', 'If-Range': ETAG})
+    cache = new_cache()
+
+    content = fetch(cache)
+
+    assert content.state is cache_module.Content.State.FAILED
+    assert not os.path.exists(os.path.join(cache.cache_folder, content.id))
+
+
+def test_stale_partials_are_removed(cache_module, new_cache, tmp_path):
+    stale_partial = write_partial(cache_module, tmp_path, b'x' * 1000)
+    expired_at = time.time() - 8*24*60*60
+    os.utime(stale_partial.data_path, (expired_at, expired_at))
+    os.utime(stale_partial.validators_path, (expired_at, expired_at))
+
+    fresh_partial = cache_module.PartialContent(str(tmp_path / 'temporary'), 'f' * 40)
+    with open(fresh_partial.data_path, 'wb') as file:
+        file.write(b'x')
+
+    cache = new_cache()
+    cache.close()
+
+    assert not os.path.exists(stale_partial.data_path)
+    assert not os.path.exists(stale_partial.validators_path)
+    assert os.path.exists(fresh_partial.data_path)
+
+
+def test_scheduler_starts_every_runnable_fetch(cache_module):
+    started = threading.Semaphore(0)
+    finish = threading.Event()
+    running_urls = set()
+
+    def fetch(task):
+        running_urls.add(task.url)
+        started.release()
+        finish.wait(5)
+        return task
+
+    Task = cache_module.Task  # pylint: disable=invalid-name
+    with ThreadPoolExecutor(10) as executor:
+        scheduler = cache_module.FetchScheduler(executor, fetch, max_workers=10, max_host_workers=2)
+        futures = [scheduler.submit(Task(f'https://example.com/{i}', Task.State.QUEUING, priority=Task.Priority.VISIBLE)) for i in range(6)]
+
+        for _ in range(2):
+            assert started.acquire(timeout=5)
+        assert not started.acquire(timeout=0.1)
+
+        # the raised limit takes effect without waiting for a running fetch to finish
+        scheduler.max_host_workers = 6
+        scheduler.dispatch()
+        for _ in range(4):
+            assert started.acquire(timeout=5)
+
+        finish.set()
+        assert [f.result(timeout=5).url for f in futures] == [f'https://example.com/{i}' for i in range(6)]
+        assert len(running_urls) == 6
+
+
+BACKENDS = ['ContentCache', 'SQLiteContentCache']
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_contents_are_reloaded(cache_module, new_cache, backend):
+    cache = new_cache(backend)
+    content = fetch(cache)
+    cache.close()
+
+    cache = new_cache(backend)
+
+    assert cache.peek_content(URL).filepath == content.filepath
+    assert cache.peek_content(URL).state is cache_module.Content.State.CACHED
+    assert cache._contents_size == len(DATA)  # pylint: disable=protected-access
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_least_recently_used_contents_are_evicted(cache_module, new_cache, backend):
+    urls = [f'https://example.com/asset{i}.zip' for i in range(3)]
+    cache = new_cache(backend, max_cache_size_bytes=len(DATA) * 5 // 2)
+    contents = [fetch(cache, url) for url in urls]
+    cache.close()
+
+    assert not os.path.exists(contents[0].filepath)
+    assert all(os.path.exists(c.filepath) for c in contents[1:])
+
+    cache = new_cache(backend)
+    assert cache.peek_content(urls[0]) is None
+    assert all(cache.peek_content(url) is not None for url in urls[1:])
+    assert cache._contents_size == 2 * len(DATA)  # pylint: disable=protected-access
+
+
+@pytest.mark.parametrize('backend, other_backend', [BACKENDS, BACKENDS[::-1]])
+def test_backend_switch_takes_over_contents(cache_module, new_cache, tmp_path, backend, other_backend):
+    urls = [f'https://example.com/asset{i}.zip' for i in range(3)]
+    cache = new_cache(backend)
+    for url in urls:
+        fetch(cache, url)
+    cache.close()
+
+    # the eviction after the take over shows the least recently used order is kept
+    cache = new_cache(other_backend, max_cache_size_bytes=len(DATA) * 5 // 2)
+    cache.close()
+
+    assert not os.path.exists(tmp_path / 'contents.jsonl' if other_backend == 'SQLiteContentCache' else tmp_path / 'contents.sqlite3')
+    cache = new_cache(other_backend)
+    assert cache.peek_content(urls[0]) is None
+    assert all(cache.peek_content(url).state is cache_module.Content.State.CACHED for url in urls[1:])
+    assert cache._contents_size == 2 * len(DATA)  # pylint: disable=protected-access
+
+
+def test_sqlite_total_length_is_kept_in_one_row(cache_module, tmp_path):
+    Content = cache_module.Content  # pylint: disable=invalid-name
+
+    sqlite_contents = cache_module.SQLiteContents(str(tmp_path))
+    sqlite_contents.put(Content('a' * 40, Content.State.CACHED, str(tmp_path / ('a' * 40)), 'application/zip', 100))
+    sqlite_contents.put(Content('b' * 40, Content.State.CACHED, str(tmp_path / ('b' * 40)), 'application/zip', 20))
+    sqlite_contents.put(Content('a' * 40, Content.State.CACHED, str(tmp_path / ('a' * 40)), 'application/zip', 10))
+    assert sqlite_contents.pop('b' * 40).length == 20
+    assert sqlite_contents.pop('b' * 40) is None
+    assert sqlite_contents.total_length() == 10
+
+    # the databases made before the row existed are summed once
+    sqlite_contents._connection.execute('DROP TABLE contents_size')  # pylint: disable=protected-access
+    sqlite_contents.close()
+    sqlite_contents = cache_module.SQLiteContents(str(tmp_path))
+    assert sqlite_contents.total_length() == 10
+    sqlite_contents.close()
+
+
+def test_segmented_download_reassembles_content(cache_module, new_cache, url_resolver):
+    cache = new_cache(segment_count=4, segment_min_size_bytes=1024)
+
+    content = fetch(cache)
+
+    assert content.state is cache_module.Content.State.CACHED
+    assert read_content(content) == DATA
+    segment_size = len(DATA) // 4
+    assert url_resolver.requested_headers[0] == {}
+    assert sorted(h['Range'] for h in url_resolver.requested_headers[1:]) == sorted(
+        f'bytes={first}-{first + segment_size - 1}' for first in range(0, len(DATA), segment_size)
+    )
+
+
+def test_segmented_download_falls_back_without_accept_ranges(cache_module, new_cache, url_resolver):
+    url_resolver.accept_ranges = False
+    cache = new_cache(segment_count=4, segment_min_size_bytes=1024)
+
+    content = fetch(cache)
+
+    assert content.state is cache_module.Content.State.CACHED
+    assert read_content(content) == DATA
+    assert url_resolver.requested_headers == [{}]
+
+
+def test_segment_helpers_count_against_host_limit(cache_module):
+    Task = cache_module.Task  # pylint: disable=invalid-name
+    finish = threading.Event()
+    helped = threading.Semaphore(0)
+
+    def help_task():
+        helped.release()
+        finish.wait(5)
+
+    with ThreadPoolExecutor(10) as executor:
+        scheduler = cache_module.FetchScheduler(executor, lambda task: finish.wait(5), max_workers=10, max_host_workers=3)
+        running_task = Task('https://example.com/0', Task.State.QUEUING)
+        scheduler.submit(running_task)
+
+        # the running fetch takes one of the three workers of the host
+        assert scheduler.submit_helpers(running_task, help_task, 3) == 2
+        assert helped.acquire(timeout=5) and helped.acquire(timeout=5)
+
+        # the other fetches of the host wait for the helpers
+        queued_task = Task('https://example.com/1', Task.State.QUEUING)
+        future = scheduler.submit(queued_task)
+        assert not future.running()
+
+        finish.set()
+        assert future.result(timeout=5)
+
+
+def test_closed_scheduler_cancels_queued_fetches(cache_module):
+    Task = cache_module.Task  # pylint: disable=invalid-name
+    started = threading.Event()
+    finish = threading.Event()
+
+    def fetch(task):
+        started.set()
+        finish.wait(5)
+        return task
+
+    with ThreadPoolExecutor(10) as executor:
+        scheduler = cache_module.FetchScheduler(executor, fetch, max_workers=1)
+        tasks = [Task(f'https://example.com/{i}', Task.State.QUEUING, priority=Task.Priority.DOWNLOAD) for i in range(3)]
+        futures = [scheduler.submit(task) for task in tasks]
+        assert started.wait(5)
+        scheduler.reprioritize(tasks[2], Task.Priority.VISIBLE)
+
+        scheduler.close()
+        assert all(f.cancelled() for f in futures[1:])
+
+        # the running fetch is left to finish, it does not dispatch the cancelled ones
+        finish.set()
+        assert futures[0].result(timeout=5) is tasks[0]
+        assert scheduler.submit(Task('https://example.com/3', Task.State.QUEUING)).cancelled()
+
+
+def test_closed_cache_resolves_every_future(cache_module, tmp_path):
+    class BlockingURLResolver(StubURLResolver):
+        def __init__(self):
+            super().__init__()
+            self.resolving = threading.Event()
+            self.resume = threading.Event()
+
+        def resolve(self, url: str, headers: Optional[Dict[str, str]] = None) -> StubResponse:
+            self.resolving.set()
+            assert self.resume.wait(5)
+            return super().resolve(url, headers)
+
+    url_resolver = BlockingURLResolver()
+    cache = cache_module.ContentCache(
+        cache_folder=str(tmp_path),
+        temporary_dir=str(tmp_path / 'temporary'),
+        url_resolver=url_resolver,
+        max_workers=1,
+    )
+
+    futures = [cache.async_get_content(f'https://example.com/asset{i}.zip', lambda content: None) for i in range(3)]
+    assert url_resolver.resolving.wait(5)
+
+    closing = threading.Thread(target=cache.close)
+    closing.start()
+    try:
+        # the queued fetches are cancelled without waiting for the running one
+        for future in futures[1:]:
+            with pytest.raises(CancelledError):
+                future.result(timeout=5)
+    finally:
+        url_resolver.resume.set()
+        closing.join(5)
+
+    assert not closing.is_alive()
+    assert futures[0].result(timeout=5).state is cache_module.Task.State.CANCELED
+
+
+def new_content(cache_module, tmp_path, content_id: str, length: int = 10):
+    Content = cache_module.Content  # pylint: disable=invalid-name
+    return Content(content_id, Content.State.CACHED, str(tmp_path / content_id), 'application/zip', length)
+
+
+def read_journal_records(tmp_path) -> List[dict]:
+    with open(tmp_path / 'contents.jsonl', 'r', encoding='utf-8') as file:
+        return [json.loads(line) for line in file]
+
+
+def test_journal_replays_records(cache_module, tmp_path):
+    journal = cache_module.ContentJournal(str(tmp_path))
+    for content_id in ('a', 'b', 'c'):
+        journal.append_put(new_content(cache_module, tmp_path, content_id))
+    journal.append_touch('a')
+    journal.append_remove('b')
+    journal.append_put(new_content(cache_module, tmp_path, 'c', length=20))
+    journal.close()
+
+    journal = cache_module.ContentJournal(str(tmp_path))
+    contents = journal.load()
+    # least recently used first, the put of 'c' counts as a use
+    assert [(c.id, c.length) for c in contents] == [('a', 10), ('c', 20)]
+    assert journal.record_count == 6
+    assert journal.load_appended() == []
+
+
+def test_journal_batches_touches(cache_module, tmp_path):
+    journal = cache_module.ContentJournal(str(tmp_path))
+    journal.append_put(new_content(cache_module, tmp_path, 'a'))
+    journal.append_put(new_content(cache_module, tmp_path, 'b'))
+
+    def fail_file_lock():
+        raise AssertionError('a touch must not take the file lock')
+
+    file_lock = journal.file_lock
+    journal.file_lock = fail_file_lock
+    for content_id in ('a', 'b', 'a', 'a'):
+        journal.append_touch(content_id)
+    journal.file_lock = file_lock
+    assert len(read_journal_records(tmp_path)) == 2
+
+    # the repeated touches are written once, before the next record
+    journal.append_remove('b')
+    assert [(r['op'], r['id']) for r in read_journal_records(tmp_path)[2:]] == [('touch', 'b'), ('touch', 'a'), ('remove', 'b')]
+
+    journal.append_touch('a')
+    journal.flush_touches()
+    journal.flush_touches()
+    assert [(r['op'], r['id']) for r in read_journal_records(tmp_path)[5:]] == [('touch', 'a')]
+    journal.close()
+
+
+def test_journal_compaction_replaces_the_journal(cache_module, tmp_path, monkeypatch):
+    journal = cache_module.ContentJournal(str(tmp_path))
+    for content_id in ('a', 'b', 'c'):
+        journal.append_put(new_content(cache_module, tmp_path, content_id))
+    journal.append_remove('b')
+    journal.append_touch('a')
+
+    other_journal = cache_module.ContentJournal(str(tmp_path))
+    other_journal.load()
+
+    replaced_paths = []
+    replace = os.replace
+
+    def record_replace(source, destination):
+        replaced_paths.append((source, destination))
+        replace(source, destination)
+
+    monkeypatch.setattr(cache_module.os, 'replace', record_replace)
+    contents = [new_content(cache_module, tmp_path, content_id) for content_id in ('c', 'a')]
+    with journal.file_lock():
+        journal.compact(contents)
+
+    journal_path = str(tmp_path / 'contents.jsonl')
+    assert replaced_paths == [(journal_path + '.tmp', journal_path)]
+    assert not os.path.exists(journal_path + '.tmp')
+    assert journal.record_count == 2
+
+    # the batched touch is in the compacted order, it is not written again
+    journal.flush_touches()
+    assert [(r['op'], r['id']) for r in read_journal_records(tmp_path)] == [('put', 'c'), ('put', 'a')]
+
+    # the other process notices the replaced journal and reloads it
+    assert other_journal.load_appended() is None
+    assert [c.id for c in other_journal.load()] == ['c', 'a']
+    journal.close()
+
+
+def test_interrupted_compaction_keeps_the_journal(cache_module, tmp_path, monkeypatch):
+    journal = cache_module.ContentJournal(str(tmp_path))
+    journal.append_put(new_content(cache_module, tmp_path, 'a'))
+
+    def fail_replace(source, destination):
+        raise OSError('interrupted')
+
+    monkeypatch.setattr(cache_module.os, 'replace', fail_replace)
+    with pytest.raises(OSError):
+        with journal.file_lock():
+            journal.compact([new_content(cache_module, tmp_path, 'b')])
+    monkeypatch.undo()
+
+    assert [c.id for c in cache_module.ContentJournal(str(tmp_path)).load()] == ['a']
+
+
+def test_journal_skips_torn_lines(cache_module, tmp_path):
+    journal = cache_module.ContentJournal(str(tmp_path))
+    journal.append_put(new_content(cache_module, tmp_path, 'a'))
+    journal.close()
+
+    put_b_line = json.dumps(journal._to_record(new_content(cache_module, tmp_path, 'b')))  # pylint: disable=protected-access
+    with open(tmp_path / 'contents.jsonl', 'a', encoding='utf-8') as file:
+        # a broken line of an interrupted session, then a line still being written
+        file.write('{"op": "put", "id": \n')
+        file.write(put_b_line[:10])
+
+    journal = cache_module.ContentJournal(str(tmp_path))
+    assert [c.id for c in journal.load()] == ['a']
+
+    with open(tmp_path / 'contents.jsonl', 'a', encoding='utf-8') as file:
+        file.write(put_b_line[10:] + '\n')
+
+    assert [r['id'] for r in journal.load_appended()] == ['b']
+
+
+def test_legacy_contents_json_is_migrated(cache_module, new_cache, tmp_path):
+    content_ids = [cache_module.Content.to_content_id(f'https://example.com/asset{i}.zip') for i in range(2)]
+    for content_id in content_ids:
+        (tmp_path / content_id).write_bytes(DATA)
+
+    with open(tmp_path / 'contents.json', 'w', encoding='utf-8') as file:
+        json.dump({
+            content_id: {'id': content_id, 'state': 'CACHED', 'filepath': content_id, 'type': 'application/zip', 'length': len(DATA)}
+            for content_id in content_ids
+        }, file)
+
+    cache = new_cache()
+
+    assert not os.path.exists(tmp_path / 'contents.json')
+    assert [r['id'] for r in read_journal_records(tmp_path)] == content_ids
+    assert [cache.peek_content(f'https://example.com/asset{i}.zip').filepath for i in range(2)] == [str(tmp_path / c) for c in content_ids]
+    assert cache._contents_size == 2 * len(DATA)  # pylint: disable=protected-access
+
+
+def test_cache_hits_are_journaled_in_batches(cache_module, new_cache, tmp_path):
+    urls = [f'https://example.com/asset{i}.zip' for i in range(3)]
+    cache = new_cache(contents_journal_flush_interval_secs=0.05)
+    for url in urls:
+        fetch(cache, url)
+
+    record_count = len(read_journal_records(tmp_path))
+    for _ in range(10):
+        cache.try_get_content(urls[0])
+
+    deadline = time.monotonic() + 5
+    while len(read_journal_records(tmp_path)) == record_count and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    touch_content_id = cache_module.Content.to_content_id(urls[0])
+    assert [(r['op'], r['id']) for r in read_journal_records(tmp_path)[record_count:]] == [('touch', touch_content_id)]
+
+    # the touch survives the reload, the least recently used is evicted
+    cache.close()
+    cache = new_cache(max_cache_size_bytes=len(DATA) * 5 // 2)
+    cache.close()
+    cache = new_cache()
+    assert cache.peek_content(urls[1]) is None
+    assert cache.peek_content(urls[0]) is not None
+
+
+def test_caches_sharing_a_folder_download_once(cache_module, tmp_path):
+    class BlockingURLResolver(StubURLResolver):
+        def __init__(self):
+            super().__init__()
+            self.resolving = threading.Event()
+            self.resume = threading.Event()
+
+        def resolve(self, url: str, headers: Optional[Dict[str, str]] = None) -> StubResponse:
+            self.resolving.set()
+            assert self.resume.wait(5)
+            return super().resolve(url, headers)
+
+    url_resolver = BlockingURLResolver()
+    caches = [
+        cache_module.ContentCache(
+            cache_folder=str(tmp_path),
+            temporary_dir=str(tmp_path / 'temporary'),
+            url_resolver=url_resolver,
+            content_lock_poll_interval_secs=0.01,
+        )
+        for _ in range(2)
+    ]
+
+    try:
+        contents = [[], []]
+        future0 = caches[0].async_get_content(URL, contents[0].append)
+        assert url_resolver.resolving.wait(5)
+
+        # the second cache waits for the content lock held by the first one
+        future1 = caches[1].async_get_content(URL, contents[1].append)
+        time.sleep(0.1)
+        assert not future1.done()
+
+        url_resolver.resume.set()
+        future0.result(5)
+        future1.result(5)
+    finally:
+        url_resolver.resume.set()
+        for cache in caches:
+            cache.close()
+
+    assert len(url_resolver.requested_headers) == 1
+    assert contents[0][0].filepath == contents[1][0].filepath
+    assert read_content(contents[1][0]) == DATA
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021 UuuNyaa <UuuNyaa@gmail.com>
+# This file is part of MMD UuuNyaa Tools.
+
+import types
+from typing import Callable, Dict, List, Optional, Set
+
+import pytest
+
+
+class _TypeNamespace:
+    """bpy.types are only used as the base classes and in the annotations."""
+
+    def __getattr__(self, name: str) -> type:
+        return type(name, (), {})
+
+
+class _PropertyNamespace:
+    """bpy.props are only used in the class annotations."""
+
+    def __getattr__(self, name: str):
+        return lambda **kwargs: None
+
+
+class StubContent:
+    # pylint: disable=too-few-public-methods
+
+    class State:
+        CACHED = 'CACHED'
+        FAILED = 'FAILED'
+
+    def __init__(self, state: str):
+        self.state = state
+
+    @staticmethod
+    def to_content_id(url: str) -> str:
+        return f'content:{url}'
+
+
+class StubContentCache:
+    def __init__(self):
+        self.contents: Dict[str, StubContent] = {}
+        self.listeners: List[Callable[[Optional[str]], None]] = []
+
+    def add_listener(self, listener: Callable[[Optional[str]], None]):
+        self.listeners.append(listener)
+
+    def peek_content(self, url: str) -> Optional[StubContent]:
+        return self.contents.get(url)
+
+    def try_get_task(self, url: str):
+        return None
+
+    def put(self, url: str, content: StubContent):
+        self.contents[url] = content
+        for listener in self.listeners:
+            listener(StubContent.to_content_id(url))
+
+
+class StubImportTasks:
+    def __init__(self):
+        self.asset_ids: Set[str] = set()
+        self.listeners: List[Callable[[str], None]] = []
+
+    def add_listener(self, listener: Callable[[str], None]):
+        self.listeners.append(listener)
+
+    def try_get_task(self, asset_id: str):
+        return asset_id if asset_id in self.asset_ids else None
+
+    def notify(self, asset_id: str):
+        for listener in self.listeners:
+            listener(asset_id)
+
+
+class StubAssets:
+    def __init__(self):
+        self.extracted_ids: Set[str] = set()
+        self.checked_ids: List[str] = []
+
+    def is_extracted(self, asset_id: str) -> bool:
+        # a file system check in the add-on
+        self.checked_ids.append(asset_id)
+        return asset_id in self.extracted_ids
+
+
+@pytest.fixture
+def stubs():
+    return types.SimpleNamespace(assets=StubAssets(), content_cache=StubContentCache(), import_tasks=StubImportTasks())
+
+
+@pytest.fixture
+def panels(load_module, stubs):
+    return load_module('asset_search/panels.py', {
+        'bpy': {
+            'types': _TypeNamespace(),
+            'props': _PropertyNamespace(),
+            'utils': types.SimpleNamespace(previews=types.SimpleNamespace(ImagePreviewCollection=object)),
+        },
+        'bpy.utils': {},
+        'bpy.utils.previews': {},
+        'mmd_uuunyaa_tools': {'PACKAGE_PATH': ''},
+        'mmd_uuunyaa_tools.asset_search.actions': {
+            'IMPORT_TASKS': stubs.import_tasks,
+            'ImportActionExecutor': None,
+            'ImportTask': None,
+            'MessageException': Exception,
+        },
+        'mmd_uuunyaa_tools.asset_search.assets': {'ASSETS': stubs.assets, 'AssetDescription': object},
+        'mmd_uuunyaa_tools.asset_search.cache': {'CONTENT_CACHE': stubs.content_cache, 'Content': StubContent, 'Task': None},
+        'mmd_uuunyaa_tools.asset_search.operators': {
+            'DeleteDebugAssetJson': None,
+            'ReloadAssetJsons': None,
+            'UpdateAssetJson': None,
+            'UpdateDebugAssetJson': None,
+        },
+        'mmd_uuunyaa_tools.m17n': {'_': lambda text: text, 'iface_': lambda text: text},
+        'mmd_uuunyaa_tools.utilities': {
+            'get_preferences': None,
+            'label_multiline': None,
+            'to_context_override': None,
+            'to_human_friendly_text': None,
+            'to_int32': None,
+        },
+    })
+
+
+def new_asset(asset_id: str) -> types.SimpleNamespace:
+    return types.SimpleNamespace(id=asset_id, download_action=f'https://example.com/{asset_id}.zip')
+
+
+def test_extracted_state_is_checked_once_until_the_import_task_notifies(panels, stubs):
+    asset_states = panels.ASSET_STATES
+    asset = new_asset('a')
+
+    assert asset_states.get(asset)[0] is panels.AssetState.INITIALIZED
+    assert stubs.assets.checked_ids == ['a']
+
+    # the content changes do not change the extracted state
+    stubs.content_cache.put(asset.download_action, StubContent(StubContent.State.CACHED))
+    assert asset_states.get(asset)[0] is panels.AssetState.CACHED
+    assert stubs.assets.checked_ids == ['a']
+
+    # the import task extracts the asset
+    stubs.import_tasks.asset_ids.add('a')
+    stubs.import_tasks.notify('a')
+    assert asset_states.get(asset)[0] is panels.AssetState.EXTRACTING
+
+    stubs.import_tasks.asset_ids.discard('a')
+    stubs.assets.extracted_ids.add('a')
+    stubs.import_tasks.notify('a')
+    assert asset_states.get(asset)[0] is panels.AssetState.EXTRACTED
+    assert stubs.assets.checked_ids == ['a', 'a']
+
+    stubs.content_cache.put(asset.download_action, StubContent(StubContent.State.FAILED))
+    assert asset_states.get(asset)[0] is panels.AssetState.EXTRACTED
+    assert stubs.assets.checked_ids == ['a', 'a']
+
+
+def test_clear_checks_the_extracted_state_again(panels, stubs):
+    asset_states = panels.ASSET_STATES
+    asset = new_asset('a')
+
+    assert not asset_states.is_extracted(asset.id)
+    assert not asset_states.is_extracted(asset.id)
+
+    # e.g. the asset extract folder is changed in the preferences
+    stubs.assets.extracted_ids.add('a')
+    asset_states.clear()
+    assert asset_states.is_extracted(asset.id)
+    assert stubs.assets.checked_ids == ['a', 'a']
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021 UuuNyaa <UuuNyaa@gmail.com>
+# This file is part of MMD UuuNyaa Tools.
+
+import types
+from typing import Dict, Tuple
+
+import numpy as np
+import pytest
+
+
+class _TypeNamespace:
+    """bpy.types and bmesh.types are only used in the annotations and as base classes."""
+
+    def __getattr__(self, name: str) -> type:
+        return type(name, (), {})
+
+
+class _PropertyNamespace:
+    """bpy.props are only used in the class annotations."""
+
+    def __getattr__(self, name: str):
+        return lambda **kwargs: None
+
+
+@pytest.fixture
+def cloth_pyramid(load_module):
+    return load_module('converters/physics/cloth_pyramid.py', {
+        'bmesh': {'types': _TypeNamespace()},
+        'bpy': {'types': _TypeNamespace(), 'props': _PropertyNamespace()},
+        'mathutils': {'Matrix': object, 'Vector': object, 'kdtree': types.SimpleNamespace(KDTree=object)},
+        'mmd_uuunyaa_tools.editors.armatures': {'ArmatureEditor': object},
+        'mmd_uuunyaa_tools.editors.meshes': {'MeshEditor': object},
+        'mmd_uuunyaa_tools.m17n': {'_': lambda text: text},
+        'mmd_uuunyaa_tools.utilities': {'MessageException': Exception},
+    })
+
+
+def new_grid_node_pairs(size: int, seed: int) -> Dict[Tuple[int, int], float]:
+    """A size x size grid graph with the exp(-span) magnitudes of build_deform_weight_graph."""
+    rng = np.random.default_rng(seed)
+    node_pair2magnitude: Dict[Tuple[int, int], float] = {}
+    for y in range(size):
+        for x in range(size):
+            node = y*size + x
+            if x+1 < size:
+                node_pair2magnitude[(node, node+1)] = float(np.exp(-rng.uniform(0.05, 0.5)))
+            if y+1 < size:
+                node_pair2magnitude[(node, node+size)] = float(np.exp(-rng.uniform(0.05, 0.5)))
+    return node_pair2magnitude
+
+
+@pytest.mark.parametrize('size', [17, 44])
+def test_sparse_heat_diffusion_matches_dense_heat_diffusion(cloth_pyramid, size):
+    node_count = size * size
+    node_pair2magnitude = new_grid_node_pairs(size, seed=size)
+
+    # five columns like the pyramid bones, a unit source each and a few scattered weights
+    rng = np.random.default_rng(size)
+    vectors = np.zeros((node_count, 5))
+    vectors[rng.integers(0, node_count, 5), np.arange(5)] = 1.0
+    vectors += rng.random((node_count, 5)) * (rng.random((node_count, 5)) < 0.05)
+
+    expected = cloth_pyramid.DenseHeatDiffusion(node_count, node_pair2magnitude, 2.0).apply(vectors)
+    actual = cloth_pyramid.SparseHeatDiffusion(node_count, node_pair2magnitude, 2.0).apply(vectors)
+
+    np.testing.assert_allclose(actual, expected, rtol=0, atol=1e-10)
+
+
+def test_heat_diffusion_uses_lanczos_above_dense_max_node_count(cloth_pyramid):
+    dense_max_node_count = cloth_pyramid.HeatDiffusion.DENSE_MAX_NODE_COUNT
+
+    def new_path_node_pairs(node_count: int) -> Dict[Tuple[int, int], float]:
+        return {(node, node+1): 1.0 for node in range(node_count-1)}
+
+    dense_heat_diffusion = cloth_pyramid.HeatDiffusion.build(dense_max_node_count, new_path_node_pairs(dense_max_node_count), 2.0)
+    assert type(dense_heat_diffusion) is cloth_pyramid.DenseHeatDiffusion  # pylint: disable=unidiomatic-typecheck
+
+    sparse_heat_diffusion = cloth_pyramid.HeatDiffusion.build(dense_max_node_count+1, new_path_node_pairs(dense_max_node_count+1), 2.0)
+    assert type(sparse_heat_diffusion) is cloth_pyramid.SparseHeatDiffusion  # pylint: disable=unidiomatic-typecheck
+
+
+class MeshCollection:
+    """The part of bpy_prop_collection used by DeformWeightGraphCache.to_key."""
+
+    def __init__(self, attribute: str, values: np.ndarray):
+        self._attribute = attribute
+        self._values = values
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def foreach_get(self, attribute: str, array: np.ndarray):
+        assert attribute == self._attribute
+        array[:] = self._values.ravel()
+
+
+def new_mesh(vertex_cos: np.ndarray, edge_vids: np.ndarray) -> types.SimpleNamespace:
+    return types.SimpleNamespace(vertices=MeshCollection('co', vertex_cos), edges=MeshCollection('vertices', edge_vids))
+
+
+IDENTITY_MATRIX = tuple(tuple(1.0 if row == col else 0.0 for col in range(4)) for row in range(4))
+
+
+def test_deform_weight_graph_key_changes_with_the_geometry(cloth_pyramid):
+    to_key = cloth_pyramid.DeformWeightGraphCache.to_key
+    vertex_cos = np.random.default_rng(0).random((4, 3)).astype(np.float32)
+    edge_vids = np.array([(0, 1), (1, 2), (2, 3), (3, 0)], dtype=np.int32)
+    vid2weight = {0: 1.0, 1: 0.5, 2: 0.0}
+
+    key = to_key(new_mesh(vertex_cos, edge_vids), IDENTITY_MATRIX, vid2weight, 0)
+    assert to_key(new_mesh(vertex_cos.copy(), edge_vids.copy()), IDENTITY_MATRIX, dict(vid2weight), 0) == key
+
+    moved_vertex_cos = vertex_cos.copy()
+    moved_vertex_cos[2, 1] += 0.01
+    translated_matrix = tuple(row[:3] + (1.0,) if index == 0 else row for index, row in enumerate(IDENTITY_MATRIX))
+    assert len({
+        key,
+        to_key(new_mesh(moved_vertex_cos, edge_vids), IDENTITY_MATRIX, vid2weight, 0),
+        to_key(new_mesh(vertex_cos, edge_vids[[0, 1, 3, 2]]), IDENTITY_MATRIX, vid2weight, 0),
+        to_key(new_mesh(vertex_cos, edge_vids), translated_matrix, vid2weight, 0),
+        to_key(new_mesh(vertex_cos, edge_vids), IDENTITY_MATRIX, {**vid2weight, 2: 0.25}, 0),
+        to_key(new_mesh(vertex_cos, edge_vids), IDENTITY_MATRIX, vid2weight, 1),
+    }) == 6
+
+
+def new_graph(cloth_pyramid) -> object:
+    return cloth_pyramid.DeformWeightGraph({}, {}, {}, {}, set(), None, None)
+
+
+def test_deform_weight_graph_cache_hits_until_the_geometry_changes(cloth_pyramid):
+    cache = cloth_pyramid.DeformWeightGraphCache()
+    vertex_cos = np.zeros((3, 3), dtype=np.float32)
+    edge_vids = np.array([(0, 1), (1, 2)], dtype=np.int32)
+
+    key = cache.to_key(new_mesh(vertex_cos, edge_vids), IDENTITY_MATRIX, {0: 1.0}, 0)
+    assert cache.get(key) is None
+
+    graph = new_graph(cloth_pyramid)
+    cache.put(key, graph)
+    assert cache.get(cache.to_key(new_mesh(vertex_cos.copy(), edge_vids), IDENTITY_MATRIX, {0: 1.0}, 0)) is graph
+
+    vertex_cos[1] = (0.0, 0.0, 1.0)
+    assert cache.get(cache.to_key(new_mesh(vertex_cos, edge_vids), IDENTITY_MATRIX, {0: 1.0}, 0)) is None
+
+
+def test_deform_weight_graph_cache_evicts_the_least_recently_used(cloth_pyramid):
+    cache = cloth_pyramid.DeformWeightGraphCache(max_graph_count=2, max_weights_count=2)
+    graphs = [new_graph(cloth_pyramid) for _ in range(3)]
+
+    cache.put('a', graphs[0])
+    cache.put('b', graphs[1])
+    assert cache.get('a') is graphs[0]
+
+    # 'b' is the least recently used after the get of 'a'
+    cache.put('c', graphs[2])
+    assert cache.get('b') is None
+    assert cache.get('a') is graphs[0]
+    assert cache.get('c') is graphs[2]
+
+    graph = graphs[0]
+    cache.put_weights(graph, (0.0,), np.zeros(1))
+    cache.put_weights(graph, (1.0,), np.ones(1))
+    assert cache.get_weights(graph, (0.0,)) is not None
+
+    cache.put_weights(graph, (2.0,), np.full(1, 2.0))
+    assert cache.get_weights(graph, (1.0,)) is None
+    assert cache.get_weights(graph, (0.0,)) is not None
+    assert cache.get_weights(graph, (2.0,)) is not None
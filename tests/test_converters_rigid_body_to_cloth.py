@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021 UuuNyaa <UuuNyaa@gmail.com>
+# This file is part of MMD UuuNyaa Tools.
+
+import types
+from typing import List, Optional
+
+import pytest
+
+
+class _TypeNamespace:
+    """bpy.types and bmesh.types are only used in the annotations."""
+
+    def __getattr__(self, name: str) -> type:
+        return type(name, (), {})
+
+
+@pytest.fixture
+def rigid_body_to_cloth(load_module):
+    return load_module('converters/physics/rigid_body_to_cloth.py', {
+        'bmesh': {'types': _TypeNamespace()},
+        'bpy': {'types': _TypeNamespace()},
+        'mmd_uuunyaa_tools.editors.meshes': {'MeshEditor': None},
+        'mmd_uuunyaa_tools.m17n': {'_': lambda text: text, 'iface_': lambda text: text},
+        'mmd_uuunyaa_tools.utilities': {'MessageException': Exception, 'import_mmd_tools': None},
+    })
+
+
+class Object:
+    """bpy.types.Object is hashed by identity."""
+
+    def __init__(self, name: str, **kwargs):
+        self.name = name
+        self.__dict__.update(kwargs)
+
+
+def new_joint(name: str, object1: Optional[Object], object2: Optional[Object]) -> Object:
+    return Object(name, rigid_body_constraint=types.SimpleNamespace(object1=object1, object2=object2))
+
+
+def to_names(objects: List[Object]) -> List[str]:
+    return [obj.name for obj in objects]
+
+
+def test_partition_rigid_bodies_by_joint_components(rigid_body_to_cloth):
+    rigid_bodies = [Object(f'r{i}') for i in range(7)]
+    r0, r1, r2, r3, r4, r5, r6 = rigid_bodies
+    outside = Object('outside')
+
+    joints = [
+        new_joint('j03', r0, r3),
+        new_joint('j14', r1, r4),
+        new_joint('j35', r3, r5),
+        # a joint to an unselected rigid body stays with the selected end
+        new_joint('j4x', r4, outside),
+        new_joint('jx1', outside, r1),
+        # joints without selected rigid bodies are not related
+        new_joint('jxx', outside, outside),
+        new_joint('j50', r5, r0),
+    ]
+
+    components = rigid_body_to_cloth.RigidBodyToClothConverter.partition_rigid_bodies(rigid_bodies, joints)
+
+    # in the order of the first rigid body of each component, keeping the rigid body and joint orders
+    assert [(to_names(c_rigid_bodies), to_names(c_joints)) for c_rigid_bodies, c_joints in components] == [
+        (['r0', 'r3', 'r5'], ['j03', 'j35', 'j50']),
+        (['r1', 'r4'], ['j14', 'j4x', 'jx1']),
+        (['r2'], []),
+        (['r6'], []),
+    ]
+
+
+def test_partition_rigid_bodies_merges_chains_joined_late(rigid_body_to_cloth):
+    rigid_bodies = [Object(f'r{i}') for i in range(6)]
+
+    # two chains, r0-r1-r2 and r3-r4-r5, are joined by the last joint
+    joints = [new_joint(f'j{i}', rigid_bodies[i], rigid_bodies[i+1]) for i in (0, 1, 3, 4)]
+    joints.append(new_joint('j52', rigid_bodies[5], rigid_bodies[2]))
+
+    components = rigid_body_to_cloth.RigidBodyToClothConverter.partition_rigid_bodies(rigid_bodies, joints)
+
+    assert [(to_names(c_rigid_bodies), to_names(c_joints)) for c_rigid_bodies, c_joints in components] == [
+        (['r0', 'r1', 'r2', 'r3', 'r4', 'r5'], ['j0', 'j1', 'j3', 'j4', 'j52']),
+    ]
@@ -0,0 +1,420 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021 UuuNyaa <UuuNyaa@gmail.com>
+# This file is part of MMD UuuNyaa Tools.
+
+import random
+import types
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pytest
+
+
+class _TypeNamespace:
+    """bpy.types and bmesh.types are only used in the annotations."""
+
+    def __getattr__(self, name: str) -> type:
+        return type(name, (), {})
+
+
+class Vector:
+    """The part of mathutils.Vector used by _calc_segment_contacts."""
+
+    def __init__(self, xyz):
+        self.xyz = np.asarray(xyz, dtype=np.float64)
+
+    def __sub__(self, other: 'Vector') -> 'Vector':
+        return Vector(self.xyz - other.xyz)
+
+    @property
+    def length(self) -> float:
+        return float(np.linalg.norm(self.xyz))
+
+    def angle(self, other: 'Vector') -> float:
+        cosine = np.dot(self.xyz, other.xyz) / (np.linalg.norm(self.xyz) * np.linalg.norm(other.xyz))
+        return float(np.arccos(np.clip(cosine, -1.0, 1.0)))
+
+
+def area_tri(v0: Vector, v1: Vector, v2: Vector) -> float:
+    return 0.5 * float(np.linalg.norm(np.cross(v1.xyz - v0.xyz, v2.xyz - v0.xyz)))
+
+
+class BMVert:
+    def __init__(self, index: int, co: Vector):
+        self.index = index
+        self.co = co
+        self.deform: Dict[int, float] = {}
+
+    def __getitem__(self, layer: str) -> Dict[int, float]:
+        # the deform layer is the only layer read
+        return self.deform
+
+
+class BMVertSeq(list):
+    layers = types.SimpleNamespace(deform=types.SimpleNamespace(verify=lambda: 'deform'))
+
+
+class BMEdge:
+    def __init__(self, index: int, verts: Tuple[BMVert, BMVert], sharp: bool, seam: bool):
+        self.index = index
+        self.verts = verts
+        self.smooth = not sharp
+        self.seam = seam
+
+    def calc_length(self) -> float:
+        return (self.verts[0].co - self.verts[1].co).length
+
+
+class BMFace:
+    def __init__(self, index: int, select: bool, material_index: int):
+        self.index = index
+        self.select = select
+        self.material_index = material_index
+
+
+class BMLoop:
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, index: int, vert: BMVert, edge: BMEdge, face: BMFace):
+        self.index = index
+        self.vert = vert
+        self.edge = edge
+        self.face = face
+        self.link_loop_next: 'BMLoop' = None
+        self.link_loop_prev: 'BMLoop' = None
+        self.link_loop_radial_next: 'BMLoop' = None
+
+    def calc_normal(self) -> Vector:
+        normal = np.cross(self.link_loop_next.vert.co.xyz - self.vert.co.xyz, self.link_loop_prev.vert.co.xyz - self.vert.co.xyz)
+        return Vector(normal / np.linalg.norm(normal))
+
+
+class MeshCollection:
+    """The part of bpy_prop_collection used by _calc_segment_contacts_batched."""
+
+    def __init__(self, items: List[Dict[str, object]]):
+        self._items = items
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def foreach_get(self, attribute: str, array: np.ndarray):
+        array[:] = np.ravel([item[attribute] for item in self._items])
+
+
+class GridMesh:
+    """A triangulated grid with a fin on one edge, built as both a BMesh and a Mesh."""
+
+    def __init__(self, seed: int, size: int = 8, select_ratio: float = 0.9, duplicate_count: int = 0):
+        rng = random.Random(seed)
+
+        # Blender stores the coordinates in float32
+        cos = [
+            np.array((x, y, rng.uniform(-0.3, 0.3)), dtype=np.float32).astype(np.float64)
+            for y in range(size+1) for x in range(size+1)
+        ]
+        faces: List[Tuple[int, int, int]] = []
+        for y in range(size):
+            for x in range(size):
+                v00 = y*(size+1) + x
+                v10, v01, v11 = v00+1, v00+size+1, v00+size+2
+                faces.extend(((v00, v10, v11), (v00, v11, v01)) if rng.random() < 0.5 else ((v00, v10, v01), (v10, v11, v01)))
+
+        # three faces share the first edge
+        cos.append(np.array((0.5, -0.5, 0.5), dtype=np.float32).astype(np.float64))
+        faces.append((faces[0][1], faces[0][0], len(cos)-1))
+
+        # double sided faces share the three edges, they have parallel contacts
+        for face_index in rng.sample(range(len(faces)), duplicate_count):
+            vi0, vi1, vi2 = faces[face_index]
+            faces.append((vi0, vi2, vi1))
+
+        self.verts = [BMVert(i, Vector(co)) for i, co in enumerate(cos)]
+
+        vertex_pair2edge: Dict[Tuple[int, int], BMEdge] = {}
+        self.faces: List[BMFace] = []
+        self.tri_loops: List[List[BMLoop]] = []
+        edge_loops: Dict[int, List[BMLoop]] = {}
+        for face_index, face_vertex_indices in enumerate(faces):
+            face = BMFace(face_index, select=rng.random() < select_ratio, material_index=rng.choice((0, 0, 0, 1)))
+            self.faces.append(face)
+
+            loops = []
+            for k in range(3):
+                vi0, vi1 = face_vertex_indices[k], face_vertex_indices[(k+1) % 3]
+                vertex_pair = (min(vi0, vi1), max(vi0, vi1))
+                edge = vertex_pair2edge.get(vertex_pair)
+                if edge is None:
+                    edge = BMEdge(
+                        len(vertex_pair2edge),
+                        (self.verts[vi0], self.verts[vi1]),
+                        sharp=rng.random() < 0.1,
+                        seam=rng.random() < 0.1,
+                    )
+                    vertex_pair2edge[vertex_pair] = edge
+
+                loop = BMLoop(face_index*3 + k, self.verts[vi0], edge, face)
+                edge_loops.setdefault(edge.index, []).append(loop)
+                loops.append(loop)
+
+            for k, loop in enumerate(loops):
+                loop.link_loop_next = loops[(k+1) % 3]
+                loop.link_loop_prev = loops[(k+2) % 3]
+            self.tri_loops.append(loops)
+
+        for loops in edge_loops.values():
+            for i, loop in enumerate(loops):
+                loop.link_loop_radial_next = loops[(i+1) % len(loops)]
+
+        self.edges = sorted(vertex_pair2edge.values(), key=lambda e: e.index)
+
+        # a few groups and coarse weights, so that the heaviest vertex group has ties
+        self.vi2vgi2weights: Dict[int, Dict[int, float]] = {
+            vert.index: {
+                vgi: rng.choice((0.25, 0.5, 1.0))
+                for vgi in rng.sample(range(4), rng.randint(0, 3))
+            }
+            for vert in self.verts
+        }
+        for vert in self.verts:
+            vert.deform = self.vi2vgi2weights[vert.index]
+
+    def to_bmesh(self) -> types.SimpleNamespace:
+        return types.SimpleNamespace(verts=BMVertSeq(self.verts))
+
+    def to_mesh(self) -> types.SimpleNamespace:
+        def to_normal(loops: List[BMLoop]) -> np.ndarray:
+            v0, v1, v2 = (loop.vert.co.xyz for loop in loops)
+            normal = np.cross(v1 - v0, v2 - v0)
+            return (normal / np.linalg.norm(normal)).astype(np.float32)
+
+        return types.SimpleNamespace(
+            polygons=MeshCollection([
+                {
+                    'loop_total': 3,
+                    'loop_start': loops[0].index,
+                    'select': face.select,
+                    'material_index': face.material_index,
+                    'normal': to_normal(loops),
+                }
+                for face, loops in zip(self.faces, self.tri_loops)
+            ]),
+            loops=MeshCollection([
+                {'vertex_index': loop.vert.index, 'edge_index': loop.edge.index}
+                for loops in self.tri_loops for loop in loops
+            ]),
+            edges=MeshCollection([
+                {'use_edge_sharp': not edge.smooth, 'use_seam': edge.seam}
+                for edge in self.edges
+            ]),
+            vertices=MeshCollection([
+                {'co': vert.co.xyz.astype(np.float32)}
+                for vert in self.verts
+            ]),
+        )
+
+
+@pytest.fixture
+def segmentation(load_module):
+    return load_module('editors/segmentation.py', {
+        'bmesh': {'types': _TypeNamespace()},
+        'bpy': {'types': _TypeNamespace()},
+        'mathutils': {'Vector': Vector, 'geometry': types.SimpleNamespace(area_tri=area_tri)},
+        'mmd_uuunyaa_tools.m17n': {'_': lambda text: text},
+    })
+
+
+@pytest.mark.parametrize('count', [1, 2, 3, 4, 15, 16, 17, 63, 64, 100, 255, 256])
+def test_pair_ids_do_not_collide(segmentation, count):
+    pair_id_shift = segmentation._to_pair_id_shift(count)  # pylint: disable=protected-access
+    verts = [BMVert(i, None) for i in range(count + 1)]
+
+    # the segment ids start at 1, the indices of the vertices and the loops at 0
+    pair_ids = {
+        segmentation._to_vertex_pair_id(verts[i], verts[j], pair_id_shift): (i, j)  # pylint: disable=protected-access
+        for i in range(count + 1)
+        for j in range(i, count + 1)
+    }
+    assert len(pair_ids) == (count + 1) * (count + 2) // 2
+
+    # the order of the pair does not matter
+    assert segmentation._to_vertex_pair_id(verts[count], verts[0], pair_id_shift) == segmentation._to_vertex_pair_id(verts[0], verts[count], pair_id_shift)  # pylint: disable=protected-access
+
+
+@pytest.mark.parametrize('seed', range(8))
+@pytest.mark.parametrize('contact_length_factor, perimeter_cost_factor', [(1.0, 0.0), (0.5, 1.0), (0.0, 0.5)])
+def test_batched_contacts_match_bmesh_contacts(segmentation, seed, contact_length_factor, perimeter_cost_factor):
+    test_mesh = GridMesh(seed)
+    cost_factors = (
+        contact_length_factor,
+        1.0,  # face angle
+        perimeter_cost_factor,
+        1.0,  # vertex group weight
+        1.0,  # vertex group change
+        1.0,  # material change
+        1.0,  # edge sharp
+        1.0,  # edge seam
+    )
+
+    expected_contacts, expected_segment_count = segmentation._calc_segment_contacts(  # pylint: disable=protected-access
+        *cost_factors, test_mesh.vi2vgi2weights, types.SimpleNamespace(verts=test_mesh.verts), test_mesh.tri_loops
+    )
+    actual_contacts, actual_segment_count = segmentation._calc_segment_contacts_batched(  # pylint: disable=protected-access
+        *cost_factors, segmentation._read_vertex_group_weights(test_mesh.to_bmesh(), set()), test_mesh.to_mesh(), test_mesh.tri_loops  # pylint: disable=protected-access
+    )
+
+    assert actual_segment_count == expected_segment_count
+    assert list(actual_contacts.keys()) == list(expected_contacts.keys())
+
+    for sci, expected in expected_contacts.items():
+        actual = actual_contacts[sci]
+
+        # the same segment ids, so the merge engines see the same tie-breaks
+        assert (actual.segment0.index, actual.segment1.index) == (expected.segment0.index, expected.segment1.index)
+        assert actual.segment0.tri_loop0s == expected.segment0.tri_loop0s
+        assert actual.segment_contacts(expected.segment1)
+
+        # the normals are float32 in the mesh, the costs agree to the float32 precision
+        assert actual.length == pytest.approx(expected.length, rel=1e-9)
+        assert actual.cost == pytest.approx(expected.cost, rel=1e-5, abs=1e-6)
+        assert actual.cost_normalized == pytest.approx(expected.cost_normalized, rel=1e-5, abs=1e-6)
+
+        for actual_segment, expected_segment in ((actual.segment0, expected.segment0), (actual.segment1, expected.segment1)):
+            assert actual_segment.area == pytest.approx(expected_segment.area, rel=1e-9)
+            assert actual_segment.perimeter == pytest.approx(expected_segment.perimeter, rel=1e-9)
+            assert actual_segment.non_contact_perimeter == pytest.approx(expected_segment.non_contact_perimeter, rel=1e-9, abs=1e-9)
+            assert actual_segment.segment_contact_ids == expected_segment.segment_contact_ids
+
+
+def test_batched_contacts_fall_back_for_non_triangle_faces(segmentation):
+    test_mesh = GridMesh(0)
+    mesh = test_mesh.to_mesh()
+    mesh.polygons.foreach_get = lambda attribute, array: array.fill(4 if attribute == 'loop_total' else 0)
+
+    assert segmentation._calc_segment_contacts_batched(  # pylint: disable=protected-access
+        1.0, 1.0, 0.0, 1.0, 1.0, 1.0, 1.0, 1.0, segmentation._read_vertex_group_weights(test_mesh.to_bmesh(), set()), mesh, test_mesh.tri_loops  # pylint: disable=protected-access
+    ) is None
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_vertex_group_weights_keep_the_group_order(segmentation, seed):
+    test_mesh = GridMesh(seed)
+    ignore_vertex_group_indices = {1}
+    expected = {
+        vi: [(vgi, weight) for vgi, weight in vgi2weights.items() if vgi not in ignore_vertex_group_indices]
+        for vi, vgi2weights in test_mesh.vi2vgi2weights.items()
+    }
+
+    vertex_group_weights = segmentation._read_vertex_group_weights(test_mesh.to_bmesh(), ignore_vertex_group_indices)  # pylint: disable=protected-access
+    vi2vgi2weights = segmentation._calc_vi2vgi2weights(test_mesh.to_bmesh(), vertex_group_weights)  # pylint: disable=protected-access
+    assert {vi: list(vgi2weights.items()) for vi, vgi2weights in vi2vgi2weights.items()} == expected
+
+    # the vertices in reverse order are packed back in the group order of each vertex
+    reversed_weights = vertex_group_weights[np.argsort(-vertex_group_weights['vertex_index'], kind='stable')]
+    vertex_group_indices, weights = segmentation._to_vertex_group_arrays(reversed_weights, len(test_mesh.verts))  # pylint: disable=protected-access
+    assert vertex_group_indices.shape[1] == max(len(items) for items in expected.values())
+    for vi, items in expected.items():
+        column_count = len(items)
+        assert list(zip(vertex_group_indices[vi, :column_count].tolist(), weights[vi, :column_count].tolist())) == items
+        assert np.all(vertex_group_indices[vi, column_count:] == -1)
+        assert np.all(weights[vi, column_count:] == 0.0)
+
+
+def test_vertex_group_weight_costs_do_not_depend_on_the_chunk_size(segmentation):
+    test_mesh = GridMesh(0, size=16)
+    vertex_group_weights = segmentation._read_vertex_group_weights(test_mesh.to_bmesh(), set())  # pylint: disable=protected-access
+    vertex_group_indices, weights = segmentation._to_vertex_group_arrays(vertex_group_weights, len(test_mesh.verts))  # pylint: disable=protected-access
+    rng = np.random.default_rng(0)
+    vertex_indices0 = rng.integers(0, len(test_mesh.verts), 1000)
+    vertex_indices1 = rng.integers(0, len(test_mesh.verts), 1000)
+
+    # the weights of the groups both vertices have are counted from each side, as _calc_segment_contacts does
+    expected = [
+        sum(abs(weight0 - vgi2weights1.get(vgi0, 0.0)) for vgi0, weight0 in vgi2weights0.items())
+        + sum(abs(weight1 - vgi2weights0.get(vgi1, 0.0)) for vgi1, weight1 in vgi2weights1.items())
+        for vgi2weights0, vgi2weights1 in (
+            (test_mesh.vi2vgi2weights[vi0], test_mesh.vi2vgi2weights[vi1])
+            for vi0, vi1 in zip(vertex_indices0.tolist(), vertex_indices1.tolist())
+        )
+    ]
+    for chunk_element_count in (1, 100, 1 << 20):
+        assert segmentation._calc_vertex_group_weight_costs(  # pylint: disable=protected-access
+            vertex_indices0, vertex_indices1, vertex_group_indices, weights, chunk_element_count
+        ) == pytest.approx(expected)
+
+
+def to_merge_result(merge_result) -> tuple:
+    segments, cost_sorted_segment_contacts, last_merged_cost = merge_result
+    return (
+        # in the iteration order, the colors are assigned in this order
+        [(s.index, s.area, s.perimeter, sorted(loop.index for loop in s.tri_loop0s)) for s in segments],
+        [(sc.index, sc.cost, sc.cost_normalized, sc.length, sc.segment0.index, sc.segment1.index) for sc in cost_sorted_segment_contacts],
+        last_merged_cost,
+    )
+
+
+@pytest.mark.parametrize('seed', range(10))
+@pytest.mark.parametrize('select_ratio, duplicate_count', [(0.9, 0), (0.6, 0), (0.8, 12)])
+@pytest.mark.parametrize('cost_threshold, maximum_area_threshold, minimum_area_threshold, contact_length_factor, perimeter_cost_factor', [
+    (1.0, 4.0, 0.5, 1.0, 0.0),
+    (2.0, 6.0, 0.0, 1.0, 1.0),
+    (float('inf'), 3.0, 0.3, 0.0, 0.5),
+    (0.8, float('inf'), float('inf'), 0.5, 0.0),
+])
+def test_heap_engine_merges_like_scan_engine(
+    segmentation, seed, select_ratio, duplicate_count,
+    cost_threshold, maximum_area_threshold, minimum_area_threshold, contact_length_factor, perimeter_cost_factor
+):
+    # pylint: disable=too-many-arguments
+    merge_results = []
+    for merge_segment_contacts in (segmentation._merge_segment_contacts_by_scan, segmentation._merge_segment_contacts_by_heap):  # pylint: disable=protected-access
+        # the merge engines modify the contacts and the segments
+        test_mesh = GridMesh(seed, select_ratio=select_ratio, duplicate_count=duplicate_count)
+        sci2segment_contacts, segment_count = segmentation._calc_segment_contacts(  # pylint: disable=protected-access
+            contact_length_factor, 1.0, perimeter_cost_factor, 1.0, 1.0, 1.0, 1.0, 1.0,
+            test_mesh.vi2vgi2weights, types.SimpleNamespace(verts=test_mesh.verts), test_mesh.tri_loops
+        )
+        merge_results.append(to_merge_result(merge_segment_contacts(
+            sci2segment_contacts, segment_count,
+            cost_threshold, maximum_area_threshold, minimum_area_threshold, contact_length_factor, perimeter_cost_factor,
+        )))
+
+    assert merge_results[1] == merge_results[0]
+
+
+def new_segment_contacts(segmentation, areas: Dict[int, float], contacts: List[Tuple[int, int, float]]):
+    segments = {i: segmentation.Segment(i, area=a, perimeter=1.0) for i, a in areas.items()}
+    sci2segment_contacts = {}
+    for sci, (si0, si1, cost) in enumerate(contacts):
+        sci2segment_contacts[sci] = segmentation.SegmentContact(sci, cost, cost, 1.0, segments[si0], segments[si1])
+        segments[si0].segment_contact_ids.add(sci)
+        segments[si1].segment_contact_ids.add(sci)
+    return sci2segment_contacts, len(segments)
+
+
+# the small segments 5-10 are chained by the expensive contacts, merging them does not isolate anything
+_CHAINED_CONTACTS = [(5, 6, 0.2), (7, 8, 0.3), (9, 10, 0.4), (6, 7, 5.0), (8, 9, 5.0), (10, 5, 5.0)]
+
+
+@pytest.mark.parametrize('areas, contacts, last_merged_cost', [
+    # the merge of 1 and 2 removes the blocked parallel contact before it, the scan skips two contacts
+    (
+        {1: 1.0, 2: 0.1, 5: 0.1, 6: 0.1, 7: 0.1, 8: 0.1, 9: 0.1, 10: 0.1},
+        [(2, 1, 0.05), (1, 2, 0.1)] + _CHAINED_CONTACTS,
+        0.3,
+    ),
+    # the second pass isolates 3 and 4, the scan skips the contact of 11 and 12 known to be blocked
+    (
+        {1: 0.1, 2: 0.1, 3: 0.1, 4: 0.1, 5: 0.1, 6: 0.1, 7: 0.1, 8: 0.1, 9: 0.1, 10: 0.1, 11: 1.0, 12: 1.0},
+        [(1, 2, 0.1), (3, 4, 0.12), (11, 12, 0.15)] + _CHAINED_CONTACTS,
+        0.4,
+    ),
+])
+def test_heap_engine_skips_like_scan_engine_after_isolation(segmentation, areas, contacts, last_merged_cost):
+    merge_results = []
+    for merge_segment_contacts in (segmentation._merge_segment_contacts_by_scan, segmentation._merge_segment_contacts_by_heap):  # pylint: disable=protected-access
+        sci2segment_contacts, segment_count = new_segment_contacts(segmentation, areas, contacts)
+        merge_results.append(to_merge_result(merge_segment_contacts(sci2segment_contacts, segment_count, 1.0, 1.05, 0.5, 0.0, 0.0)))
+
+    assert merge_results[0][2] == last_merged_cost
+    assert merge_results[1] == merge_results[0]